@@ -0,0 +1,184 @@
+# Tabela de agregados do IDEB por município.
+# Calcula, UMA VEZ por conjunto de dados e para todo o Brasil (~5.570 municípios),
+# média, contagem e desvio padrão de 'ideb', 'nota_matem' e 'nota_portugues'
+# em uma única passada de groupby().agg(). A tabela é indexada por 'cod_mun'
+# e unida às geometrias com um único join alinhado pelo índice.
+#
+# Para arquivos grandes (ou vários anos), a tabela também pode ser montada em streaming:
+# o TXT é lido em blocos, cada bloco é limpo com as mesmas regras do painel e somado
+# a acumuladores de soma, contagem e soma dos quadrados por município. A memória de pico
+# fica proporcional ao número de municípios, não ao de escolas.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/agregados_ideb.py mapa_ideb_2021/ideb_escola_2021.txt --saida agregados.parquet
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import ingestao_ideb
+
+# Coluna de origem -> sufixo usado nas colunas agregadas (media_mat, contagem_mat, desvio_mat, ...)
+METRICAS = {
+    'nota_matem': 'mat',
+    'nota_portugues': 'por',
+    'ideb': 'ideb',
+}
+
+# Estatística do pandas -> prefixo da coluna agregada
+ESTATISTICAS = {
+    'mean': 'media',
+    'count': 'contagem',
+    'std': 'desvio',
+}
+
+
+def nomes_colunas_agregadas():
+    """Retorna os nomes das colunas produzidas por calcular_agregados_municipios, na ordem."""
+    return [f"{prefixo}_{sufixo}" for sufixo in METRICAS.values() for prefixo in ESTATISTICAS.values()]
+
+
+def calcular_agregados_municipios(df_ideb):
+    """
+    Calcula média, contagem e desvio padrão das notas por município em uma única passada.
+    Retorna um DataFrame indexado por 'cod_mun' com as colunas media_*, contagem_* e desvio_*.
+    """
+    agregados = df_ideb.groupby('cod_mun', sort=True)[list(METRICAS)].agg(list(ESTATISTICAS))
+    agregados.columns = [f"{ESTATISTICAS[estat]}_{METRICAS[col]}" for col, estat in agregados.columns]
+    agregados = agregados[nomes_colunas_agregadas()]
+
+    # Médias e desvios em float64 (a soma em float32 perde precisão), contagens como inteiros
+    for col in agregados.columns:
+        if col.startswith('contagem_'):
+            agregados[col] = agregados[col].astype('int32')
+        else:
+            agregados[col] = agregados[col].astype('float64')
+    agregados.index = agregados.index.astype('Int64')
+    agregados.index.name = 'cod_mun'
+    return agregados
+
+
+def juntar_agregados_geometria(muni_gdf, agregados, coluna_codigo='code_muni'):
+    """
+    Une a tabela de agregados às geometrias dos municípios com um único join
+    alinhado pelo índice (left join: municípios sem dados do IDEB ficam com NaN).
+    """
+    chave = muni_gdf[coluna_codigo].astype('Int64')
+    muni_notas_gdf = muni_gdf.copy()
+    dados = agregados.reindex(chave.to_numpy())
+    for col in agregados.columns:
+        muni_notas_gdf[col] = dados[col].to_numpy()
+    # Municípios sem escolas com IDEB têm contagem 0
+    for col in agregados.columns:
+        if col.startswith('contagem_'):
+            muni_notas_gdf[col] = muni_notas_gdf[col].fillna(0).astype('int32')
+    return muni_notas_gdf
+
+
+# --- Agregação em streaming (memória proporcional ao número de municípios) ---
+
+TAMANHO_BLOCO_PADRAO = 200_000
+
+
+def nomes_colunas_acumuladores():
+    """Colunas dos acumuladores: soma_*, soma_quad_* e contagem_* de cada métrica."""
+    return [f"{prefixo}_{sufixo}" for sufixo in METRICAS.values() for prefixo in ('soma', 'soma_quad', 'contagem')]
+
+
+def acumular_bloco(bloco, colunas_chave=('cod_mun',)):
+    """
+    Soma, soma dos quadrados e contagem de valores válidos por município em um bloco já limpo.
+    Retorna um DataFrame indexado por 'cod_mun' com as colunas de nomes_colunas_acumuladores().
+    Com mais 'colunas_chave' (ex: cod_mun e rede, no cubo_ideb.py), o índice tem um nível por coluna.
+    """
+    valores = bloco[list(METRICAS)].astype('float64')
+    chave = [bloco[col].to_numpy() for col in colunas_chave] if len(colunas_chave) > 1 else bloco[colunas_chave[0]].to_numpy()
+    somas = valores.groupby(chave).sum()
+    somas_quad = (valores * valores).groupby(chave).sum()
+    contagens = valores.notna().groupby(chave).sum()
+
+    acumuladores = pd.DataFrame(index=somas.index)
+    for col, sufixo in METRICAS.items():
+        acumuladores[f"soma_{sufixo}"] = somas[col]
+        acumuladores[f"soma_quad_{sufixo}"] = somas_quad[col]
+        acumuladores[f"contagem_{sufixo}"] = contagens[col].astype('float64')
+    acumuladores.index.names = list(colunas_chave)
+    return acumuladores[nomes_colunas_acumuladores()]
+
+
+def combinar_acumuladores(*lista_acumuladores):
+    """Soma acumuladores parciais (de blocos, arquivos ou anos diferentes)."""
+    resultado = None
+    for acumuladores in lista_acumuladores:
+        if acumuladores is None:
+            continue
+        resultado = acumuladores if resultado is None else resultado.add(acumuladores, fill_value=0)
+    return resultado
+
+
+def acumular_arquivo(caminho_arquivo, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    """
+    Lê um TXT do IDEB em blocos e devolve os acumuladores por município.
+    Se o arquivo não for utf-8, o erro só aparece no meio da leitura: nesse caso
+    os blocos já somados são descartados e o arquivo é relido como latin-1.
+    """
+    for encoding in ('utf-8', 'latin-1'):
+        try:
+            acumuladores = None
+            for bloco in ingestao_ideb.ler_txt_ideb(caminho_arquivo, chunksize=tamanho_bloco, encoding_inicial=encoding):
+                bloco = ingestao_ideb.limpar_dados_ideb(bloco)
+                acumuladores = combinar_acumuladores(acumuladores, acumular_bloco(bloco))
+            return acumuladores
+        except UnicodeDecodeError:
+            if encoding == 'latin-1':
+                raise
+    return None
+
+
+def finalizar_acumuladores(acumuladores):
+    """
+    Converte acumuladores em média, contagem e desvio padrão amostral (como o pandas .std()),
+    no mesmo formato de calcular_agregados_municipios.
+    """
+    agregados = pd.DataFrame(index=acumuladores.index.astype('Int64'))
+    agregados.index.name = 'cod_mun'
+    for sufixo in METRICAS.values():
+        soma = acumuladores[f"soma_{sufixo}"].to_numpy()
+        soma_quad = acumuladores[f"soma_quad_{sufixo}"].to_numpy()
+        n = acumuladores[f"contagem_{sufixo}"].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            media = np.where(n > 0, soma / n, np.nan)
+            variancia = np.where(n > 1, (soma_quad - soma * soma / n) / (n - 1), np.nan)
+        agregados[f"media_{sufixo}"] = media
+        agregados[f"contagem_{sufixo}"] = n.astype('int32')
+        # Erros de arredondamento podem deixar a variância levemente negativa
+        agregados[f"desvio_{sufixo}"] = np.sqrt(np.clip(variancia, 0, None))
+    return agregados[nomes_colunas_agregadas()]
+
+
+def agregar_arquivos_em_blocos(caminhos, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    """Agrega um ou mais arquivos TXT do IDEB sem manter as linhas das escolas em memória."""
+    acumuladores = combinar_acumuladores(*(acumular_arquivo(c, tamanho_bloco) for c in caminhos))
+    if acumuladores is None:
+        return None
+    return finalizar_acumuladores(acumuladores.sort_index())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agrega arquivos ideb_escola_*.txt por município, em blocos.")
+    parser.add_argument('arquivos', nargs='+', help="Arquivos TXT do IDEB (delimitados por tabulação).")
+    parser.add_argument('--saida', required=True, help="Arquivo Parquet de saída com os agregados.")
+    parser.add_argument('--tamanho-bloco', type=int, default=TAMANHO_BLOCO_PADRAO, help="Linhas lidas por bloco.")
+    args = parser.parse_args()
+
+    agregados = agregar_arquivos_em_blocos(args.arquivos, args.tamanho_bloco)
+    if agregados is None:
+        print("Nenhum dado válido encontrado.")
+        return
+    agregados.to_parquet(args.saida, engine='pyarrow')
+    print(f"{len(agregados)} municípios agregados salvos em '{args.saida}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# Autocorrelação espacial das notas por município: I de Moran global e agrupamentos locais (LISA).
+# A vizinhança (contiguidade) dos municípios é calculada UMA vez por ano das geometrias, para o
+# Brasil inteiro, com um índice espacial STRtree: cada polígono é comparado só com os que
+# cruzam o seu retângulo envolvente, em vez de todos os pares (O(n²)). O resultado é uma matriz
+# esparsa (CSR) gravada em '<pasta>/vizinhanca_municipios_br_<ano>_<tipo>.npz', com os códigos
+# dos municípios e a versão das geometrias de origem (recalculada se a origem mudar).
+#
+# Tipos de contiguidade:
+#   'queen' (rainha): vizinhos que têm ao menos um ponto da fronteira em comum;
+#   'rook' (torre): vizinhos que têm um trecho de fronteira (linha) em comum.
+#
+# As estatísticas usam a matriz padronizada por linha (cada vizinho pesa 1/k) e são calculadas
+# com produtos esparsos vetorizados, inclusive as permutações da inferência: os valores são
+# embaralhados P vezes de uma só vez (matriz n x P) e a defasagem espacial das P permutações é
+# um único produto W @ Z. As permutações embaralham todos os valores (inclusive o do próprio
+# município), uma aproximação da permutação condicional que tem efeito desprezível exceto em
+# estados com muito poucos municípios. Municípios sem vizinhos (ilhas) ou sem valor ficam fora.
+#
+# O scipy (matrizes esparsas) só é necessário para a análise: sem ele, o módulo é importado
+# normalmente e o painel não oferece os agrupamentos espaciais.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/analise_espacial.py mapa_ideb_2021/dados_geoespaciais 2020 --tipo queen
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+import armazem_compartilhado
+import fontes_geometria
+
+TIPOS_CONTIGUIDADE = {
+    'queen': 'Rainha (fronteira ou vértice em comum)',
+    'rook': 'Torre (trecho de fronteira em comum)',
+}
+TIPO_PADRAO = 'queen'
+
+# Quadrantes do diagrama de Moran (valor do município x média dos vizinhos)
+CLASSES_LISA = {
+    'AA': 'Alto-Alto',
+    'BB': 'Baixo-Baixo',
+    'AB': 'Alto-Baixo',
+    'BA': 'Baixo-Alto',
+    'NS': 'Não significativo',
+}
+PERMUTACOES = 999
+SIGNIFICANCIA = 0.05
+SEMENTE = 2021 # Permutações reprodutíveis: o mesmo resultado em cada processo e no cache
+
+
+def calcular_contiguidade(geometrias, tipo=TIPO_PADRAO):
+    """
+    Matriz de contiguidade binária e simétrica (CSR n x n) entre os polígonos de 'geometrias'.
+    Os pares candidatos vêm de uma consulta em lote ao STRtree; só eles são testados.
+    """
+    if tipo not in TIPOS_CONTIGUIDADE:
+        raise ValueError(f"Tipo de contiguidade desconhecido: '{tipo}' (use {', '.join(TIPOS_CONTIGUIDADE)}).")
+    geometrias = np.asarray(geometrias, dtype=object)
+    n = len(geometrias)
+    shapely.prepare(geometrias)
+    origem, destino = shapely.STRtree(geometrias).query(geometrias, predicate='intersects')
+    unicos = origem < destino # Cada par uma vez, sem o próprio polígono
+    origem, destino = origem[unicos], destino[unicos]
+    if tipo == 'rook':
+        # Fronteiras que se cruzam em uma linha (dimensão 1), não só em pontos
+        lado = shapely.relate_pattern(geometrias[origem], geometrias[destino], '****1****')
+        origem, destino = origem[lado], destino[lado]
+    linhas = np.concatenate([origem, destino])
+    colunas = np.concatenate([destino, origem])
+    return sparse.csr_matrix((np.ones(len(linhas), dtype='int8'), (linhas, colunas)), shape=(n, n))
+
+
+class Vizinhanca:
+    """Matriz de contiguidade com os códigos dos municípios de cada linha/coluna."""
+
+    def __init__(self, codigos, matriz, tipo=TIPO_PADRAO):
+        self.codigos = np.asarray(codigos, dtype='int64')
+        self.matriz = matriz.tocsr()
+        self.tipo = tipo
+
+    @classmethod
+    def de_geometrias(cls, codigos, geometrias, tipo=TIPO_PADRAO):
+        return cls(codigos, calcular_contiguidade(geometrias, tipo), tipo)
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def numero_vizinhos(self):
+        return np.diff(self.matriz.indptr)
+
+    def subconjunto(self, codigos):
+        """
+        Vizinhança restrita a 'codigos' (na ordem dada), ex: os municípios de um estado.
+        Vizinhos fora do subconjunto são descartados; códigos desconhecidos ficam sem vizinhos.
+        """
+        codigos = np.asarray(codigos, dtype='int64')
+        posicoes = pd.Index(self.codigos).get_indexer(codigos)
+        conhecidos = posicoes >= 0
+        # Seleção das linhas e colunas por uma matriz de projeção esparsa (sem densificar)
+        projecao = sparse.csr_matrix(
+            (np.ones(conhecidos.sum(), dtype='int8'), (np.flatnonzero(conhecidos), posicoes[conhecidos])),
+            shape=(len(codigos), len(self.codigos)),
+        )
+        return Vizinhanca(codigos, projecao @ self.matriz @ projecao.T, self.tipo)
+
+
+def caminho_vizinhanca(pasta, ano, tipo=TIPO_PADRAO):
+    return os.path.join(pasta, f"vizinhanca_municipios_br_{ano}_{tipo}.npz")
+
+
+def gravar_vizinhanca(vizinhanca, caminho, versao_geometrias):
+    """Grava a matriz (CSR), os códigos e a versão das geometrias; escrita atômica."""
+    caminho_tmp = f"{caminho}.tmp-{os.getpid()}.npz"
+    matriz = vizinhanca.matriz
+    np.savez_compressed(
+        caminho_tmp, codigos=vizinhanca.codigos, indptr=matriz.indptr, indices=matriz.indices,
+        tipo=np.array(vizinhanca.tipo), versao=np.array(versao_geometrias),
+    )
+    os.replace(caminho_tmp, caminho)
+
+
+def ler_vizinhanca(caminho, versao_geometrias=None):
+    """Lê a vizinhança gravada; None se não existir ou se foi calculada de outras geometrias."""
+    if not os.path.exists(caminho):
+        return None
+    with np.load(caminho) as arquivo:
+        if versao_geometrias is not None and str(arquivo['versao']) != versao_geometrias:
+            return None
+        n = len(arquivo['codigos'])
+        matriz = sparse.csr_matrix(
+            (np.ones(len(arquivo['indices']), dtype='int8'), arquivo['indices'], arquivo['indptr']), shape=(n, n))
+        return Vizinhanca(arquivo['codigos'], matriz, str(arquivo['tipo']))
+
+
+def vizinhanca_municipios(fonte, pasta, ano, tipo=TIPO_PADRAO, ler_municipios=None):
+    """
+    Vizinhança de todos os municípios do Brasil: lida de '<pasta>/vizinhanca_municipios_br_<ano>_<tipo>.npz'
+    ou calculada a partir das geometrias da fonte (e gravada, se a pasta permitir escrita).
+    'ler_municipios()', se informado, substitui a leitura da fonte (ex: armazém já mapeado).
+    """
+    caminho = caminho_vizinhanca(pasta, ano, tipo)
+    versao = armazem_compartilhado.versao_geometrias(fonte, 'municipios', ano)
+    vizinhanca = ler_vizinhanca(caminho, versao)
+    if vizinhanca is not None:
+        return vizinhanca
+    municipios_gdf = ler_municipios() if ler_municipios is not None else fonte.ler('municipios', ano)
+    vizinhanca = Vizinhanca.de_geometrias(municipios_gdf['code_muni'], municipios_gdf.geometry.values, tipo)
+    if os.access(pasta, os.W_OK):
+        gravar_vizinhanca(vizinhanca, caminho, versao)
+    return vizinhanca
+
+
+def padronizar_linhas(matriz):
+    """Pesos padronizados por linha (cada vizinho pesa 1/k); linhas sem vizinhos ficam zeradas."""
+    k = np.diff(matriz.indptr)
+    pesos = np.repeat(1.0 / np.maximum(k, 1), k)
+    return sparse.csr_matrix((pesos, matriz.indices, matriz.indptr), shape=matriz.shape)
+
+
+def autocorrelacao_espacial(valores, vizinhanca, permutacoes=PERMUTACOES, significancia=SIGNIFICANCIA, semente=SEMENTE):
+    """
+    I de Moran global e LISA (I de Moran local) dos 'valores' (um por município de 'vizinhanca',
+    na mesma ordem; NaN = sem dado). Retorna (global, locais):
+      global: {'moran_i', 'esperado', 'p_valor', 'n'} (None se houver menos de 3 municípios com vizinhos);
+      locais: DataFrame indexado pelo código do município com 'lisa_i', 'p_valor' e 'classe'
+              (chave de CLASSES_LISA; 'NS' também para municípios sem valor ou sem vizinhos).
+    Os p-valores são pseudo p-valores de 'permutacoes' permutações aleatórias.
+    """
+    valores = np.asarray(valores, dtype='float64')
+    lisa_todos = np.full(len(valores), np.nan)
+    p_todos = np.full(len(valores), np.nan)
+    classes_todos = np.full(len(valores), 'NS', dtype=object)
+
+    def montar_locais():
+        return pd.DataFrame({'lisa_i': lisa_todos, 'p_valor': p_todos, 'classe': classes_todos},
+                            index=pd.Index(vizinhanca.codigos, name='code_muni'))
+
+    # Só municípios com valor; quem fica sem vizinhos depois disso também sai
+    validos = np.flatnonzero(~np.isnan(valores))
+    subconjunto = vizinhanca.subconjunto(vizinhanca.codigos[validos])
+    com_vizinhos = subconjunto.numero_vizinhos() > 0
+    validos = validos[com_vizinhos]
+    n = len(validos)
+    if n < 3:
+        return None, montar_locais()
+    pesos = padronizar_linhas(subconjunto.matriz[com_vizinhos][:, com_vizinhos])
+    s0 = pesos.sum()
+
+    z = valores[validos] - valores[validos].mean()
+    soma_quadrados = z @ z
+    if soma_quadrados == 0: # Todos os valores iguais: sem variação para correlacionar
+        return None, montar_locais()
+    defasagem = pesos @ z
+    moran_i = n / s0 * (z @ defasagem) / soma_quadrados
+    lisa_i = z * defasagem / (soma_quadrados / n)
+
+    # P permutações de uma vez: cada coluna de Z é um embaralhamento de z
+    gerador = np.random.default_rng(semente)
+    permutados = gerador.permuted(np.broadcast_to(z[:, None], (n, permutacoes)), axis=0)
+    defasagens = pesos @ permutados
+    moran_perm = n / s0 * np.einsum('ij,ij->j', permutados, defasagens) / soma_quadrados
+    lisa_perm = z[:, None] * defasagens / (soma_quadrados / n)
+
+    def pseudo_p_valor(maiores):
+        # Unicaudal na direção observada (como no PySAL)
+        return (np.minimum(maiores, permutacoes - maiores) + 1) / (permutacoes + 1)
+
+    p_global = pseudo_p_valor((moran_perm >= moran_i).sum())
+    p_locais = pseudo_p_valor((lisa_perm >= lisa_i[:, None]).sum(axis=1))
+
+    classes = np.select(
+        [(z > 0) & (defasagem > 0), (z < 0) & (defasagem < 0), (z > 0) & (defasagem < 0), (z < 0) & (defasagem > 0)],
+        ['AA', 'BB', 'AB', 'BA'], default='NS',
+    )
+    classes[p_locais > significancia] = 'NS'
+    lisa_todos[validos], p_todos[validos], classes_todos[validos] = lisa_i, p_locais, classes
+    return {'moran_i': float(moran_i), 'esperado': -1.0 / (n - 1), 'p_valor': float(p_global), 'n': n}, montar_locais()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula e grava a vizinhança (contiguidade) dos municípios do Brasil.")
+    parser.add_argument('pasta', help="Pasta com os arquivos municipios_br_<ano>.*")
+    parser.add_argument('ano', type=int)
+    parser.add_argument('--tipo', choices=list(TIPOS_CONTIGUIDADE), default=TIPO_PADRAO)
+    parser.add_argument('--fonte-geo', help="Fonte das geometrias (padrão: arquivos da pasta ou geobr; ver fontes_geometria.py)")
+    args = parser.parse_args()
+    if sparse is None:
+        parser.error("o pacote 'scipy' é necessário (pip install scipy).")
+
+    fonte = fontes_geometria.escolher_fonte(args.pasta, args.ano, args.fonte_geo)
+    caminho = caminho_vizinhanca(args.pasta, args.ano, args.tipo)
+    if not os.access(args.pasta, os.W_OK):
+        parser.error(f"Sem permissão de escrita em '{args.pasta}'.")
+    if os.path.exists(caminho):
+        os.remove(caminho) # Recalcula sempre pela linha de comando
+    inicio = time.perf_counter()
+    vizinhanca = vizinhanca_municipios(fonte, args.pasta, args.ano, args.tipo)
+    k = vizinhanca.numero_vizinhos()
+    print(f"{len(vizinhanca)} municípios, {k.sum() // 2} pares de vizinhos ({args.tipo}), "
+          f"média de {k.mean():.1f} vizinhos, {(k == 0).sum()} sem vizinhos; {time.perf_counter() - inicio:.1f} s")
+    print(f"Vizinhança gravada em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
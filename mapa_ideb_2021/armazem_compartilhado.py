@@ -0,0 +1,256 @@
+# Armazém compacto dos dados do painel em arquivos Arrow IPC mapeados em memória.
+# O st.cache_data guarda uma cópia serializada dos DataFrames em cada processo do Streamlit e
+# devolve uma cópia nova a cada acerto de cache. Aqui cada tabela é gravada UMA vez no formato
+# Arrow (sem compressão), com tipos compactos:
+#   - textos repetidos (UF, nome do município da escola) como dicionário (categorias);
+#   - inteiros (inclusive códigos gravados como float) em int32 e notas em float32;
+#   - geometrias em WKB (binário), decodificadas só para as linhas pedidas;
+# e ordenada por UF, com o início e o fim das linhas de cada estado nos metadados.
+# Cada processo mapeia o arquivo somente leitura (pyarrow.memory_map): as colunas numéricas
+# viram DataFrames sem cópia e as páginas do arquivo ficam no cache do sistema operacional,
+# compartilhadas por todos os processos do servidor. Os frames devolvidos são somente leitura.
+#
+# O armazém é gravado na primeira leitura (ou pelo script abaixo) e regravado quando a
+# versão dos dados de origem muda. Se a pasta for somente leitura, as funções armazem_*
+# retornam None e quem chama lê os dados da forma habitual.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/armazem_compartilhado.py --ideb mapa_ideb_2021/ideb_escola_2021.txt \
+#       --geo mapa_ideb_2021/dados_geoespaciais 2020
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+import fontes_geometria
+import geometria_local
+import ingestao_ideb
+import particoes_uf
+
+VERSAO_FORMATO = 1
+EXTENSAO = 'arrow'
+CHAVE_METADADOS = b'armazem_ideb'
+# Colunas de texto com até esta fração de valores distintos viram categorias
+FRACAO_MAXIMA_CATEGORIAS = 0.5
+LIMITES_INT32 = (np.iinfo('int32').min, np.iinfo('int32').max)
+
+
+def _cabe_em_int32(valores):
+    return valores.size == 0 or (valores.min() >= LIMITES_INT32[0] and valores.max() <= LIMITES_INT32[1])
+
+
+def compactar_dataframe(df):
+    """
+    Retorna uma cópia de 'df' com tipos compactos: inteiros em int32 (Int32 se houver nulos),
+    floats de valores inteiros em int32, demais floats em float32 e textos repetidos em categorias.
+    As categorias já existentes são mantidas.
+    """
+    colunas = {}
+    for coluna in df.columns:
+        serie = df[coluna]
+        if isinstance(serie.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(serie):
+            colunas[coluna] = serie
+        elif pd.api.types.is_float_dtype(serie):
+            valores = serie.to_numpy(dtype='float64', na_value=np.nan)
+            if not np.isnan(valores).any() and np.array_equal(valores, np.round(valores)) and _cabe_em_int32(valores):
+                colunas[coluna] = serie.astype('int32') # Ex: code_muni lido do GeoJSON como float
+            else:
+                colunas[coluna] = serie.astype('float32')
+        elif pd.api.types.is_integer_dtype(serie):
+            validos = serie.dropna().to_numpy(dtype='int64')
+            if not _cabe_em_int32(validos):
+                colunas[coluna] = serie
+            else:
+                colunas[coluna] = serie.astype('Int32' if serie.isna().any() else 'int32')
+        elif pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie):
+            if serie.nunique(dropna=True) <= FRACAO_MAXIMA_CATEGORIAS * len(serie):
+                colunas[coluna] = serie.astype('category')
+            else:
+                colunas[coluna] = serie
+        else:
+            colunas[coluna] = serie
+    return pd.DataFrame(colunas, index=pd.RangeIndex(len(df)))
+
+
+def gravar_armazem(df, caminho, versao_dados, coluna_uf):
+    """
+    Grava 'df' (DataFrame ou GeoDataFrame) compactado e ordenado por 'coluna_uf' em um
+    arquivo Arrow IPC, de forma atômica. Retorna o caminho gravado.
+    """
+    coluna_geometria = df.geometry.name if hasattr(df, 'geometry') else None
+    crs = df.crs.to_json() if coluna_geometria and df.crs is not None else None
+
+    # Mesma ordenação estável do índice por UF do painel: cada estado fica contíguo
+    particoes = particoes_uf.ParticoesUF(df, coluna_uf)
+    limites_uf = {uf: particoes.limites(uf) for uf in particoes.ufs()}
+    dados = compactar_dataframe(particoes.df.drop(columns=[coluna_geometria] if coluna_geometria else []))
+    tabela = pa.Table.from_pandas(dados, preserve_index=False)
+    if coluna_geometria:
+        import shapely
+        wkb = shapely.to_wkb(np.asarray(particoes.df.geometry.array))
+        tabela = tabela.append_column(coluna_geometria, pa.array(wkb, type=pa.binary()))
+    metadados = {
+        'versao_formato': VERSAO_FORMATO,
+        'versao_dados': versao_dados,
+        'coluna_uf': coluna_uf,
+        'limites_uf': limites_uf,
+        'geometria': coluna_geometria,
+        'crs': crs,
+    }
+    metadados_schema = dict(tabela.schema.metadata or {})
+    metadados_schema[CHAVE_METADADOS] = json.dumps(metadados).encode('utf-8')
+    tabela = tabela.replace_schema_metadata(metadados_schema)
+
+    caminho_tmp = f"{caminho}.tmp-{os.getpid()}"
+    try:
+        with pa.OSFile(caminho_tmp, 'wb') as destino, pyarrow.ipc.new_file(destino, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+        # Processos que já mapearam a versão anterior continuam lendo o arquivo antigo
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+    return caminho
+
+
+class ArmazemMapeado:
+    """Tabela de um arquivo Arrow IPC mapeada em memória, somente leitura, com fatias por UF sem cópia."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.tabela = pyarrow.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+        self.metadados = json.loads((self.tabela.schema.metadata or {}).get(CHAVE_METADADOS, b'{}'))
+        self._limites_uf = {uf: tuple(limites) for uf, limites in self.metadados.get('limites_uf', {}).items()}
+
+    @property
+    def versao_dados(self):
+        return self.metadados.get('versao_dados')
+
+    @property
+    def bytes_mapeados(self):
+        return self.tabela.nbytes
+
+    def ufs(self):
+        return list(self._limites_uf)
+
+    def tabela_uf(self, uf=None):
+        """Tabela Arrow inteira ou só as linhas da UF (fatia sem cópia; vazia se a UF não existir)."""
+        if uf is None:
+            return self.tabela
+        inicio, fim = self._limites_uf.get(uf, (0, 0))
+        return self.tabela.slice(inicio, fim - inicio)
+
+    def dataframe(self, uf=None, colunas=None):
+        """
+        DataFrame das colunas pedidas (padrão: todas menos a geometria). As colunas numéricas
+        sem nulos apontam para o arquivo mapeado, sem cópia, e são somente leitura.
+        """
+        tabela = self.tabela_uf(uf)
+        if colunas is None:
+            colunas = [c for c in tabela.column_names if c != self.metadados.get('geometria')]
+        return tabela.select(colunas).to_pandas(split_blocks=True)
+
+    def geodataframe(self, uf=None):
+        """GeoDataFrame da UF (ou de tudo), decodificando o WKB apenas dessas linhas."""
+        import geopandas
+        import shapely
+        coluna_geometria = self.metadados.get('geometria')
+        if not coluna_geometria:
+            raise ValueError(f"O armazém '{self.caminho}' não tem coluna de geometria.")
+        df = self.dataframe(uf)
+        wkb = self.tabela_uf(uf).column(coluna_geometria).to_numpy(zero_copy_only=False)
+        return geopandas.GeoDataFrame(df, geometry=shapely.from_wkb(wkb), crs=self.metadados.get('crs'))
+
+
+def abrir_armazem(caminho, versao_dados=None):
+    """Mapeia o armazém; retorna None se ele não existir, for de outro formato ou de outra versão dos dados."""
+    if not os.path.exists(caminho):
+        return None
+    armazem = ArmazemMapeado(caminho)
+    if armazem.metadados.get('versao_formato') != VERSAO_FORMATO:
+        return None
+    if versao_dados is not None and armazem.versao_dados != versao_dados:
+        return None
+    return armazem
+
+
+def _gravar_se_possivel(carregar, caminho, versao_dados, coluna_uf):
+    """Grava o armazém com os dados de carregar() se a pasta permitir escrita; retorna se gravou."""
+    if not os.access(os.path.dirname(caminho) or '.', os.W_OK):
+        return False
+    gravar_armazem(carregar(), caminho, versao_dados, coluna_uf)
+    return True
+
+
+def caminho_armazem_ideb(caminho_txt):
+    return os.path.splitext(caminho_txt)[0] + f".{EXTENSAO}"
+
+
+def armazem_ideb(caminho_txt):
+    """
+    Armazém dos dados do IDEB limpos (escolas), gravado a partir do Parquet/TXT se preciso.
+    Retorna None se ele não existir e não puder ser gravado.
+    """
+    caminho = caminho_armazem_ideb(caminho_txt)
+    versao = ingestao_ideb.versao_dados(caminho_txt)
+    armazem = abrir_armazem(caminho, versao)
+    if armazem is None and _gravar_se_possivel(lambda: ingestao_ideb.carregar_ideb(caminho_txt), caminho, versao, 'UF'):
+        armazem = abrir_armazem(caminho, versao)
+    return armazem
+
+
+def versao_geometrias(fonte, nivel, ano):
+    """Versão das geometrias da fonte: tamanho e data do arquivo local lido, ou o nome da fonte (geobr)."""
+    pasta = getattr(fonte, 'pasta', None)
+    formatos = geometria_local.formatos_disponiveis(pasta, nivel, ano) if pasta else []
+    if not formatos:
+        return f"{fonte.nome}|{ano}"
+    estado = os.stat(geometria_local.caminho_geometria(pasta, nivel, ano, formatos[0]))
+    return f"{fonte.nome}|{formatos[0]}|{estado.st_size}-{estado.st_mtime_ns}"
+
+
+def armazem_geometrias(fonte, pasta, nivel, ano):
+    """
+    Armazém das geometrias de 'nivel' ('municipios' ou 'estados') em '<pasta>/<nivel>_br_<ano>.arrow',
+    gravado a partir da fonte (fontes_geometria) se não existir ou se a origem mudou.
+    Retorna None se ele não existir e não puder ser gravado.
+    """
+    caminho = geometria_local.caminho_geometria(pasta, nivel, ano, EXTENSAO)
+    versao = versao_geometrias(fonte, nivel, ano)
+    armazem = abrir_armazem(caminho, versao)
+    if armazem is None and _gravar_se_possivel(lambda: fonte.ler(nivel, ano), caminho, versao, 'abbrev_state'):
+        armazem = abrir_armazem(caminho, versao)
+    return armazem
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grava os armazéns Arrow (mapeáveis em memória) do painel.")
+    parser.add_argument('--ideb', help="Arquivo TXT do IDEB (usa o Parquet da ingestão se estiver atualizado).")
+    parser.add_argument('--geo', nargs=2, metavar=('PASTA', 'ANO'), help="Pasta das geometrias e ano.")
+    parser.add_argument('--fonte-geo', help="Fonte das geometrias (padrão: arquivos locais da pasta; ver fontes_geometria.py).")
+    args = parser.parse_args()
+    if not args.ideb and not args.geo:
+        parser.error("informe --ideb e/ou --geo")
+
+    armazens = []
+    if args.ideb:
+        armazens.append(armazem_ideb(args.ideb))
+    if args.geo:
+        pasta, ano = args.geo[0], int(args.geo[1])
+        fonte = fontes_geometria.escolher_fonte(pasta, ano, args.fonte_geo)
+        armazens += [armazem_geometrias(fonte, pasta, nivel, ano) for nivel in ('municipios', 'estados')]
+    for armazem in armazens:
+        if armazem is None:
+            print("Pasta sem permissão de escrita: armazém não gravado.")
+            continue
+        tipos = ', '.join(f"{campo.name}: {campo.type}" for campo in armazem.tabela.schema)
+        print(f"{armazem.caminho}: {armazem.tabela.num_rows} linhas, {armazem.bytes_mapeados / 1024 / 1024:.1f} MB ({tipos})")
+
+
+if __name__ == "__main__":
+    main()
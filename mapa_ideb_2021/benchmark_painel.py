@@ -0,0 +1,340 @@
+# Benchmarks do painel com dados sintéticos (ver dados_sinteticos.py), sem rede e sem os dados reais.
+# Mede as etapas que determinam o tempo de resposta do painel:
+#   - carga fria do TXT, conversão para Parquet e carga do Parquet;
+#   - gravação e carga do armazém Arrow mapeado em memória (armazem_compartilhado.py);
+#   - agregação por município (groupby e em blocos);
+#   - montagem do cubo de rede, localização e etapa (cubo_ideb.py) e consultas com filtros;
+#   - leitura das geometrias em cada formato e junção com os agregados;
+#   - troca de estado (fatia das partições por UF e leitura de um estado no GeoParquet/FlatGeobuf);
+#   - classificação das cores, construção do mapa e tamanho do HTML gerado;
+#   - tabela nacional de municípios: ordens das colunas e consulta de uma página (busca + ordenação);
+#   - vizinhança nacional dos municípios (STRtree) e I de Moran/LISA de todos os estados;
+#   - importação dos módulos de cada painel em um interpretador novo (partida a frio do Streamlit).
+# O resultado é gravado em JSON; com --comparar, as etapas são comparadas com um resultado
+# anterior (pelo tempo mínimo) e o script sai com código 1 se alguma ficar mais lenta que a tolerância.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/benchmark_painel.py --escolas 1000000 --saida base.json
+#   python mapa_ideb_2021/benchmark_painel.py --escolas 1000000 --saida atual.json --comparar base.json
+
+import argparse
+import ast
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import agregados_ideb
+import analise_espacial
+import armazem_compartilhado
+import classificacao
+import cubo_ideb
+import dados_sinteticos
+import fontes_geometria
+import geometria_local
+import geometria_simplificada
+import ingestao_ideb
+import mapa_metricas
+import particoes_uf
+import tabela_paginada
+
+VERSAO_RESULTADOS = 1
+PASTA_PADRAO = os.path.join(tempfile.gettempdir(), "benchmark_painel_ideb")
+NOME_PARAMETROS = "parametros_sinteticos.json"
+TOLERANCIA_PADRAO = 0.25
+# Diferenças menores que isto (em segundos) não contam como regressão: são ruído de medição
+DIFERENCA_MINIMA = 0.005
+# Estado usado nas medições de mapa: MG é o estado com mais municípios (853)
+UF_MAPA = 'MG'
+METRICAS_MAPA = {'media_mat': 'Média Mat.', 'media_por': 'Média Port.', 'media_ideb': 'IDEB (Média)'}
+# Scripts dos painéis cuja importação é medida, e módulos que não deveriam ser importados na partida
+SCRIPTS_PAINEL = ('painel_ideb_2020.py', 'seu_painel_ideb.py')
+MODULOS_PESADOS = ('geobr', 'rpy2', 'streamlit_folium')
+PASTA_MODULOS = os.path.dirname(os.path.abspath(__file__))
+
+
+def medir(funcao, repeticoes=3):
+    """
+    Executa funcao() 'repeticoes' vezes e retorna (resultado da última execução, tempos).
+    Os tempos trazem mínimo, mediana e a lista de execuções, em segundos.
+    """
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, {
+        'minimo': min(tempos),
+        'mediana': statistics.median(tempos),
+        'execucoes': tempos,
+    }
+
+
+def modulos_importados(caminho_script):
+    """Módulos importados no nível de topo do script: o que um processo novo do Streamlit importa ao iniciar."""
+    with open(caminho_script, encoding='utf-8') as f:
+        arvore = ast.parse(f.read())
+    modulos = []
+    for no in arvore.body:
+        if isinstance(no, ast.Import):
+            modulos += [alias.name for alias in no.names]
+        elif isinstance(no, ast.ImportFrom) and no.module:
+            modulos.append(no.module)
+    return modulos
+
+
+def medir_importacao(modulos):
+    """
+    Importa os módulos em um interpretador novo (a partir da pasta dos módulos do painel).
+    Retorna (segundos gastos nos imports, módulos de MODULOS_PESADOS que acabaram importados).
+    """
+    codigo = "\n".join(
+        ["import json, sys, time", "inicio = time.perf_counter()"]
+        + [f"import {modulo}" for modulo in modulos]
+        + [f"print(json.dumps([time.perf_counter() - inicio, [m for m in {MODULOS_PESADOS!r} if m in sys.modules]]))"]
+    )
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=PASTA_MODULOS, capture_output=True, text=True, check=True)
+    segundos, pesados = json.loads(saida.stdout.strip().splitlines()[-1])
+    return segundos, pesados
+
+
+def preparar_dados(pasta, n_escolas, semente, encoding):
+    """
+    Gera o conjunto sintético em 'pasta', reaproveitando o que já existe se os parâmetros
+    forem os mesmos (o gerador é determinístico). Retorna o caminho do TXT e a pasta das geometrias.
+    """
+    parametros = {'escolas': n_escolas, 'semente': semente, 'encoding': encoding,
+                  'municipios': int(sum(dados_sinteticos.MUNICIPIOS_POR_UF.values()))}
+    caminho_parametros = os.path.join(pasta, NOME_PARAMETROS)
+    caminho_txt = os.path.join(pasta, "ideb_escola_2021.txt")
+    pasta_geo = os.path.join(pasta, "dados_geoespaciais")
+
+    existentes = None
+    if os.path.exists(caminho_parametros):
+        with open(caminho_parametros, encoding='utf-8') as f:
+            existentes = json.load(f)
+    if existentes != parametros or not os.path.exists(caminho_txt):
+        print(f"Gerando dados sintéticos em '{pasta}' ({n_escolas} escolas)...")
+        dados_sinteticos.gerar_conjunto(pasta, n_escolas, (2021,), semente, encoding)
+        with open(caminho_parametros, 'w', encoding='utf-8') as f:
+            json.dump(parametros, f, indent=2)
+    # Remove o Parquet de execuções anteriores para que a primeira carga seja realmente do TXT
+    for caminho in ingestao_ideb.caminhos_colunares(caminho_txt):
+        if os.path.exists(caminho):
+            os.remove(caminho)
+    return caminho_txt, pasta_geo, parametros
+
+
+def executar_benchmarks(caminho_txt, pasta_geo, ano_geo=2020, repeticoes=3):
+    """Executa todas as etapas e retorna (etapas, tamanhos_bytes)."""
+    etapas = {}
+    tamanhos = {}
+
+    def registrar(nome, funcao, repeticoes_etapa=repeticoes):
+        resultado, tempos = medir(funcao, repeticoes_etapa)
+        etapas[nome] = tempos
+        print(f"{nome:<36} {tempos['mediana'] * 1000:10.1f} ms (mín. {tempos['minimo'] * 1000:.1f} ms)")
+        return resultado
+
+    # Carga dos dados do IDEB
+    df_ideb = registrar('carga_fria_txt', lambda: ingestao_ideb.limpar_dados_ideb(ingestao_ideb.ler_txt_ideb(caminho_txt)))
+    registrar('conversao_parquet', lambda: ingestao_ideb.converter_txt_para_parquet(caminho_txt), 1)
+    registrar('carga_parquet', lambda: ingestao_ideb.carregar_ideb_colunar(caminho_txt))
+    tamanhos['txt_ideb'] = os.path.getsize(caminho_txt)
+    tamanhos['parquet_ideb'] = os.path.getsize(ingestao_ideb.caminhos_colunares(caminho_txt)[0])
+    caminho_armazem = armazem_compartilhado.caminho_armazem_ideb(caminho_txt)
+    registrar('gravacao_armazem_arrow', lambda: armazem_compartilhado.gravar_armazem(df_ideb, caminho_armazem, 'benchmark', 'UF'), 1)
+    registrar('carga_armazem_arrow', lambda: armazem_compartilhado.ArmazemMapeado(caminho_armazem).dataframe())
+    tamanhos['arrow_ideb'] = os.path.getsize(caminho_armazem)
+    tamanhos['memoria_df_ideb'] = int(df_ideb.memory_usage(deep=True).sum())
+
+    # Agregação por município
+    agregados = registrar('agregacao_groupby', lambda: agregados_ideb.calcular_agregados_municipios(df_ideb))
+    registrar('agregacao_em_blocos', lambda: agregados_ideb.agregar_arquivos_em_blocos([caminho_txt]), 1)
+    registrar('particoes_escolas_uf', lambda: particoes_uf.ParticoesUF(df_ideb, 'UF'))
+
+    # Cubo de rede, localização e etapa: uma leitura do TXT; os filtros são buscas e somas de fatias
+    registrar('cubo_montagem', lambda: cubo_ideb.gerar_cubo(caminho_txt), 1)
+    tamanhos['cubo_ideb'] = os.path.getsize(cubo_ideb.caminho_cubo(caminho_txt))
+    cubo = registrar('cubo_leitura', lambda: cubo_ideb.carregar_cubo(caminho_txt))
+
+    def consultar_cubo():
+        for dimensao in cubo_ideb.DIMENSOES:
+            cubo.consultar('municipio', {dimensao: tuple(cubo.membros(dimensao)[:2])})
+    registrar('consultas_cubo_3x', consultar_cubo)
+
+    # Geometrias: leitura nacional em cada formato e junção com os agregados
+    br_muni_gdf = None
+    for ext in geometria_local.formatos_disponiveis(pasta_geo, 'municipios', ano_geo):
+        br_muni_gdf = registrar(f'geometrias_nacional_{ext}',
+                                lambda ext=ext: geometria_local.ler_geometrias(pasta_geo, 'municipios', ano_geo, formato=ext))
+        tamanhos[f'geometrias_{ext}'] = os.path.getsize(geometria_local.caminho_geometria(pasta_geo, 'municipios', ano_geo, ext))
+    br_muni_gdf['code_muni'] = br_muni_gdf['code_muni'].astype('Int64')
+
+    def juntar_e_particionar():
+        unido = agregados_ideb.juntar_agregados_geometria(br_muni_gdf, agregados)
+        return particoes_uf.ParticoesUF(unido, 'abbrev_state')
+    particoes_municipios = registrar('juncao_e_particoes_municipios', juntar_e_particionar)
+
+    # Troca de estado: média por estado, percorrendo as 27 UFs
+    ufs = particoes_municipios.ufs()
+
+    def trocar_estados_particoes():
+        for uf in ufs:
+            particoes_municipios.obter(uf)
+    registrar('troca_estado_particoes_27_ufs', trocar_estados_particoes)
+
+    if geometria_local.possui_leitura_por_estado(pasta_geo, 'municipios', ano_geo):
+        def trocar_estados_leitura():
+            for uf in ufs:
+                gdf = geometria_local.ler_geometrias(pasta_geo, 'municipios', ano_geo, uf=uf)
+                gdf['code_muni'] = gdf['code_muni'].astype('Int64')
+                agregados_ideb.juntar_agregados_geometria(gdf, agregados)
+        registrar('troca_estado_leitura_27_ufs', trocar_estados_leitura, 1)
+
+    fonte_geo = fontes_geometria.FonteArquivosLocais(pasta_geo)
+    armazem_geo = armazem_compartilhado.armazem_geometrias(fonte_geo, pasta_geo, 'municipios', ano_geo)
+
+    def trocar_estados_armazem():
+        for uf in ufs:
+            gdf = armazem_geo.geodataframe(uf)
+            gdf['code_muni'] = gdf['code_muni'].astype('Int64')
+            agregados_ideb.juntar_agregados_geometria(gdf, agregados)
+    registrar('troca_estado_armazem_27_ufs', trocar_estados_armazem, 1)
+    tamanhos['geometrias_arrow'] = os.path.getsize(armazem_geo.caminho)
+
+    # Classificação das cores (todas as UFs e métricas de uma vez)
+    classes_por_metodo = {}
+    for metodo in classificacao.METODOS:
+        classes_por_metodo[metodo] = registrar(
+            f'classificacao_{metodo}',
+            lambda metodo=metodo: classificacao.classificar_agregados(agregados, list(METRICAS_MAPA), metodo))
+    classes = classes_por_metodo[classificacao.METODO_PADRAO]
+
+    # Tabela de municípios paginada: montagem (ordens de todas as colunas) e consultas de uma página
+    dados_tabela = mapa_metricas.dados_tabela_municipios(
+        agregados_ideb.juntar_agregados_geometria(br_muni_gdf, agregados), colunas_extras=['abbrev_state'])
+    tabela = registrar('tabela_ordenada_nacional', lambda: tabela_paginada.TabelaOrdenada(dados_tabela))
+
+    def consultar_paginas():
+        for coluna in METRICAS_MAPA:
+            tabela.consultar(coluna, decrescente=True, pagina=2)
+            tabela.consultar(coluna, busca='1', pagina=1)
+    registrar('consulta_tabela_nacional_6x', consultar_paginas)
+
+    # Autocorrelação espacial: vizinhança nacional (STRtree) e LISA de cada estado
+    vizinhanca = registrar('vizinhanca_nacional_strtree', lambda: analise_espacial.Vizinhanca.de_geometrias(
+        br_muni_gdf['code_muni'].astype('int64'), br_muni_gdf.geometry.values))
+
+    def lisa_estados():
+        for uf in ufs:
+            gdf = particoes_municipios.obter(uf)
+            analise_espacial.autocorrelacao_espacial(gdf['media_ideb'], vizinhanca.subconjunto(gdf['code_muni'].astype('int64')))
+    registrar('lisa_media_ideb_27_ufs', lisa_estados, 1)
+
+    # Construção do mapa do maior estado, com as geometrias completas e com as simplificadas
+    muni_estado_gdf = particoes_municipios.obter(UF_MAPA)
+    centro = shapely.box(*muni_estado_gdf.total_bounds).centroid
+    niveis = registrar('geometrias_simplificadas_uf', lambda: geometria_simplificada.preparar_niveis_estado(muni_estado_gdf), 1)
+    for nome, niveis_mapa in (('completo', None), ('simplificado', niveis)):
+        artefato = registrar(f'mapa_{nome}_{UF_MAPA}', lambda niveis_mapa=niveis_mapa: mapa_metricas.artefato_mapa(
+            mapa_metricas.criar_mapa_multimetrica(muni_estado_gdf, METRICAS_MAPA, centro, niveis_mapa, largura_px=900,
+                                                  padrao='media_ideb', classes=classes.get(UF_MAPA))
+        ))
+        tamanhos[f'html_mapa_{nome}_{UF_MAPA}'] = len(artefato['html'].encode('utf-8'))
+
+    # Importação dos painéis: medida dentro do interpretador novo (sem o tempo de iniciar o Python)
+    for script in SCRIPTS_PAINEL:
+        modulos = modulos_importados(os.path.join(PASTA_MODULOS, script))
+        tempos = []
+        for _ in range(repeticoes):
+            segundos, pesados = medir_importacao(modulos)
+            tempos.append(segundos)
+        nome = f"importacao_{os.path.splitext(script)[0]}"
+        etapas[nome] = {'minimo': min(tempos), 'mediana': statistics.median(tempos), 'execucoes': tempos}
+        print(f"{nome:<36} {etapas[nome]['mediana'] * 1000:10.1f} ms (mín. {etapas[nome]['minimo'] * 1000:.1f} ms)")
+        if pesados:
+            print(f"  atenção: {script} importa {', '.join(pesados)} na partida")
+
+    return etapas, tamanhos
+
+
+def comparar_resultados(atual, base, tolerancia=TOLERANCIA_PADRAO):
+    """
+    Compara os tempos mínimos de cada etapa presente nos dois resultados (o mínimo é menos
+    sensível à carga da máquina que a mediana).
+    Retorna uma lista de (etapa, tempo_base, tempo_atual, razão, regressão?).
+    """
+    linhas = []
+    for etapa, tempos in atual['etapas'].items():
+        if etapa not in base['etapas']:
+            continue
+        tempo_base = base['etapas'][etapa]['minimo']
+        tempo_atual = tempos['minimo']
+        razao = tempo_atual / tempo_base if tempo_base > 0 else float('inf')
+        regressao = razao > 1 + tolerancia and tempo_atual - tempo_base > DIFERENCA_MINIMA
+        linhas.append((etapa, tempo_base, tempo_atual, razao, regressao))
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do painel IDEB com dados sintéticos.")
+    parser.add_argument('--pasta', default=PASTA_PADRAO, help="Pasta dos dados sintéticos (gerados se preciso).")
+    parser.add_argument('--escolas', type=int, default=200_000, help="Número de linhas (escolas) do arquivo do IDEB.")
+    parser.add_argument('--semente', type=int, default=dados_sinteticos.SEMENTE_PADRAO)
+    parser.add_argument('--encoding', default='latin-1', choices=['utf-8', 'latin-1'])
+    parser.add_argument('--repeticoes', type=int, default=3, help="Execuções de cada etapa.")
+    parser.add_argument('--saida', default="resultados_benchmark.json", help="Arquivo JSON com os resultados.")
+    parser.add_argument('--comparar', help="JSON de um resultado anterior para comparação.")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO,
+                        help="Aumento relativo do tempo mínimo considerado regressão (0.25 = 25%%).")
+    args = parser.parse_args()
+
+    # O folium avisa a cada mapa que os tiles do CartoDB pedem chave de API; o benchmark não baixa tiles
+    warnings.filterwarnings('ignore', message='CartoDB tiles')
+    caminho_txt, pasta_geo, parametros = preparar_dados(args.pasta, args.escolas, args.semente, args.encoding)
+    etapas, tamanhos = executar_benchmarks(caminho_txt, pasta_geo, repeticoes=args.repeticoes)
+
+    resultado = {
+        'versao': VERSAO_RESULTADOS,
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'ambiente': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+        },
+        'parametros': dict(parametros, repeticoes=args.repeticoes),
+        'etapas': etapas,
+        'tamanhos_bytes': tamanhos,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em '{args.saida}'.")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        if base.get('parametros', {}).get('escolas') != parametros['escolas']:
+            print("Atenção: o resultado base foi medido com outro número de escolas.")
+        linhas = comparar_resultados(resultado, base, args.tolerancia)
+        print(f"\n{'etapa':<36} {'base (ms)':>10} {'atual (ms)':>11} {'razão':>7}")
+        for etapa, tempo_base, tempo_atual, razao, regressao in linhas:
+            marca = "  <- regressão" if regressao else ""
+            print(f"{etapa:<36} {tempo_base * 1000:10.1f} {tempo_atual * 1000:11.1f} {razao:7.2f}{marca}")
+        if any(linha[-1] for linha in linhas):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
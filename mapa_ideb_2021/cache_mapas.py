@@ -0,0 +1,103 @@
+# Cache dos artefatos de mapa já renderizados (HTML do Folium, limites das classes, legenda).
+# A chave é (versão dos dados do IDEB, ano das geometrias, UF, métrica/modo), de modo que
+# um rerun do Streamlit que não muda nada disso reaproveita o mapa pronto.
+# O cache tem um orçamento de memória em bytes, remove os itens usados há mais tempo (LRU)
+# e conta acertos, falhas e remoções.
+
+import os
+import threading
+from collections import OrderedDict
+
+# Orçamento padrão; pode ser alterado pela variável de ambiente PAINEL_IDEB_CACHE_MAPAS_MB
+LIMITE_PADRAO_MB = 256
+
+
+def limite_configurado_bytes():
+    """Lê o orçamento de memória do cache (em MB) da variável de ambiente, com valor padrão."""
+    try:
+        limite_mb = float(os.environ.get('PAINEL_IDEB_CACHE_MAPAS_MB', LIMITE_PADRAO_MB))
+    except ValueError:
+        limite_mb = LIMITE_PADRAO_MB
+    return int(limite_mb * 1024 * 1024)
+
+
+def tamanho_artefato(artefato):
+    """Estimativa do tamanho em bytes de um artefato: soma dos textos (HTML/JSON) que ele contém."""
+    if isinstance(artefato, str):
+        return len(artefato.encode('utf-8'))
+    if isinstance(artefato, bytes):
+        return len(artefato)
+    if isinstance(artefato, dict):
+        return sum(tamanho_artefato(v) for v in artefato.values())
+    if isinstance(artefato, (list, tuple)):
+        return sum(tamanho_artefato(v) for v in artefato)
+    return 64
+
+
+class CacheArtefatosMapa:
+    """Cache LRU com orçamento de memória. Seguro para uso por várias sessões (threads)."""
+
+    def __init__(self, limite_bytes=None):
+        self.limite_bytes = limite_configurado_bytes() if limite_bytes is None else limite_bytes
+        self._itens = OrderedDict() # chave -> (artefato, tamanho)
+        self._bytes = 0
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave):
+        """Retorna o artefato da chave (e o marca como usado recentemente) ou None."""
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[0]
+
+    def guardar(self, chave, artefato):
+        """Guarda o artefato e remove os menos usados até caber no orçamento."""
+        tamanho = tamanho_artefato(artefato)
+        with self._trava:
+            if chave in self._itens:
+                self._bytes -= self._itens.pop(chave)[1]
+            if tamanho > self.limite_bytes:
+                return # Maior que o orçamento inteiro: não vale a pena guardar
+            self._itens[chave] = (artefato, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.limite_bytes:
+                _, (_, tamanho_removido) = self._itens.popitem(last=False)
+                self._bytes -= tamanho_removido
+                self.remocoes += 1
+
+    def obter_ou_criar(self, chave, criar):
+        """
+        Retorna o artefato em cache ou chama criar() para gerá-lo.
+        Se criar() retornar None (ex: sem dados), nada é guardado.
+        """
+        artefato = self.obter(chave)
+        if artefato is None:
+            artefato = criar()
+            if artefato is not None:
+                self.guardar(chave, artefato)
+        return artefato
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+            self._bytes = 0
+
+    def estatisticas(self):
+        with self._trava:
+            total = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'bytes': self._bytes,
+                'limite_bytes': self.limite_bytes,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+                'taxa_acerto': self.acertos / total if total else 0.0,
+            }
@@ -0,0 +1,45 @@
+# Execução concorrente de cargas independentes (ex: dados do IDEB e geometrias na partida do painel).
+# As tarefas rodam em um pool de threads: a leitura dos arquivos e o parse feitos pelo pyarrow,
+# pelo GDAL (pyogrio) e pelo pandas liberam o GIL na maior parte do tempo, e as threads
+# compartilham os caches do processo (st.cache_resource, armazéns mapeados), o que um pool
+# de processos não faria. O tempo total passa a ser o da carga mais longa, e não a soma delas.
+# Um erro em uma tarefa não interrompe as outras: as exceções são devolvidas a quem chamou,
+# que decide como exibi-las.
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def _executar_medindo(funcao):
+    inicio = time.perf_counter()
+    try:
+        return funcao(), None, time.perf_counter() - inicio
+    except Exception as erro:
+        return None, erro, time.perf_counter() - inicio
+
+
+def carregar_em_paralelo(tarefas, ao_concluir=None, inicializar=None, max_trabalhadores=None):
+    """
+    Executa as funções de 'tarefas' ({nome: função sem argumentos}) ao mesmo tempo.
+    'ao_concluir(nome, concluidas, total)' é chamada na thread de quem chamou, a cada tarefa
+    terminada (ex: para atualizar uma barra de progresso); 'inicializar()' roda no início de
+    cada thread do pool (ex: para repassar o contexto da thread principal).
+    Retorna (resultados, erros, segundos): dicionários por nome com o resultado das tarefas
+    bem-sucedidas, a exceção das que falharam e a duração de cada uma.
+    """
+    resultados, erros, segundos = {}, {}, {}
+    if not tarefas:
+        return resultados, erros, segundos
+    with ThreadPoolExecutor(max_workers=max_trabalhadores or len(tarefas), initializer=inicializar,
+                            thread_name_prefix='carga') as executor:
+        futuros = {executor.submit(_executar_medindo, funcao): nome for nome, funcao in tarefas.items()}
+        for concluidas, futuro in enumerate(as_completed(futuros), start=1):
+            nome = futuros[futuro]
+            resultado, erro, segundos[nome] = futuro.result()
+            if erro is None:
+                resultados[nome] = resultado
+            else:
+                erros[nome] = erro
+            if ao_concluir is not None:
+                ao_concluir(nome, concluidas, len(tarefas))
+    return resultados, erros, segundos
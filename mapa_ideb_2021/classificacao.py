@@ -0,0 +1,159 @@
+# Classificação das cores dos mapas (limites das classes do coroplético).
+# Os limites são calculados UMA vez por conjunto de agregados, para os 27 estados e todas
+# as métricas de uma vez: os valores são ordenados por (UF, valor) e os quantis e intervalos
+# iguais de todos os estados saem de operações vetorizadas sobre essa ordenação.
+# O resultado fica em cache junto com os agregados e o construtor do mapa apenas consulta
+# os limites do estado e da métrica, sem calcular nada durante a renderização.
+#
+# Métodos disponíveis:
+#   - 'quantis': cada classe com (aproximadamente) o mesmo número de municípios;
+#   - 'intervalos_iguais': classes de mesma largura entre o mínimo e o máximo do estado;
+#   - 'jenks': quebras naturais (algoritmo exato de Fisher), que minimizam a variância dentro das classes.
+
+import numpy as np
+
+import ingestao_ideb
+
+METODOS = {
+    'quantis': 'Quantis',
+    'intervalos_iguais': 'Intervalos iguais',
+    'jenks': 'Quebras naturais (Jenks)',
+}
+METODO_PADRAO = 'quantis'
+N_CLASSES = 6
+
+# O algoritmo de Fisher usa uma matriz n x n por estado (o maior estado, MG, tem 853 municípios).
+# Acima deste limite, as quebras são calculadas sobre uma amostra ordenada de LIMITE_JENKS valores.
+LIMITE_JENKS = 2000
+
+# Tabela código IBGE da UF (0-99) -> posição da UF em UFS_BRASIL (-1 se desconhecido)
+_POSICAO_UF_POR_CODIGO = np.full(100, -1, dtype='int64')
+for _codigo, _sigla in ingestao_ideb.CODIGOS_IBGE_UF.items():
+    _POSICAO_UF_POR_CODIGO[_codigo] = ingestao_ideb.UFS_BRASIL.index(_sigla)
+
+
+def posicoes_uf(codigos_municipios):
+    """Posição em UFS_BRASIL da UF de cada município (pelos dois primeiros dígitos do código IBGE), ou -1."""
+    codigos_uf = np.asarray(codigos_municipios, dtype='int64') // 100_000
+    validos = (codigos_uf >= 0) & (codigos_uf < 100)
+    return np.where(validos, _POSICAO_UF_POR_CODIGO[np.clip(codigos_uf, 0, 99)], -1)
+
+
+def _ajustar_limites(limites):
+    """
+    Remove limites repetidos (quantis colapsados). Sem variação nos dados,
+    usa [min, min + 0.1], como o mapa fazia antes.
+    """
+    limites = sorted(set(float(v) for v in limites))
+    if len(limites) < 2:
+        return [limites[0], limites[0] + 0.1]
+    return limites
+
+
+def _limites_por_grupo(valores_ordenados, inicios, contagens, proporcoes):
+    """
+    Interpolação linear das posições 'proporcoes' (entre 0 e 1) dentro de cada grupo,
+    igual a np.quantile. Retorna uma matriz (grupos x proporções).
+    """
+    posicoes = inicios[:, None] + proporcoes[None, :] * (contagens[:, None] - 1)
+    abaixo = np.floor(posicoes).astype('int64')
+    acima = np.ceil(posicoes).astype('int64')
+    fracao = posicoes - abaixo
+    return valores_ordenados[abaixo] + (valores_ordenados[acima] - valores_ordenados[abaixo]) * fracao
+
+
+def quebras_jenks(valores_ordenados, n_classes=N_CLASSES):
+    """
+    Quebras naturais de Fisher-Jenks para valores já ordenados (programação dinâmica exata,
+    com cada etapa vetorizada sobre todas as posições). Retorna os limites [min, ..., max].
+    """
+    x = np.asarray(valores_ordenados, dtype='float64')
+    if x.size > LIMITE_JENKS:
+        x = x[np.linspace(0, x.size - 1, LIMITE_JENKS).round().astype('int64')]
+    n = x.size
+    n_classes = min(n_classes, np.unique(x).size)
+    if n_classes < 2:
+        return [float(x[0]), float(x[-1])]
+
+    soma = np.concatenate(([0.0], np.cumsum(x)))
+    soma_quad = np.concatenate(([0.0], np.cumsum(x * x)))
+    inicio = np.arange(n)[:, None]
+    fim = np.arange(n)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Soma dos desvios quadráticos de x[inicio..fim] (inclusive)
+        custo_trecho = (soma_quad[fim + 1] - soma_quad[inicio]) - (soma[fim + 1] - soma[inicio]) ** 2 / (fim - inicio + 1)
+    custo_trecho[inicio > fim] = np.inf
+
+    custo = custo_trecho[0] # Melhor custo com uma classe terminando em cada posição
+    inicios_classe = []
+    colunas = np.arange(n)
+    for _ in range(1, n_classes):
+        # A nova classe começa em 'inicio' (>= 1) e termina em 'fim'; as anteriores cobrem x[0..inicio-1]
+        total = custo[:-1, None] + custo_trecho[1:, :]
+        melhor = np.argmin(total, axis=0)
+        custo = total[melhor, colunas]
+        inicios_classe.append(melhor + 1)
+
+    # Reconstrói as quebras a partir da última posição
+    limites = [float(x[-1])]
+    fim = n - 1
+    for melhores in reversed(inicios_classe):
+        inicio_classe = melhores[fim]
+        limites.append(float(x[inicio_classe - 1]))
+        fim = inicio_classe - 1
+    limites.append(float(x[0]))
+    return limites[::-1]
+
+
+def classificar(valores, grupos, n_grupos, metodo=METODO_PADRAO, n_classes=N_CLASSES):
+    """
+    Calcula os limites das classes de cada grupo (ex: posição da UF) para uma métrica.
+    'grupos' são inteiros em [0, n_grupos); valores NaN e grupos negativos são ignorados.
+    Retorna {grupo: [limites]} apenas para os grupos com algum valor válido.
+    """
+    if metodo not in METODOS:
+        raise ValueError(f"Método de classificação desconhecido: '{metodo}' (use um de {list(METODOS)}).")
+    valores = np.asarray(valores, dtype='float64')
+    grupos = np.asarray(grupos, dtype='int64')
+    validos = ~np.isnan(valores) & (grupos >= 0)
+    valores, grupos = valores[validos], grupos[validos]
+    if valores.size == 0:
+        return {}
+
+    # Uma única ordenação por (grupo, valor) serve a todos os grupos
+    ordem = np.lexsort((valores, grupos))
+    valores_ordenados = valores[ordem]
+    contagens = np.bincount(grupos, minlength=n_grupos)
+    inicios = np.concatenate(([0], np.cumsum(contagens)[:-1]))
+    com_dados = np.flatnonzero(contagens)
+
+    if metodo == 'quantis':
+        matriz = _limites_por_grupo(valores_ordenados, inicios[com_dados], contagens[com_dados],
+                                    np.linspace(0, 1, n_classes + 1))
+    elif metodo == 'intervalos_iguais':
+        minimos = valores_ordenados[inicios[com_dados]]
+        maximos = valores_ordenados[inicios[com_dados] + contagens[com_dados] - 1]
+        matriz = minimos[:, None] + (maximos - minimos)[:, None] * np.linspace(0, 1, n_classes + 1)[None, :]
+    else:
+        matriz = [
+            quebras_jenks(valores_ordenados[inicios[g]:inicios[g] + contagens[g]], n_classes)
+            for g in com_dados
+        ]
+    return {int(g): _ajustar_limites(limites) for g, limites in zip(com_dados, matriz)}
+
+
+def classificar_agregados(agregados, colunas, metodo=METODO_PADRAO, n_classes=N_CLASSES):
+    """
+    Limites das classes de todas as UFs para cada coluna da tabela de agregados (indexada por 'cod_mun').
+    Retorna {sigla_uf: {coluna: [limites]}}; colunas sem valores em um estado ficam de fora.
+    """
+    grupos = posicoes_uf(agregados.index.to_numpy(dtype='int64', na_value=-1))
+    classes = {}
+    for coluna in colunas:
+        if coluna not in agregados.columns:
+            continue
+        limites_por_uf = classificar(agregados[coluna].to_numpy(dtype='float64', na_value=np.nan), grupos,
+                                     len(ingestao_ideb.UFS_BRASIL), metodo, n_classes)
+        for posicao, limites in limites_por_uf.items():
+            classes.setdefault(ingestao_ideb.UFS_BRASIL[posicao], {})[coluna] = limites
+    return classes
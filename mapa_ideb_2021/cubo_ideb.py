@@ -0,0 +1,261 @@
+# Cubo pré-agregado do IDEB por rede, localização e etapa, com a hierarquia geográfica
+# escola -> município -> UF -> região -> Brasil.
+# O arquivo de escolas tem mais dimensões do que o painel usa; filtrar por elas com um
+# groupby sobre as escolas a cada interação custaria uma varredura completa por rerun.
+# Aqui, o TXT é lido UMA vez, em blocos (como em agregados_ideb.py), e as escolas são
+# somadas em acumuladores aditivos (soma, soma dos quadrados e contagem de cada nota) por
+# município e combinação de rede, localização e etapa. Desses acumuladores saem, por soma,
+# todas as combinações de dimensões (cada uma também no membro TOTAL) em cada nível
+# geográfico, gravadas em um Parquet compacto ('<arquivo>.cubo.parquet', dimensões como
+# dicionário) e ordenadas para que cada combinação seja uma fatia contígua.
+#
+# Uma consulta (nível geográfico + membros escolhidos de cada dimensão) é uma busca de
+# fatia; com mais de um membro em uma dimensão, as fatias dos membros são somadas (rollup).
+# Média e desvio padrão saem dos acumuladores (agregados_ideb.finalizar_acumuladores),
+# no mesmo formato da tabela de agregados do painel.
+#
+# Dimensões ausentes no arquivo (ex: arquivos sem a localização da escola) ficam com um único
+# membro e não aparecem como filtro no painel.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/cubo_ideb.py mapa_ideb_2021/ideb_escola_2021.txt
+
+import argparse
+import itertools
+import json
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import agregados_ideb
+import ingestao_ideb
+
+# Dimensão -> colunas aceitas no arquivo, em ordem de preferência
+DIMENSOES = {
+    'rede': ('rede', 'tipo_rede'),
+    'localizacao': ('localizacao', 'tipo_localizacao'),
+    'etapa': ('anos_escolares', 'etapa', 'ensino'),
+}
+TITULOS_DIMENSOES = {'rede': 'Rede', 'localizacao': 'Localização', 'etapa': 'Etapa'}
+TOTAL = '(total)' # Membro que soma todos os outros da dimensão
+NAO_INFORMADO = 'Não informado'
+
+# Níveis geográficos e nome do código de cada um no resultado das consultas
+NIVEIS = {'municipio': 'cod_mun', 'uf': 'cod_uf', 'regiao': 'cod_regiao', 'brasil': 'cod_brasil'}
+# Primeiro dígito do código IBGE do município
+REGIOES = {1: 'Norte', 2: 'Nordeste', 3: 'Sudeste', 4: 'Sul', 5: 'Centro-Oeste'}
+
+VERSAO_FORMATO = 1
+CHAVE_METADADOS = b'cubo_ideb'
+
+
+def caminho_cubo(caminho_txt):
+    return os.path.splitext(caminho_txt)[0] + '.cubo.parquet'
+
+
+def versao_origem(caminho_txt):
+    """Tamanho e data de modificação do TXT de origem, ou None se ele não estiver presente."""
+    if not os.path.exists(caminho_txt):
+        return None
+    stat = os.stat(caminho_txt)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def versao_cubo(caminho_txt):
+    """Tamanho e data de modificação do cubo gravado do TXT, ou None se ele não existir (para chaves de cache)."""
+    return versao_origem(caminho_cubo(caminho_txt))
+
+
+def codigo_nivel(cod_mun, nivel):
+    """Código do município (7 dígitos do IBGE) no nível geográfico: ele mesmo, a UF, a região ou 0 (Brasil)."""
+    divisores = {'municipio': 1, 'uf': 100_000, 'regiao': 1_000_000}
+    if nivel == 'brasil':
+        return cod_mun * 0
+    return cod_mun // divisores[nivel]
+
+
+def acumular_arquivo_cubo(caminho_txt, tamanho_bloco=agregados_ideb.TAMANHO_BLOCO_PADRAO):
+    """
+    Lê o TXT em blocos e soma os acumuladores por município, rede, localização e etapa.
+    Retorna (acumuladores, {dimensão: coluna do arquivo}) só com as dimensões encontradas.
+    """
+    colunas_arquivo = [col for colunas in DIMENSOES.values() for col in colunas]
+    for encoding in ('utf-8', 'latin-1'):
+        try:
+            acumuladores, encontradas = None, {}
+            for bloco in ingestao_ideb.ler_txt_ideb(caminho_txt, chunksize=tamanho_bloco, encoding_inicial=encoding,
+                                                    colunas_opcionais=colunas_arquivo):
+                bloco = ingestao_ideb.limpar_dados_ideb(bloco, colunas_extras=colunas_arquivo)
+                for dimensao, colunas in DIMENSOES.items():
+                    coluna = next((col for col in colunas if col in bloco.columns), None)
+                    if coluna is None:
+                        bloco[dimensao] = NAO_INFORMADO
+                        continue
+                    encontradas[dimensao] = coluna
+                    bloco[dimensao] = bloco[coluna].fillna('').str.strip().replace('', NAO_INFORMADO)
+                acumuladores = agregados_ideb.combinar_acumuladores(
+                    acumuladores, agregados_ideb.acumular_bloco(bloco, ('cod_mun',) + tuple(DIMENSOES)))
+            return acumuladores, encontradas
+        except UnicodeDecodeError:
+            if encoding == 'latin-1':
+                raise
+    return None, {}
+
+
+def montar_cubo(acumuladores):
+    """
+    Todas as combinações de dimensões (cada uma com o membro TOTAL) em todos os níveis geográficos,
+    somadas a partir dos acumuladores por município. Retorna um DataFrame ordenado por
+    nível, rede, localização, etapa e código.
+    """
+    base = acumuladores.reset_index()
+    cod_mun = base['cod_mun'].to_numpy(dtype='int64')
+    colunas_acumuladores = agregados_ideb.nomes_colunas_acumuladores()
+    partes = []
+    for nivel in NIVEIS:
+        codigo = codigo_nivel(cod_mun, nivel)
+        for mantidas in itertools.product((True, False), repeat=len(DIMENSOES)):
+            chaves = [codigo] + [
+                base[dimensao].to_numpy() if manter else pd.Series(TOTAL, index=base.index).to_numpy()
+                for dimensao, manter in zip(DIMENSOES, mantidas)
+            ]
+            parte = base[colunas_acumuladores].groupby(chaves, sort=False).sum()
+            parte.index.names = ['codigo'] + list(DIMENSOES)
+            partes.append(parte.reset_index().assign(nivel=nivel))
+
+    cubo = pd.concat(partes, ignore_index=True)
+    cubo['nivel'] = pd.Categorical(cubo['nivel'], categories=list(NIVEIS))
+    for dimensao in DIMENSOES:
+        membros = sorted(set(cubo[dimensao]) - {TOTAL})
+        cubo[dimensao] = pd.Categorical(cubo[dimensao], categories=[TOTAL] + membros)
+    cubo['codigo'] = cubo['codigo'].astype('int32')
+    for coluna in colunas_acumuladores:
+        if coluna.startswith('contagem_'):
+            cubo[coluna] = cubo[coluna].astype('int32')
+    cubo = cubo.sort_values(['nivel'] + list(DIMENSOES) + ['codigo'], kind='stable', ignore_index=True)
+    return cubo[['nivel'] + list(DIMENSOES) + ['codigo'] + colunas_acumuladores]
+
+
+def gerar_cubo(caminho_txt, tamanho_bloco=agregados_ideb.TAMANHO_BLOCO_PADRAO):
+    """Monta e grava o cubo do TXT em '<arquivo>.cubo.parquet'. Retorna (caminho, metadados)."""
+    acumuladores, encontradas = acumular_arquivo_cubo(caminho_txt, tamanho_bloco)
+    if acumuladores is None:
+        raise ValueError(f"Nenhum dado válido encontrado em '{caminho_txt}'.")
+    cubo = montar_cubo(acumuladores)
+    metadados_cubo = {
+        'versao_formato': VERSAO_FORMATO,
+        'arquivo_origem': os.path.basename(caminho_txt),
+        'versao_origem': versao_origem(caminho_txt),
+        'colunas_dimensoes': encontradas,
+        'membros': {dimensao: [m for m in cubo[dimensao].cat.categories if m != TOTAL] for dimensao in DIMENSOES},
+    }
+    tabela = pa.Table.from_pandas(cubo, preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[CHAVE_METADADOS] = json.dumps(metadados_cubo, ensure_ascii=False).encode('utf-8')
+    tabela = tabela.replace_schema_metadata(metadados)
+
+    caminho = caminho_cubo(caminho_txt)
+    caminho_tmp = f"{caminho}.tmp-{os.getpid()}"
+    try:
+        pq.write_table(tabela, caminho_tmp, compression='zstd')
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+    return caminho, metadados_cubo
+
+
+class CuboIdeb:
+    """Cubo lido do Parquet, com a posição da fatia de cada (nível, rede, localização, etapa)."""
+
+    def __init__(self, cubo, metadados):
+        self.cubo = cubo
+        self.metadados = metadados
+        chaves = ['nivel'] + list(DIMENSOES)
+        # A tabela está ordenada pelas chaves: cada combinação ocupa linhas contíguas
+        self._fatias = {
+            chave: (int(posicoes[0]), int(posicoes[-1]) + 1)
+            for chave, posicoes in cubo.groupby(chaves, observed=True, sort=False).indices.items()
+        }
+
+    def dimensoes(self):
+        """Dimensões encontradas no arquivo de origem (as demais têm um único membro)."""
+        return [dimensao for dimensao in DIMENSOES if dimensao in self.metadados['colunas_dimensoes']]
+
+    def membros(self, dimensao):
+        return list(self.metadados['membros'][dimensao])
+
+    def _fatia(self, nivel, combinacao):
+        inicio, fim = self._fatias.get((nivel,) + tuple(combinacao), (0, 0))
+        return self.cubo.iloc[inicio:fim]
+
+    def acumuladores(self, nivel='municipio', filtros=None):
+        """
+        Acumuladores do nível geográfico com os 'filtros' ({dimensão: membros}; ausente ou vazio = todos),
+        indexados pelo código. Um membro por dimensão é só uma busca; vários são somados.
+        """
+        filtros = filtros or {}
+        escolhas = [list(filtros.get(dimensao) or [TOTAL]) for dimensao in DIMENSOES]
+        colunas = agregados_ideb.nomes_colunas_acumuladores()
+        fatias = [self._fatia(nivel, combinacao) for combinacao in itertools.product(*escolhas)]
+        if len(fatias) == 1:
+            return fatias[0].set_index('codigo')[colunas]
+        return pd.concat(fatias).groupby('codigo', sort=True)[colunas].sum()
+
+    def consultar(self, nivel='municipio', filtros=None):
+        """
+        Média, contagem e desvio padrão das notas por código do nível geográfico, com os filtros.
+        No nível 'municipio', o resultado tem o formato de agregados_ideb.calcular_agregados_municipios.
+        """
+        agregados = agregados_ideb.finalizar_acumuladores(self.acumuladores(nivel, filtros).astype('float64'))
+        agregados.index.name = NIVEIS[nivel]
+        return agregados
+
+
+def ler_cubo(caminho, versao=None):
+    """Lê o cubo gravado; None se não existir, for de outro formato ou de outra versão da origem."""
+    if not os.path.exists(caminho):
+        return None
+    tabela = pq.read_table(caminho)
+    metadados = json.loads((tabela.schema.metadata or {}).get(CHAVE_METADADOS, b'{}'))
+    if metadados.get('versao_formato') != VERSAO_FORMATO:
+        return None
+    if versao is not None and metadados.get('versao_origem') != versao:
+        return None
+    return CuboIdeb(tabela.to_pandas(), metadados)
+
+
+def carregar_cubo(caminho_txt):
+    """Cubo do TXT, se gravado e atualizado (sem o TXT, ex: deploy só com os derivados, o cubo é aceito)."""
+    return ler_cubo(caminho_cubo(caminho_txt), versao_origem(caminho_txt))
+
+
+def descrever_filtros(filtros):
+    """Texto estável dos filtros ativos (para chaves de cache), ou '' sem filtros."""
+    partes = [f"{dimensao}={','.join(sorted(filtros[dimensao]))}" for dimensao in DIMENSOES if filtros.get(dimensao)]
+    return ';'.join(partes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monta o cubo do IDEB por rede, localização e etapa.")
+    parser.add_argument('arquivos', nargs='+', help="Arquivos ideb_escola_<ano>.txt")
+    parser.add_argument('--tamanho-bloco', type=int, default=agregados_ideb.TAMANHO_BLOCO_PADRAO, help="Linhas lidas por bloco.")
+    args = parser.parse_args()
+
+    for caminho_txt in args.arquivos:
+        inicio = time.perf_counter()
+        caminho, metadados = gerar_cubo(caminho_txt, args.tamanho_bloco)
+        segundos = time.perf_counter() - inicio
+        cubo = ler_cubo(caminho)
+        print(f"{caminho}: {len(cubo.cubo)} células, {os.path.getsize(caminho) / 1024:.0f} KB, {segundos:.1f} s")
+        for dimensao in DIMENSOES:
+            coluna = metadados['colunas_dimensoes'].get(dimensao)
+            situacao = f"coluna '{coluna}': {', '.join(metadados['membros'][dimensao])}" if coluna else "ausente no arquivo"
+            print(f"  {TITULOS_DIMENSOES[dimensao]}: {situacao}")
+
+
+if __name__ == "__main__":
+    main()
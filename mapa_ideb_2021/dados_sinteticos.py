@@ -0,0 +1,230 @@
+# Gerador de dados sintéticos no formato do INEP, para benchmarks e testes offline.
+# Produz, a partir de uma semente fixa (mesma semente = mesmos arquivos):
+#   - ideb_escola_<ano>.txt: delimitado por tabulação, em utf-8 ou latin-1, com colunas
+#     extras além das usadas pelo painel, nomes acentuados e linhas com ideb vazio ou 0;
+#   - municipios_br_<ano>.* e estados_br_<ano>.*: geometrias sintéticas dos 5.570 municípios
+#     (grade de células por estado, com fronteiras compartilhadas entre vizinhos), com as
+#     mesmas colunas do geobr (code_muni, name_muni, abbrev_state, ...).
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/dados_sinteticos.py /tmp/ideb_sintetico --escolas 2000000 --encoding latin-1
+
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import geometria_local
+import ingestao_ideb
+
+# Número de municípios de cada UF (IBGE), somando 5.570
+MUNICIPIOS_POR_UF = {
+    'RO': 52, 'AC': 22, 'AM': 62, 'RR': 15, 'PA': 144, 'AP': 16, 'TO': 139,
+    'MA': 217, 'PI': 224, 'CE': 184, 'RN': 167, 'PB': 223, 'PE': 185, 'AL': 102, 'SE': 75, 'BA': 417,
+    'MG': 853, 'ES': 78, 'RJ': 92, 'SP': 645,
+    'PR': 399, 'SC': 295, 'RS': 497,
+    'MS': 79, 'MT': 141, 'GO': 246, 'DF': 1,
+}
+
+# Colunas do arquivo gerado, na ordem. As que não estão em COLUNAS_NECESSARIAS existem
+# só para que a leitura com 'usecols' tenha colunas a descartar, como no arquivo real.
+COLUNAS_ARQUIVO = [
+    'ano', 'UF', 'cod_mun', 'nome_mun', 'id_escola', 'nome_escola', 'rede', 'localizacao', 'anos_escolares',
+    'taxa_aprovacao', 'indicador_rendimento', 'nota_matem', 'nota_portugues', 'nota_media_padronizada', 'ideb',
+]
+REDES = np.array(['Municipal', 'Estadual', 'Federal', 'Pública'])
+# Dimensões usadas pelo cubo (cubo_ideb.py)
+LOCALIZACOES = np.array(['Urbana', 'Rural'])
+ANOS_ESCOLARES = np.array(['Anos iniciais', 'Anos finais', 'Ensino médio'])
+PREFIXOS_NOME = np.array(['São', 'Santa', 'Nova', 'Bom Jesus do', 'Conceição do', 'Itaú de', 'Açailândia de', 'Paraíso do'])
+
+# Proporções de linhas com ideb ausente e com ideb 0 (ambas descartadas na limpeza)
+PROPORCAO_IDEB_VAZIO = 0.10
+PROPORCAO_IDEB_ZERO = 0.03
+# Proporção de notas ausentes (escolas sem Saeb em uma das disciplinas)
+PROPORCAO_NOTA_VAZIA = 0.02
+
+LINHAS_POR_BLOCO = 500_000
+SEMENTE_PADRAO = 2021
+
+
+def gerar_municipios(semente=SEMENTE_PADRAO):
+    """
+    Tabela dos 5.570 municípios sintéticos: código IBGE (código da UF + sequência),
+    nome, UF e um 'nível' médio de desempenho usado para gerar as notas das escolas.
+    """
+    codigos_uf = {sigla: codigo for codigo, sigla in ingestao_ideb.CODIGOS_IBGE_UF.items()}
+    rng = np.random.default_rng(semente)
+    partes = []
+    for uf, quantidade in MUNICIPIOS_POR_UF.items():
+        sequencia = np.arange(1, quantidade + 1)
+        partes.append(pd.DataFrame({
+            'cod_mun': codigos_uf[uf] * 100_000 + sequencia * 10,
+            'nome_mun': [f"{PREFIXOS_NOME[i % len(PREFIXOS_NOME)]} {uf} {i}" for i in sequencia],
+            'UF': uf,
+        }))
+    municipios = pd.concat(partes, ignore_index=True)
+    municipios['nivel'] = rng.normal(0, 1, len(municipios))
+    return municipios
+
+
+def _distribuir_escolas(n_municipios, n_escolas, rng):
+    """Número de escolas de cada município (distribuição log-normal, ao menos uma escola por município)."""
+    pesos = rng.lognormal(0, 1.2, n_municipios)
+    extras = rng.multinomial(max(n_escolas - n_municipios, 0), pesos / pesos.sum())
+    return extras + 1
+
+
+def gerar_blocos_escolas(n_escolas, semente=SEMENTE_PADRAO, ano=2021, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    Gera as linhas das escolas em blocos de até 'linhas_por_bloco' linhas (DataFrames com
+    as colunas de COLUNAS_ARQUIVO), sem montar o arquivo inteiro em memória.
+    """
+    municipios = gerar_municipios(semente)
+    rng = np.random.default_rng([semente, ano])
+    escolas_por_municipio = _distribuir_escolas(len(municipios), n_escolas, rng)
+    indice_municipio = np.repeat(np.arange(len(municipios)), escolas_por_municipio)
+    # Gerador à parte: as dimensões do cubo não alteram as demais colunas de uma mesma semente
+    rng_dimensoes = np.random.default_rng([semente, ano, 1])
+
+    for inicio in range(0, indice_municipio.size, linhas_por_bloco):
+        indices = indice_municipio[inicio:inicio + linhas_por_bloco]
+        n = indices.size
+        mun = municipios.iloc[indices]
+        nivel = mun['nivel'].to_numpy()
+        nota_matem = np.clip(rng.normal(220 + 18 * nivel, 22), 120, 350)
+        nota_portugues = np.clip(rng.normal(210 + 16 * nivel, 20), 120, 350)
+        rendimento = np.clip(rng.normal(0.9 + 0.03 * nivel, 0.05), 0.4, 1.0)
+        padronizada = np.clip((nota_matem + nota_portugues) / 2 / 50 + rng.normal(0, 0.2, n), 0, 10)
+        ideb = np.round(padronizada * rendimento, 1)
+
+        sorteio = rng.random(n)
+        ideb = np.where(sorteio < PROPORCAO_IDEB_VAZIO, np.nan, ideb)
+        ideb = np.where((sorteio >= PROPORCAO_IDEB_VAZIO) & (sorteio < PROPORCAO_IDEB_VAZIO + PROPORCAO_IDEB_ZERO), 0.0, ideb)
+        nota_matem = np.where(rng.random(n) < PROPORCAO_NOTA_VAZIA, np.nan, nota_matem)
+        nota_portugues = np.where(rng.random(n) < PROPORCAO_NOTA_VAZIA, np.nan, nota_portugues)
+
+        id_escola = np.arange(inicio, inicio + n) + 11_000_000
+        yield pd.DataFrame({
+            'ano': ano,
+            'UF': mun['UF'].to_numpy(),
+            'cod_mun': mun['cod_mun'].to_numpy(),
+            'nome_mun': mun['nome_mun'].to_numpy(),
+            'id_escola': id_escola,
+            'nome_escola': [f"Escola Estadual Professor João {i}" for i in id_escola],
+            'rede': REDES[rng.integers(0, len(REDES), n)],
+            'localizacao': LOCALIZACOES[(rng_dimensoes.random(n) < 0.3).astype(int)],
+            'anos_escolares': ANOS_ESCOLARES[rng_dimensoes.integers(0, len(ANOS_ESCOLARES), n)],
+            'taxa_aprovacao': np.round(rendimento * 100, 1),
+            'indicador_rendimento': np.round(rendimento, 2),
+            'nota_matem': np.round(nota_matem, 2),
+            'nota_portugues': np.round(nota_portugues, 2),
+            'nota_media_padronizada': np.round(padronizada, 2),
+            'ideb': ideb,
+        }, columns=COLUNAS_ARQUIVO)
+
+
+def escrever_txt_ideb(caminho, n_escolas, semente=SEMENTE_PADRAO, ano=2021, encoding='utf-8'):
+    """Grava um ideb_escola_<ano>.txt sintético (tabulação, sem índice). Retorna o número de linhas."""
+    total = 0
+    with open(caminho, 'w', encoding=encoding, newline='') as f:
+        for i, bloco in enumerate(gerar_blocos_escolas(n_escolas, semente, ano)):
+            bloco.to_csv(f, sep='\t', index=False, header=(i == 0))
+            total += len(bloco)
+    return total
+
+
+def gerar_geometrias(semente=SEMENTE_PADRAO, vertices_por_lado=8):
+    """
+    Geometrias sintéticas: cada UF é um retângulo em uma grade que cobre aproximadamente
+    a extensão do Brasil, dividido em células (municípios) que compartilham as fronteiras.
+    'vertices_por_lado' controla o detalhe das fronteiras (e portanto o tamanho dos mapas).
+    Retorna (municipios_gdf, estados_gdf) no CRS SIRGAS 2000 (EPSG:4674), como o geobr.
+    """
+    import geopandas
+    import shapely
+
+    municipios = gerar_municipios(semente)
+    ufs = list(MUNICIPIOS_POR_UF)
+    colunas_grade = 6
+    largura_uf, altura_uf = 39.0 / colunas_grade, 39.0 / math.ceil(len(ufs) / colunas_grade)
+
+    geometrias_estados, geometrias_municipios = [], []
+    for i, uf in enumerate(ufs):
+        x0 = -74.0 + (i % colunas_grade) * largura_uf
+        y0 = 5.0 - (i // colunas_grade + 1) * altura_uf
+        geometrias_estados.append(shapely.box(x0, y0, x0 + largura_uf, y0 + altura_uf))
+
+        quantidade = MUNICIPIOS_POR_UF[uf]
+        colunas = math.ceil(math.sqrt(quantidade))
+        linhas = math.ceil(quantidade / colunas)
+        dx, dy = largura_uf / colunas, altura_uf / linhas
+        for j in range(quantidade):
+            cx, cy = x0 + (j % colunas) * dx, y0 + (j // colunas) * dy
+            # A última célula de cada linha ocupa o resto da linha, para cobrir o estado sem lacunas
+            largura = dx * (colunas - j % colunas) if j == quantidade - 1 else dx
+            geometrias_municipios.append(shapely.box(cx, cy, cx + largura, cy + dy))
+
+    # Vértices intermediários deterministas: vizinhos recebem exatamente os mesmos pontos na fronteira
+    comprimento = min(largura_uf, altura_uf) / 30 / max(vertices_por_lado, 1)
+    geometrias_municipios = shapely.segmentize(np.array(geometrias_municipios), comprimento)
+
+    municipios_gdf = geopandas.GeoDataFrame({
+        'code_muni': municipios['cod_mun'].astype('float64'),
+        'name_muni': municipios['nome_mun'],
+        'code_state': municipios['cod_mun'] // 100_000,
+        'abbrev_state': municipios['UF'],
+    }, geometry=geometrias_municipios, crs='EPSG:4674')
+    estados_gdf = geopandas.GeoDataFrame({
+        'code_state': [municipios.loc[municipios['UF'] == uf, 'cod_mun'].iloc[0] // 100_000 for uf in ufs],
+        'abbrev_state': ufs,
+        'name_state': ufs,
+    }, geometry=geometrias_estados, crs='EPSG:4674')
+    return municipios_gdf, estados_gdf
+
+
+def gerar_conjunto(pasta, n_escolas, anos=(2021,), semente=SEMENTE_PADRAO, encoding='utf-8',
+                   ano_geo=2020, formatos=geometria_local.EXTENSOES):
+    """
+    Gera um conjunto completo na estrutura esperada pelos painéis:
+    <pasta>/ideb_escola_<ano>.txt e <pasta>/dados_geoespaciais/<nivel>_br_<ano_geo>.*
+    Retorna um dict com os caminhos gerados.
+    """
+    os.makedirs(pasta, exist_ok=True)
+    pasta_geo = os.path.join(pasta, 'dados_geoespaciais')
+    os.makedirs(pasta_geo, exist_ok=True)
+
+    arquivos_ideb = []
+    for ano in anos:
+        caminho = os.path.join(pasta, f"ideb_escola_{ano}.txt")
+        escrever_txt_ideb(caminho, n_escolas, semente, ano, encoding)
+        arquivos_ideb.append(caminho)
+
+    municipios_gdf, estados_gdf = gerar_geometrias(semente)
+    geometria_local.salvar_geometrias(municipios_gdf, pasta_geo, 'municipios', ano_geo, formatos)
+    geometria_local.salvar_geometrias(estados_gdf, pasta_geo, 'estados', ano_geo, formatos)
+    return {'ideb': arquivos_ideb, 'pasta_geo': pasta_geo, 'ano_geo': ano_geo}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera arquivos sintéticos do IDEB e geometrias no formato do painel.")
+    parser.add_argument('pasta', help="Pasta de saída.")
+    parser.add_argument('--escolas', type=int, default=200_000, help="Número de linhas (escolas) por arquivo.")
+    parser.add_argument('--anos', type=int, nargs='+', default=[2021])
+    parser.add_argument('--semente', type=int, default=SEMENTE_PADRAO)
+    parser.add_argument('--encoding', default='utf-8', choices=['utf-8', 'latin-1'])
+    parser.add_argument('--formatos', nargs='+', default=list(geometria_local.EXTENSOES), choices=geometria_local.EXTENSOES)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    gerados = gerar_conjunto(args.pasta, args.escolas, args.anos, args.semente, args.encoding, formatos=args.formatos)
+    for caminho in gerados['ideb']:
+        print(f"{caminho}: {os.path.getsize(caminho) / 1024 / 1024:.1f} MB")
+    print(f"Geometrias em '{gerados['pasta_geo']}'. Concluído em {time.perf_counter() - inicio:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
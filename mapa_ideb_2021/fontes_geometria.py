@@ -0,0 +1,106 @@
+# Fontes das geometrias de municípios e estados, escolhidas por configuração:
+#   'local:<pasta>'       arquivos em disco (GeoParquet, FlatGeobuf ou GeoJSON, o melhor disponível);
+#   'geoparquet:<pasta>'  somente o GeoParquet (leitura por estado, sem cair no GeoJSON);
+#   'geobr'               pacote geobr (wrapper Python do geobr do R, via rpy2; baixa da internet).
+# As bibliotecas de cada fonte (geopandas, geobr/rpy2) só são importadas na primeira leitura:
+# importar este módulo é barato, e um processo novo do Streamlit não paga a inicialização
+# do R nem o download quando os arquivos locais existem.
+#
+# Sem configuração explícita (argumento ou PAINEL_IDEB_FONTE_GEO), escolher_fonte() usa os
+# arquivos locais quando existem e o geobr caso contrário.
+
+import os
+
+import geometria_local
+
+
+class FonteArquivosLocais:
+    """Lê '<nivel>_br_<ano>.*' de uma pasta local, no melhor formato disponível (ou no 'formato' pedido)."""
+
+    prefixo = 'local'
+    formato = None
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.nome = f"{self.prefixo}:{pasta}"
+
+    def _formatos(self, nivel, ano):
+        formatos = geometria_local.formatos_disponiveis(self.pasta, nivel, ano)
+        return [ext for ext in formatos if self.formato in (None, ext)]
+
+    def disponivel(self, nivel, ano):
+        return bool(self._formatos(nivel, ano))
+
+    def leitura_por_estado(self, nivel, ano):
+        """Indica se ler um estado evita ler o Brasil inteiro (formato binário em disco)."""
+        return any(ext != 'geojson' for ext in self._formatos(nivel, ano))
+
+    def ler(self, nivel, ano, uf=None, bbox=None):
+        return geometria_local.ler_geometrias(self.pasta, nivel, ano, uf=uf, bbox=bbox, formato=self.formato)
+
+
+class FonteGeoParquet(FonteArquivosLocais):
+    """Como FonteArquivosLocais, mas apenas o GeoParquet ('<nivel>_br_<ano>.parquet')."""
+
+    prefixo = 'geoparquet'
+    formato = 'parquet'
+
+
+class FonteGeobr:
+    """
+    Baixa as geometrias com o pacote geobr. O import (que inicia o R via rpy2) acontece
+    só na primeira leitura. O geobr devolve sempre o Brasil inteiro; 'uf' filtra depois.
+    """
+
+    nome = 'geobr'
+
+    def __init__(self, simplificado=True):
+        self.simplificado = simplificado
+
+    def disponivel(self, nivel, ano):
+        return True # Não dá para saber sem baixar; os erros aparecem na leitura
+
+    def leitura_por_estado(self, nivel, ano):
+        return False
+
+    def ler(self, nivel, ano, uf=None, bbox=None):
+        import geobr # O wrapper Python para a biblioteca geobr do R
+        if nivel == 'municipios':
+            gdf = geobr.read_municipality(year=ano, simplified=self.simplificado)
+        elif nivel == 'estados':
+            gdf = geobr.read_state(year=ano, simplified=self.simplificado)
+        else:
+            raise ValueError(f"Nível geográfico desconhecido: '{nivel}'")
+        if uf is not None:
+            gdf = gdf[gdf['abbrev_state'] == uf].reset_index(drop=True)
+        return gdf
+
+
+FONTES = {
+    FonteArquivosLocais.prefixo: FonteArquivosLocais,
+    FonteGeoParquet.prefixo: FonteGeoParquet,
+}
+
+
+def criar_fonte(especificacao):
+    """'geobr', 'local:<pasta>' ou 'geoparquet:<pasta>' (o mesmo texto de fonte.nome)."""
+    if especificacao == FonteGeobr.nome:
+        return FonteGeobr()
+    prefixo, _, pasta = especificacao.partition(':')
+    if prefixo in FONTES and pasta:
+        return FONTES[prefixo](pasta)
+    raise ValueError(f"Fonte desconhecida: '{especificacao}' (use 'geobr', 'local:<pasta>' ou 'geoparquet:<pasta>').")
+
+
+def escolher_fonte(pasta_local, ano, especificacao=None):
+    """
+    Fonte configurada ('especificacao' ou PAINEL_IDEB_FONTE_GEO); sem configuração, os arquivos
+    de 'pasta_local' quando existem para o ano e o geobr caso contrário.
+    """
+    especificacao = especificacao or os.environ.get('PAINEL_IDEB_FONTE_GEO')
+    if especificacao:
+        return criar_fonte(especificacao)
+    fonte = FonteArquivosLocais(pasta_local)
+    if fonte.disponivel('municipios', ano) and fonte.disponivel('estados', ano):
+        return fonte
+    return FonteGeobr()
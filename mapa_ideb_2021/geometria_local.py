@@ -0,0 +1,120 @@
+# Armazenamento local das geometrias de municípios e estados.
+# Além do GeoJSON (texto, lido sempre por inteiro), as geometrias são gravadas em dois
+# formatos binários que permitem ler apenas um estado:
+#   - GeoParquet ordenado por UF, com um grupo de linhas por UF: o filtro por 'abbrev_state'
+#     usa as estatísticas (mínimo = máximo) de cada grupo e lê só o grupo do estado;
+#   - FlatGeobuf com índice espacial (R-tree empacotada): leitura por bbox.
+# Os leitores escolhem o melhor formato disponível e voltam para o GeoJSON se preciso.
+# O geopandas (e o pandas/pyarrow) só é importado na leitura e na gravação: verificar
+# quais arquivos existem é barato.
+
+import os
+
+# Formatos em ordem de preferência de leitura
+EXTENSOES = ('parquet', 'fgb', 'geojson')
+
+
+def caminho_geometria(pasta, nivel, ano, extensao):
+    """Ex: caminho_geometria('dados_geoespaciais', 'municipios', 2020, 'parquet')."""
+    return os.path.join(pasta, f"{nivel}_br_{ano}.{extensao}")
+
+
+def formatos_disponiveis(pasta, nivel, ano):
+    """Lista as extensões existentes em disco para o nível e ano, na ordem de preferência."""
+    return [ext for ext in EXTENSOES if os.path.exists(caminho_geometria(pasta, nivel, ano, ext))]
+
+
+def possui_leitura_por_estado(pasta, nivel, ano):
+    """Indica se há um formato binário que permite ler apenas um estado."""
+    return any(ext != 'geojson' for ext in formatos_disponiveis(pasta, nivel, ano))
+
+
+def salvar_geometrias(gdf, pasta, nivel, ano, formatos=EXTENSOES):
+    """
+    Grava o GeoDataFrame nos formatos pedidos (GeoJSON, GeoParquet e FlatGeobuf).
+    As linhas são ordenadas por UF para que cada estado fique contíguo no arquivo.
+    Retorna a lista de caminhos gravados.
+    """
+    if 'abbrev_state' in gdf.columns:
+        gdf = gdf.sort_values('abbrev_state', kind='stable').reset_index(drop=True)
+
+    caminhos = []
+    for ext in formatos:
+        caminho = caminho_geometria(pasta, nivel, ano, ext)
+        # Grava em um arquivo temporário e renomeia: uma falha no meio não deixa arquivo pela metade
+        # O nome temporário mantém a extensão: o GDAL decide o formato pela extensão
+        # (um caminho sem '.fgb' vira uma pasta no driver FlatGeobuf)
+        caminho_tmp = os.path.join(pasta, f".{nivel}_br_{ano}.tmp-{os.getpid()}.{ext}")
+        try:
+            if ext == 'geojson':
+                gdf.to_file(caminho_tmp, driver="GeoJSON")
+            elif ext == 'parquet':
+                _salvar_parquet_por_uf(gdf, caminho_tmp)
+            elif ext == 'fgb':
+                gdf.to_file(caminho_tmp, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+            else:
+                raise ValueError(f"Formato de geometria desconhecido: '{ext}'")
+            os.replace(caminho_tmp, caminho)
+        finally:
+            if os.path.exists(caminho_tmp):
+                os.remove(caminho_tmp)
+        caminhos.append(caminho)
+    return caminhos
+
+
+def _salvar_parquet_por_uf(gdf, caminho):
+    """
+    Grava o GeoParquet com um grupo de linhas por UF (linhas de UF desconhecida ficam em
+    um grupo à parte, no início). O geopandas monta o esquema e os metadados 'geo'; o
+    pyarrow regrava a tabela com os grupos nos limites das partições (particoes_uf.py).
+    """
+    if 'abbrev_state' not in gdf.columns:
+        gdf.to_parquet(caminho, index=False)
+        return
+
+    import io
+    import numpy as np
+    import pyarrow.parquet as pq
+    from particoes_uf import ParticoesUF
+
+    particoes = ParticoesUF(gdf, 'abbrev_state')
+    buffer = io.BytesIO()
+    particoes.df.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    tabela = pq.read_table(buffer)
+    limites = np.concatenate([[0], np.flatnonzero(np.diff(particoes.codigos)) + 1, [len(tabela)]])
+    with pq.ParquetWriter(caminho, tabela.schema) as escritor:
+        for inicio, fim in zip(limites[:-1], limites[1:]):
+            escritor.write_table(tabela.slice(inicio, fim - inicio), row_group_size=fim - inicio)
+
+
+def ler_geometrias(pasta, nivel, ano, uf=None, bbox=None, formato=None):
+    """
+    Lê as geometrias usando o melhor formato disponível (ou o 'formato' pedido).
+    Com 'uf', lê apenas as linhas daquele estado (filtro por 'abbrev_state');
+    com 'bbox' (xmin, ymin, xmax, ymax), o FlatGeobuf usa o índice espacial para
+    ler só as feições que intersectam o retângulo.
+    """
+    formatos = formatos_disponiveis(pasta, nivel, ano)
+    if formato is not None:
+        formatos = [ext for ext in formatos if ext == formato]
+    if not formatos:
+        raise FileNotFoundError(f"Nenhum arquivo de geometria encontrado para '{nivel}' ({ano}) em '{pasta}'.")
+    ext = formatos[0]
+    caminho = caminho_geometria(pasta, nivel, ano, ext)
+
+    import geopandas
+    if ext == 'parquet':
+        filtros = [('abbrev_state', '=', uf)] if uf is not None else None
+        gdf = geopandas.read_parquet(caminho, filters=filtros)
+    else:
+        kwargs = {}
+        if bbox is not None:
+            kwargs['bbox'] = tuple(bbox)
+        if uf is not None:
+            kwargs['where'] = f"abbrev_state = '{uf}'"
+        gdf = geopandas.read_file(caminho, **kwargs)
+
+    if uf is not None and 'abbrev_state' in gdf.columns:
+        gdf = gdf[gdf['abbrev_state'] == uf].reset_index(drop=True)
+    return gdf
@@ -0,0 +1,200 @@
+# Geometrias simplificadas em várias resoluções para os mapas Folium.
+# Para cada estado, pré-calcula versões simplificadas dos municípios em alguns níveis de
+# tolerância, preservando a topologia (fronteiras compartilhadas continuam encaixadas),
+# com coordenadas quantizadas e em TopoJSON, onde cada fronteira é gravada uma única vez.
+# O construtor do mapa enquadra o estado (fit_bounds) e escolhe o nível de acordo com o
+# tamanho de um pixel no zoom que o Leaflet usa para esse enquadramento.
+#
+# O pacote 'topojson' é opcional: sem ele, as geometrias são simplificadas como cobertura
+# (shapely.coverage_simplify) e enviadas como GeoJSON com coordenadas arredondadas.
+#
+# Os arquivos gravados guardam a versão das geometrias de origem (ver
+# armazem_compartilhado.versao_geometrias) e são ignorados se ela mudar.
+#
+# Uso (a partir da raiz do repositório), para gravar os arquivos de todos os estados:
+#   python mapa_ideb_2021/geometria_simplificada.py mapa_ideb_2021/dados_geoespaciais 2020
+
+import argparse
+import json
+import os
+
+import numpy as np
+import shapely
+
+import armazem_compartilhado
+import fontes_geometria
+
+try:
+    import topojson
+except ImportError:
+    topojson = None
+
+# Tolerância de simplificação (em graus) de cada nível. 0.001° ≈ 110 m no equador.
+NIVEIS_RESOLUCAO = {
+    'alta': 0.001,
+    'media': 0.005,
+    'baixa': 0.02,
+}
+
+# Quantização do TopoJSON (número de posições por eixo) e grade equivalente para o GeoJSON
+QUANTIZACAO = 100_000
+CASAS_DECIMAIS_GEOJSON = 4
+
+OBJETO_TOPOJSON = 'municipios'
+COLUNAS_PROPRIEDADES = ['code_muni', 'name_muni']
+
+# Pirâmide de tiles do Leaflet (Web Mercator)
+TAMANHO_TILE = 256
+ZOOM_MAXIMO = 18
+
+
+def _mercator_y(latitude):
+    return np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2))
+
+
+def zoom_enquadramento(bounds, largura_px, altura_px):
+    """Zoom (inteiro) que o Leaflet escolhe no fit_bounds de 'bounds' (xmin, ymin, xmax, ymax) em largura x altura pixels."""
+    xmin, ymin, xmax, ymax = bounds
+    largura_zoom0 = TAMANHO_TILE * max(xmax - xmin, 1e-9) / 360
+    altura_zoom0 = TAMANHO_TILE * max(_mercator_y(ymax) - _mercator_y(ymin), 1e-9) / (2 * np.pi)
+    zoom = np.floor(min(np.log2(largura_px / largura_zoom0), np.log2(altura_px / altura_zoom0)))
+    return int(np.clip(zoom, 0, ZOOM_MAXIMO))
+
+
+def escolher_nivel(bounds, largura_px, altura_px=None):
+    """
+    Escolhe o nível de resolução para um mapa enquadrado em 'bounds' (fit_bounds) com
+    'largura_px' x 'altura_px' pixels (altura igual à largura se omitida): o nível mais
+    simplificado cuja tolerância ainda é menor que o tamanho de um pixel nesse zoom
+    (detalhes menores que um pixel não aparecem na tela).
+    """
+    zoom = zoom_enquadramento(bounds, max(largura_px, 1), max(altura_px or largura_px, 1))
+    graus_por_pixel = 360 / (TAMANHO_TILE * 2 ** zoom)
+    candidatos = [nivel for nivel, tol in NIVEIS_RESOLUCAO.items() if tol <= graus_por_pixel]
+    if not candidatos:
+        return min(NIVEIS_RESOLUCAO, key=NIVEIS_RESOLUCAO.get)
+    return max(candidatos, key=NIVEIS_RESOLUCAO.get)
+
+
+def simplificar_cobertura(geometrias, tolerancia):
+    """
+    Simplifica um conjunto de polígonos vizinhos sem abrir buracos nem sobreposições
+    entre eles. Usa shapely.coverage_simplify (shapely >= 2.1) quando disponível.
+    """
+    geometrias = np.asarray(geometrias)
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geometrias, tolerancia)
+    return shapely.simplify(geometrias, tolerancia, preserve_topology=True)
+
+
+def preparar_niveis_estado(muni_estado_gdf):
+    """
+    Gera as geometrias de um estado em todos os níveis de resolução.
+    Retorna {nivel: {'formato': 'topojson' | 'geojson', 'dados': dict}}.
+    """
+    base = muni_estado_gdf[COLUNAS_PROPRIEDADES + ['geometry']].copy()
+    base['code_muni'] = base['code_muni'].astype('int64')
+    niveis = {}
+
+    if topojson is not None:
+        # A topologia é construída uma vez; cada nível só simplifica os arcos compartilhados
+        topologia = topojson.Topology(base, prequantize=QUANTIZACAO, object_name=OBJETO_TOPOJSON)
+        for nivel, tolerancia in NIVEIS_RESOLUCAO.items():
+            dados = json.loads(topologia.toposimplify(tolerancia).to_json())
+            niveis[nivel] = {'formato': 'topojson', 'dados': dados}
+        return niveis
+
+    grade = 10 ** -CASAS_DECIMAIS_GEOJSON
+    for nivel, tolerancia in NIVEIS_RESOLUCAO.items():
+        simplificado = base.copy()
+        geometrias = simplificar_cobertura(base.geometry.values, tolerancia)
+        simplificado['geometry'] = shapely.set_precision(geometrias, grade)
+        niveis[nivel] = {'formato': 'geojson', 'dados': json.loads(simplificado.to_json())}
+    return niveis
+
+
+def _elementos(payload):
+    """Lista de feições (GeoJSON) ou geometrias (TopoJSON) do payload."""
+    if payload['formato'] == 'topojson':
+        return payload['dados']['objects'][OBJETO_TOPOJSON]['geometries']
+    return payload['dados']['features']
+
+
+def montar_payload(payload, valores, coluna_codigo='code_muni'):
+    """
+    Monta o payload para o mapa: mantém apenas os municípios presentes em 'valores'
+    e acrescenta às propriedades de cada um os valores das métricas.
+    'valores' é um dict {código do município: {coluna: valor}}.
+    Os arcos/coordenadas não são copiados, apenas as propriedades.
+    """
+    elementos = []
+    for elemento in _elementos(payload):
+        codigo = int(elemento['properties'][coluna_codigo])
+        if codigo not in valores:
+            continue
+        propriedades = dict(elemento['properties'], **valores[codigo])
+        elementos.append(dict(elemento, properties=propriedades))
+
+    dados = dict(payload['dados'])
+    if payload['formato'] == 'topojson':
+        objeto = dict(dados['objects'][OBJETO_TOPOJSON], geometries=elementos)
+        dados['objects'] = dict(dados['objects'], **{OBJETO_TOPOJSON: objeto})
+    else:
+        dados['features'] = elementos
+    return {'formato': payload['formato'], 'dados': dados}
+
+
+def caminho_niveis_estado(pasta, ano, sigla_estado):
+    return os.path.join(pasta, f"simplificadas_{ano}", f"{sigla_estado}.json")
+
+
+def salvar_niveis_estado(niveis, pasta, ano, sigla_estado, versao_geometrias):
+    caminho = caminho_niveis_estado(pasta, ano, sigla_estado)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    caminho_tmp = caminho + '.tmp'
+    with open(caminho_tmp, 'w', encoding='utf-8') as f:
+        json.dump({'versao_geometrias': versao_geometrias, 'niveis': niveis}, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(caminho_tmp, caminho)
+    return caminho
+
+
+def ler_niveis_estado(pasta, ano, sigla_estado, versao_geometrias):
+    """Lê os níveis pré-calculados de um estado; None se não existirem ou se vieram de outras geometrias."""
+    caminho = caminho_niveis_estado(pasta, ano, sigla_estado)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        gravado = json.load(f)
+    if gravado.get('versao_geometrias') != versao_geometrias:
+        return None
+    return gravado['niveis']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-calcula geometrias simplificadas (TopoJSON) por estado.")
+    parser.add_argument('pasta', help="Pasta com os arquivos municipios_br_<ano>.*")
+    parser.add_argument('ano', type=int)
+    parser.add_argument('--estados', nargs='*', help="Siglas dos estados (padrão: todos).")
+    parser.add_argument('--fonte-geo', help="Fonte das geometrias (padrão: arquivos da pasta ou geobr; ver fontes_geometria.py)")
+    args = parser.parse_args()
+
+    if topojson is None:
+        print("Pacote 'topojson' não instalado: as geometrias serão gravadas como GeoJSON simplificado.")
+
+    fonte = fontes_geometria.escolher_fonte(args.pasta, args.ano, args.fonte_geo)
+    versao = armazem_compartilhado.versao_geometrias(fonte, 'municipios', args.ano)
+    municipios_gdf = fonte.ler("municipios", args.ano)
+    estados = args.estados or sorted(municipios_gdf['abbrev_state'].unique())
+    for sigla in estados:
+        muni_estado_gdf = municipios_gdf[municipios_gdf['abbrev_state'] == sigla]
+        if muni_estado_gdf.empty:
+            print(f"{sigla}: nenhum município encontrado, ignorado.")
+            continue
+        niveis = preparar_niveis_estado(muni_estado_gdf)
+        caminho = salvar_niveis_estado(niveis, args.pasta, args.ano, sigla, versao)
+        tamanhos = ', '.join(f"{nivel} {len(json.dumps(p['dados'])) / 1024:.0f} KB" for nivel, p in niveis.items())
+        print(f"{sigla}: {caminho} ({tamanhos})")
+
+
+if __name__ == "__main__":
+    main()
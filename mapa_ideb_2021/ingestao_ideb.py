@@ -0,0 +1,235 @@
+# Estágio de ingestão dos dados do IDEB.
+# Converte UMA VEZ o arquivo TXT bruto do INEP (ideb_escola_*.txt, delimitado por tabulação)
+# em um arquivo Parquet tipado e apenas com as colunas usadas pelo painel, acompanhado
+# de um manifesto JSON com o hash do arquivo de origem.
+# Os painéis leem o Parquet quando ele existe e voltam para o TXT caso contrário.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/ingestao_ideb.py mapa_ideb_2021/ideb_escola_2021.txt
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+# Colunas que são realmente necessárias para o painel
+COLUNAS_NECESSARIAS = ['UF', 'cod_mun', 'nome_mun', 'ideb', 'nota_matem', 'nota_portugues']
+COLUNAS_NUMERICAS = ['ideb', 'nota_matem', 'nota_portugues']
+
+# Lista fixa de UFs: garante que os códigos da coluna categórica 'UF' sejam os mesmos em todos os arquivos
+UFS_BRASIL = [
+    'AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA',
+    'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO',
+]
+
+# Código IBGE da UF -> sigla. Os dois primeiros dígitos do código do município (cod_mun) são o código da UF.
+CODIGOS_IBGE_UF = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+
+VERSAO_FORMATO = 1
+
+
+def ler_txt_ideb(caminho_arquivo, encoding_inicial='utf-8', colunas_opcionais=(), **kwargs):
+    """
+    Lê o arquivo TXT do IDEB carregando apenas as colunas necessárias.
+    Tenta utf-8 e, se falhar, latin-1 (comum em arquivos brasileiros).
+    'colunas_opcionais' são lidas (como texto) quando existem no arquivo (ex: dimensões do cubo_ideb.py).
+    Argumentos extras (ex: chunksize) são repassados para pd.read_csv; com chunksize,
+    um erro de encoding só aparece durante a iteração e deve ser tratado por quem lê.
+    """
+    encodings = ('utf-8', 'latin-1') if encoding_inicial == 'utf-8' else (encoding_inicial,)
+    for encoding in encodings:
+        try:
+            # Lê apenas o cabeçalho para validar as colunas antes do parse completo
+            cabecalho = pd.read_csv(caminho_arquivo, sep='\t', encoding=encoding, nrows=0)
+            for col in COLUNAS_NECESSARIAS:
+                if col not in cabecalho.columns:
+                    raise ValueError(f"Coluna essencial '{col}' não encontrada no arquivo '{caminho_arquivo}'. Verifique o conteúdo do arquivo.")
+
+            opcionais = [col for col in colunas_opcionais if col in cabecalho.columns]
+            # As notas são lidas como texto e convertidas depois com pd.to_numeric,
+            # assim valores inválidos (ex: '-') viram NaN em vez de derrubar a leitura.
+            return pd.read_csv(
+                caminho_arquivo, sep='\t', encoding=encoding,
+                usecols=COLUNAS_NECESSARIAS + opcionais,
+                dtype=dict({'UF': 'category', 'cod_mun': str, 'nome_mun': str,
+                            'ideb': str, 'nota_matem': str, 'nota_portugues': str}, **{col: str for col in opcionais}),
+                **kwargs
+            )
+        except UnicodeDecodeError:
+            if encoding == encodings[-1]:
+                raise
+    return None
+
+
+def limpar_dados_ideb(df, colunas_extras=()):
+    """
+    Aplica as regras de limpeza do painel e converte para tipos compactos:
+    UF como categoria, cod_mun como int32 e notas como float32.
+    Remove linhas com 'ideb' ausente ou igual a 0 e com 'cod_mun' inválido.
+    'colunas_extras' presentes em 'df' são mantidas sem conversão.
+    """
+    df = df[COLUNAS_NECESSARIAS + [col for col in colunas_extras if col in df.columns]].copy()
+    for col in COLUNAS_NUMERICAS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+
+    cod_mun = pd.to_numeric(df['cod_mun'], errors='coerce')
+    validos = df['ideb'].notna() & (df['ideb'] != 0) & cod_mun.notna()
+    df = df[validos].copy()
+    df['cod_mun'] = cod_mun[validos].astype('int32')
+    df['UF'] = pd.Categorical(df['UF'].astype(str), categories=UFS_BRASIL)
+    df['nome_mun'] = df['nome_mun'].astype(str)
+    return df.reset_index(drop=True)
+
+
+def calcular_hash_arquivo(caminho_arquivo, tamanho_bloco=1 << 20):
+    """Calcula o hash SHA-256 de um arquivo lendo-o em blocos."""
+    h = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def caminhos_colunares(caminho_txt):
+    """Retorna os caminhos (parquet, manifesto) gerados ao lado do arquivo TXT."""
+    base = os.path.splitext(caminho_txt)[0]
+    return base + '.parquet', base + '.manifesto.json'
+
+
+def _escrever_atomico(caminho, escrever):
+    """Escreve em um arquivo temporário e renomeia, para nunca deixar um arquivo pela metade."""
+    caminho_tmp = caminho + '.tmp'
+    try:
+        escrever(caminho_tmp)
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+
+
+def converter_txt_para_parquet(caminho_txt, caminho_parquet=None):
+    """
+    Converte o TXT do IDEB em um Parquet tipado e com colunas podadas,
+    e grava o manifesto com o hash do arquivo de origem. Retorna o manifesto.
+    """
+    caminho_padrao, caminho_manifesto = caminhos_colunares(caminho_txt)
+    caminho_parquet = caminho_parquet or caminho_padrao
+    if caminho_parquet != caminho_padrao:
+        caminho_manifesto = os.path.splitext(caminho_parquet)[0] + '.manifesto.json'
+
+    inicio = time.perf_counter()
+    df = limpar_dados_ideb(ler_txt_ideb(caminho_txt))
+    _escrever_atomico(caminho_parquet, lambda p: df.to_parquet(p, index=False, engine='pyarrow'))
+
+    stat = os.stat(caminho_txt)
+    manifesto = {
+        'versao_formato': VERSAO_FORMATO,
+        'arquivo_origem': os.path.basename(caminho_txt),
+        'sha256_origem': calcular_hash_arquivo(caminho_txt),
+        'tamanho_origem': stat.st_size,
+        'mtime_origem': stat.st_mtime_ns,
+        'arquivo_parquet': os.path.basename(caminho_parquet),
+        'linhas': int(len(df)),
+        'colunas': {col: str(dtype) for col, dtype in df.dtypes.items()},
+        'segundos_conversao': round(time.perf_counter() - inicio, 3),
+    }
+
+    def _gravar_manifesto(p):
+        with open(p, 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+    _escrever_atomico(caminho_manifesto, _gravar_manifesto)
+    return manifesto
+
+
+def ler_manifesto(caminho_txt):
+    """Lê o manifesto associado ao TXT, ou retorna None se ele não existir."""
+    _, caminho_manifesto = caminhos_colunares(caminho_txt)
+    if not os.path.exists(caminho_manifesto):
+        return None
+    with open(caminho_manifesto, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parquet_atualizado(caminho_txt):
+    """
+    Indica se o Parquet gerado a partir do TXT existe e continua válido.
+    Para não recalcular o hash de um arquivo de centenas de MB a cada inicialização,
+    compara tamanho e data de modificação registrados no manifesto.
+    Se o TXT não estiver presente (ex: deploy apenas com o Parquet), o Parquet é usado.
+    """
+    caminho_parquet, _ = caminhos_colunares(caminho_txt)
+    manifesto = ler_manifesto(caminho_txt)
+    if manifesto is None or not os.path.exists(caminho_parquet):
+        return False
+    if manifesto.get('versao_formato') != VERSAO_FORMATO:
+        return False
+    if not os.path.exists(caminho_txt):
+        return True
+    stat = os.stat(caminho_txt)
+    return stat.st_size == manifesto['tamanho_origem'] and stat.st_mtime_ns == manifesto['mtime_origem']
+
+
+def versao_dados(caminho_txt):
+    """
+    Identificador da versão dos dados do IDEB, usado em chaves de cache:
+    o hash do arquivo de origem registrado no manifesto (se o Parquet estiver atualizado)
+    ou, na falta dele, tamanho e data de modificação do TXT.
+    """
+    if parquet_atualizado(caminho_txt):
+        return ler_manifesto(caminho_txt)['sha256_origem'][:16]
+    if os.path.exists(caminho_txt):
+        stat = os.stat(caminho_txt)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+    return 'desconhecida'
+
+
+def carregar_ideb_colunar(caminho_txt):
+    """
+    Carrega os dados do IDEB a partir do Parquet gerado pela ingestão.
+    Retorna None se o Parquet não existir ou estiver desatualizado em relação ao TXT.
+    """
+    if not parquet_atualizado(caminho_txt):
+        return None
+    caminho_parquet, _ = caminhos_colunares(caminho_txt)
+    df = pd.read_parquet(caminho_parquet, engine='pyarrow')
+    # Garante as categorias fixas de UF mesmo que o Parquet tenha sido gerado com um subconjunto
+    df['UF'] = pd.Categorical(df['UF'].astype(str), categories=UFS_BRASIL)
+    return df
+
+
+def carregar_ideb(caminho_txt):
+    """Carrega os dados do IDEB limpos: do Parquet quando disponível, senão do TXT."""
+    df = carregar_ideb_colunar(caminho_txt)
+    if df is None:
+        df = limpar_dados_ideb(ler_txt_ideb(caminho_txt))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte arquivos ideb_escola_*.txt em Parquet tipado.")
+    parser.add_argument('arquivos', nargs='+', help="Arquivos TXT do IDEB (delimitados por tabulação).")
+    parser.add_argument('--forcar', action='store_true', help="Converte mesmo que o Parquet já esteja atualizado.")
+    args = parser.parse_args()
+
+    for caminho_txt in args.arquivos:
+        if not args.forcar and parquet_atualizado(caminho_txt):
+            print(f"'{caminho_txt}' já convertido, nada a fazer.")
+            continue
+        print(f"Convertendo '{caminho_txt}'...")
+        manifesto = converter_txt_para_parquet(caminho_txt)
+        print(f"  {manifesto['linhas']} linhas salvas em '{manifesto['arquivo_parquet']}' "
+              f"({manifesto['segundos_conversao']} s, sha256 {manifesto['sha256_origem'][:12]}...)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# Instrumentação das etapas do painel (carga, filtro por UF, agregação, mapas).
+# Cada rerun do Streamlit abre uma "execução" e cada etapa registra:
+#   - tempo de parede;
+#   - pico de memória alocada durante a etapa (só com tracemalloc ativo, que tem custo);
+#   - número de linhas produzidas, bytes do payload (HTML dos mapas) e acerto/falha de cache.
+# Para saber se uma função com @st.cache_data/@st.cache_resource foi realmente executada,
+# o corpo da função chama registrar_falha_cache(): se a etapa termina sem essa chamada,
+# o resultado veio do cache.
+# Etapas executadas em outras threads durante o rerun (ex: carga_paralela.py) entram na mesma
+# execução se a thread chamar vincular_execucao(); cada thread tem a sua pilha de etapas
+# aninhadas. O pico de memória é global: em etapas simultâneas, inclui as alocações das outras.
+#
+# As execuções podem ser exportadas (variáveis de ambiente):
+#   PAINEL_IDEB_LOG_ETAPAS=/caminho/etapas.jsonl     uma linha JSON por rerun
+#   PAINEL_IDEB_PROMETHEUS=/caminho/painel_ideb.prom  métricas no formato texto do Prometheus
+#                                                     (ex: coletor textfile do node_exporter)
+#   PAINEL_IDEB_MEDIR_MEMORIA=1                       ativa o tracemalloc desde o início
+#                                                     (e o painel não o desliga)
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PREFIXO_PROMETHEUS = 'painel_ideb'
+
+_local = threading.local() # Execução atual de cada sessão (o Streamlit roda cada sessão em uma thread)
+_trava_totais = threading.Lock()
+_totais = {} # etapa -> totais acumulados no processo (para os contadores do Prometheus)
+_execucoes_totais = 0
+
+
+def memoria_ativa():
+    return tracemalloc.is_tracing()
+
+
+def memoria_fixada_por_ambiente():
+    """Indica se PAINEL_IDEB_MEDIR_MEMORIA=1 mantém o tracemalloc ligado no processo."""
+    return os.environ.get('PAINEL_IDEB_MEDIR_MEMORIA') == '1'
+
+
+def ativar_memoria(ativar=True):
+    """
+    Liga ou desliga o tracemalloc. Vale para o processo inteiro (todas as sessões):
+    chamar só em uma ação explícita, nunca a cada rerun. Com PAINEL_IDEB_MEDIR_MEMORIA=1,
+    o tracemalloc não é desligado.
+    """
+    if ativar and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not ativar and tracemalloc.is_tracing() and not memoria_fixada_por_ambiente():
+        tracemalloc.stop()
+
+
+class Etapa:
+    """Medições de uma etapa. 'linhas', 'bytes' e 'cache' podem ser preenchidos dentro do bloco."""
+
+    def __init__(self, nome, cache=False):
+        self.nome = nome
+        self.segundos = None
+        self.pico_memoria = None
+        self.linhas = None
+        self.bytes = None
+        # None: etapa sem cache; 'acerto'/'falha' para etapas que consultam um cache
+        self.cache = 'acerto' if cache else None
+        self._pico_guardado = 0
+
+    def como_dict(self):
+        return {
+            'etapa': self.nome,
+            'segundos': self.segundos,
+            'pico_memoria_bytes': self.pico_memoria,
+            'linhas': self.linhas,
+            'bytes': self.bytes,
+            'cache': self.cache,
+        }
+
+
+class Execucao:
+    """Etapas medidas em um rerun do painel, na ordem em que terminaram."""
+
+    def __init__(self):
+        self.inicio = time.time()
+        self._relogio = time.perf_counter()
+        self.segundos = None
+        self.etapas = []
+        self._pilhas = threading.local() # Etapas abertas em cada thread
+
+    @property
+    def _pilha(self):
+        pilha = getattr(self._pilhas, 'pilha', None)
+        if pilha is None:
+            pilha = self._pilhas.pilha = []
+        return pilha
+
+    @contextmanager
+    def etapa(self, nome, cache=False):
+        medicao = Etapa(nome, cache)
+        memoria_inicial = None
+        if memoria_ativa():
+            atual, pico = tracemalloc.get_traced_memory()
+            if self._pilha:
+                # O pico é global: guarda o da etapa externa antes de zerá-lo para a interna
+                self._pilha[-1]._pico_guardado = max(self._pilha[-1]._pico_guardado, pico)
+            tracemalloc.reset_peak()
+            memoria_inicial = atual
+        self._pilha.append(medicao)
+        inicio = time.perf_counter()
+        try:
+            yield medicao
+        finally:
+            medicao.segundos = time.perf_counter() - inicio
+            self._pilha.pop()
+            if memoria_inicial is not None and memoria_ativa():
+                pico = max(tracemalloc.get_traced_memory()[1], medicao._pico_guardado)
+                medicao.pico_memoria = max(pico - memoria_inicial, 0)
+                if self._pilha:
+                    self._pilha[-1]._pico_guardado = max(self._pilha[-1]._pico_guardado, pico)
+            self.etapas.append(medicao)
+
+    def registrar_falha_cache(self):
+        """Marca a etapa aberta mais interna como falha de cache (o corpo da função cacheada rodou)."""
+        for medicao in reversed(self._pilha):
+            if medicao.cache is not None:
+                medicao.cache = 'falha'
+                return
+
+    def finalizar(self):
+        self.segundos = time.perf_counter() - self._relogio
+        return self
+
+    def como_dict(self):
+        return {
+            'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+            'segundos': self.segundos,
+            'memoria_medida': any(m.pico_memoria is not None for m in self.etapas),
+            'etapas': [m.como_dict() for m in self.etapas],
+        }
+
+
+def iniciar_execucao():
+    """Abre a execução do rerun atual (chamar no início do script)."""
+    if memoria_fixada_por_ambiente():
+        ativar_memoria(True)
+    _local.execucao = Execucao()
+    return _local.execucao
+
+
+def execucao_atual():
+    """Execução do rerun atual; fora do painel (ex: scripts), cria uma execução avulsa."""
+    execucao = getattr(_local, 'execucao', None)
+    if execucao is None:
+        execucao = iniciar_execucao()
+    return execucao
+
+
+def vincular_execucao(execucao):
+    """Faz a thread atual registrar suas etapas em 'execucao' (ex: threads de um pool abertas no rerun)."""
+    _local.execucao = execucao
+
+
+def etapa(nome, cache=False):
+    """Context manager: with instrumentacao.etapa('filtro_uf') as medicao: ..."""
+    return execucao_atual().etapa(nome, cache)
+
+
+def registrar_falha_cache():
+    execucao_atual().registrar_falha_cache()
+
+
+def _contar_linhas(resultado):
+    """Linhas de um DataFrame, ou do primeiro DataFrame de uma tupla (ex: (municipios, estados))."""
+    if isinstance(resultado, tuple):
+        for item in resultado:
+            if hasattr(item, 'shape'):
+                return int(item.shape[0])
+        return None
+    if hasattr(resultado, 'shape'):
+        return int(resultado.shape[0])
+    return None
+
+
+def instrumentar(nome=None, cache=False):
+    """
+    Decorador que mede cada chamada da função como uma etapa.
+    Deve ficar ACIMA de @st.cache_data/@st.cache_resource, para medir também os acertos de cache.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            with etapa(nome or funcao.__name__, cache) as medicao:
+                resultado = funcao(*args, **kwargs)
+                medicao.linhas = _contar_linhas(resultado)
+            return resultado
+        return envoltorio
+    return decorador
+
+
+def _acumular_totais(execucao):
+    global _execucoes_totais
+    with _trava_totais:
+        _execucoes_totais += 1
+        for medicao in execucao.etapas:
+            totais = _totais.setdefault(medicao.nome, {'execucoes': 0, 'segundos': 0.0, 'acertos': 0, 'falhas': 0})
+            totais['execucoes'] += 1
+            totais['segundos'] += medicao.segundos
+            if medicao.cache == 'acerto':
+                totais['acertos'] += 1
+            elif medicao.cache == 'falha':
+                totais['falhas'] += 1
+
+
+def resumo_por_etapa(execucao):
+    """
+    Junta as medições de mesmo nome de uma execução (ex: a construção de três mapas):
+    soma tempos, linhas e bytes e fica com o maior pico de memória.
+    """
+    resumo = {}
+    for m in execucao.etapas:
+        item = resumo.setdefault(m.nome, {'segundos': 0.0, 'pico_memoria': None, 'linhas': None, 'bytes': None})
+        item['segundos'] += m.segundos
+        for campo, valor in (('linhas', m.linhas), ('bytes', m.bytes)):
+            if valor is not None:
+                item[campo] = (item[campo] or 0) + valor
+        if m.pico_memoria is not None:
+            item['pico_memoria'] = max(item['pico_memoria'] or 0, m.pico_memoria)
+    return resumo
+
+
+def formatar_prometheus(execucao):
+    """Métricas da última execução (gauges) e totais do processo (counters) no formato texto do Prometheus."""
+    p = PREFIXO_PROMETHEUS
+    resumo = resumo_por_etapa(execucao)
+    linhas = [
+        f"# HELP {p}_etapa_segundos Duração da etapa no último rerun.",
+        f"# TYPE {p}_etapa_segundos gauge",
+    ]
+    linhas += [f'{p}_etapa_segundos{{etapa="{nome}"}} {v["segundos"]:.6f}' for nome, v in resumo.items()]
+    for campo, metrica, descricao in (
+        ('pico_memoria', 'etapa_pico_memoria_bytes', "Pico de memória alocada na etapa (tracemalloc)."),
+        ('linhas', 'etapa_linhas', "Linhas produzidas pela etapa."),
+        ('bytes', 'etapa_payload_bytes', "Bytes do payload gerado na etapa."),
+    ):
+        medidas = {nome: v[campo] for nome, v in resumo.items() if v[campo] is not None}
+        if medidas:
+            linhas += [f"# HELP {p}_{metrica} {descricao}", f"# TYPE {p}_{metrica} gauge"]
+            linhas += [f'{p}_{metrica}{{etapa="{nome}"}} {valor}' for nome, valor in medidas.items()]
+
+    with _trava_totais:
+        totais = {nome: dict(valores) for nome, valores in _totais.items()}
+        execucoes_totais = _execucoes_totais
+    linhas += [f"# HELP {p}_reruns_total Reruns do painel medidos neste processo.",
+               f"# TYPE {p}_reruns_total counter",
+               f"{p}_reruns_total {execucoes_totais}",
+               f"# HELP {p}_etapa_segundos_total Tempo acumulado de cada etapa.",
+               f"# TYPE {p}_etapa_segundos_total counter"]
+    linhas += [f'{p}_etapa_segundos_total{{etapa="{nome}"}} {v["segundos"]:.6f}' for nome, v in sorted(totais.items())]
+    linhas += [f"# HELP {p}_etapa_cache_total Consultas ao cache de cada etapa, por resultado.",
+               f"# TYPE {p}_etapa_cache_total counter"]
+    for nome, v in sorted(totais.items()):
+        if v['acertos'] or v['falhas']:
+            linhas.append(f'{p}_etapa_cache_total{{etapa="{nome}",resultado="acerto"}} {v["acertos"]}')
+            linhas.append(f'{p}_etapa_cache_total{{etapa="{nome}",resultado="falha"}} {v["falhas"]}')
+    return "\n".join(linhas) + "\n"
+
+
+def _gravar_atomico(caminho, texto):
+    caminho_tmp = f"{caminho}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(caminho_tmp, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(caminho_tmp, caminho)
+
+
+def finalizar_execucao():
+    """
+    Fecha a execução do rerun atual, acumula os totais do processo e exporta para os
+    arquivos configurados nas variáveis de ambiente. Retorna a execução.
+    """
+    execucao = execucao_atual().finalizar()
+    _acumular_totais(execucao)
+
+    caminho_log = os.environ.get('PAINEL_IDEB_LOG_ETAPAS')
+    if caminho_log:
+        with _trava_totais, open(caminho_log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(execucao.como_dict(), ensure_ascii=False) + "\n")
+    caminho_prometheus = os.environ.get('PAINEL_IDEB_PROMETHEUS')
+    if caminho_prometheus:
+        _gravar_atomico(caminho_prometheus, formatar_prometheus(execucao))
+    return execucao
@@ -0,0 +1,473 @@
+# Mapa com uma única camada de geometrias e troca de métrica no navegador.
+# As geometrias dos municípios são serializadas UMA vez, com todas as métricas
+# (media_mat, media_por, media_ideb, ...) como propriedades de cada feição.
+# As classes de cor de cada métrica são calculadas no servidor e enviadas junto;
+# trocar a métrica no seletor do mapa apenas recolore a camada via JavaScript,
+# sem novo rerun do Streamlit e sem repetir os polígonos no HTML.
+# Na visão nacional, a camada é de tiles vetoriais (tiles_vetoriais.py) e os valores vão em
+# um dicionário código do município -> métricas, unido às feições dos tiles no navegador.
+# O mapa de agrupamentos (LISA, ver analise_espacial.py) usa as mesmas geometrias simplificadas,
+# com cores por categoria em vez de classes numéricas.
+
+import math
+
+import folium
+import numpy as np
+import pandas as pd
+from branca.element import MacroElement, Template
+from branca.utilities import color_brewer
+from folium.plugins import VectorGridProtobuf
+
+import analise_espacial
+import classificacao
+import geometria_simplificada
+
+N_CORES = 6
+PALETA = 'YlGnBu'
+
+# Métricas exibidas no mapa único (coluna -> título da legenda)
+METRICAS_MAPA = {'media_mat': 'Média Mat.', 'media_por': 'Média Port.', 'media_ideb': 'IDEB (Média)'}
+# Variações entre anos, exibidas quando um ano de comparação é escolhido
+VARIACOES_MAPA = {'variacao_mat': 'Variação Mat.', 'variacao_por': 'Variação Port.', 'variacao_ideb': 'Variação IDEB'}
+# Colunas da tabela de municípios (coluna -> título)
+COLUNAS_TABELA = {'name_muni': 'Município', 'media_mat': 'Profic. Mat.', 'media_por': 'Profic. Port.', 'media_ideb': 'IDEB (Média)'}
+VARIACOES_TABELA = {'variacao_mat': 'Δ Mat.', 'variacao_por': 'Δ Port.', 'variacao_ideb': 'Δ IDEB'}
+# Cores dos agrupamentos LISA (chaves de analise_espacial.CLASSES_LISA)
+CORES_LISA = {'AA': '#d7191c', 'BB': '#2c7bb6', 'AB': '#fdae61', 'BA': '#abd9e9', 'NS': '#eeeeee'}
+
+
+def calcular_bins(valores, n_cores=N_CORES, metodo=classificacao.METODO_PADRAO):
+    """
+    Calcula os limites das classes de cor de um único conjunto de valores.
+    Usado quando os limites pré-calculados (classificacao.classificar_agregados) não foram informados.
+    Retorna None se não houver valores válidos.
+    """
+    valores = np.asarray(valores, dtype='float64')
+    return classificacao.classificar(valores, np.zeros(valores.size, dtype='int64'), 1, metodo, n_cores).get(0)
+
+
+def _enquadrar(mapa, bounds):
+    """Abre o mapa enquadrado em 'bounds' (xmin, ymin, xmax, ymax): o zoom em que geometria_simplificada.escolher_nivel se baseia."""
+    xmin, ymin, xmax, ymax = (float(v) for v in bounds)
+    mapa.fit_bounds([[ymin, xmin], [ymax, xmax]])
+
+
+def _valor_json(valor):
+    """Converte NaN/NA em None (null no JSON) e números numpy em float."""
+    if valor is None:
+        return None
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(valor) else valor
+
+
+class SeletorMetrica(MacroElement):
+    """
+    Controle Leaflet com um seletor de métrica e a legenda da métrica atual.
+    Recolore a camada 'camada' no navegador usando os limites e cores pré-calculados.
+    Com 'camada_tiles' (nome da camada nos tiles vetoriais), 'camada' é um VectorGrid e os
+    valores vêm de 'valores' ({código do município: {coluna: valor}}), não das propriedades.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var camada = {{ this.camada.get_name() }};
+            var config = {{ this.config|tojson }};
+            var mapa = {{ this._parent.get_name() }};
+
+            function valorDe(propriedades, coluna) {
+                if (!config.valores) { return propriedades[coluna]; }
+                var valores = config.valores[propriedades.code_muni];
+                return valores ? valores[coluna] : null;
+            }
+
+            function corDoValor(valor, metrica) {
+                if (valor === null || valor === undefined) { return null; }
+                var bins = metrica.bins, cores = metrica.cores;
+                for (var i = 1; i < bins.length; i++) {
+                    if (valor <= bins[i]) { return cores[Math.min(i - 1, cores.length - 1)]; }
+                }
+                return cores[cores.length - 1];
+            }
+
+            function formatar(valor) {
+                return valor.toLocaleString('pt-BR', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+            }
+
+            var controle = L.control({position: 'topright'});
+            controle.onAdd = function() {
+                var div = L.DomUtil.create('div', 'seletor-metrica');
+                div.style.background = 'white';
+                div.style.padding = '6px 8px';
+                div.style.borderRadius = '4px';
+                div.style.boxShadow = '0 1px 4px rgba(0,0,0,0.3)';
+                var seletor = L.DomUtil.create('select', '', div);
+                Object.keys(config.metricas).forEach(function(coluna) {
+                    var opcao = L.DomUtil.create('option', '', seletor);
+                    opcao.value = coluna;
+                    opcao.text = config.metricas[coluna].titulo;
+                });
+                seletor.value = config.padrao;
+                this._legenda = L.DomUtil.create('div', '', div);
+                L.DomEvent.disableClickPropagation(div);
+                L.DomEvent.on(seletor, 'change', function() { aplicar(seletor.value); });
+                return div;
+            };
+            controle.addTo(mapa);
+
+            function aplicar(coluna) {
+                var metrica = config.metricas[coluna];
+                function estilo(propriedades) {
+                    var cor = corDoValor(valorDe(propriedades, coluna), metrica);
+                    return {
+                        fill: true,
+                        fillColor: cor || config.cor_sem_dado,
+                        fillOpacity: cor ? config.opacidade : 0.15,
+                        color: 'black', weight: 1, opacity: 0.2
+                    };
+                }
+                if (config.camada_tiles) {
+                    // O VectorGrid não tem setStyle: troca a função de estilo e redesenha os tiles carregados
+                    camada.options.vectorTileLayerStyles[config.camada_tiles] = estilo;
+                    camada.redraw();
+                } else {
+                    camada.setStyle(function(feature) { return estilo(feature.properties); });
+                }
+                var html = '<b>' + metrica.titulo + '</b>';
+                if (metrica.bins) {
+                    for (var i = 0; i < metrica.bins.length - 1; i++) {
+                        html += '<div><span style="display:inline-block;width:12px;height:12px;margin-right:4px;background:'
+                            + metrica.cores[Math.min(i, metrica.cores.length - 1)] + '"></span>'
+                            + formatar(metrica.bins[i]) + ' – ' + formatar(metrica.bins[i + 1]) + '</div>';
+                    }
+                }
+                controle._legenda.innerHTML = html;
+            }
+            aplicar(config.padrao);
+
+            if (config.camada_tiles) {
+                camada.on('click', function(e) {
+                    var propriedades = e.layer.properties;
+                    var html = '<b>' + propriedades.name_muni + ' (' + propriedades.abbrev_state + ')</b>';
+                    Object.keys(config.metricas).forEach(function(coluna) {
+                        var valor = valorDe(propriedades, coluna);
+                        html += '<br>' + config.metricas[coluna].titulo + ': '
+                            + (valor === null || valor === undefined ? '-' : formatar(valor));
+                    });
+                    L.popup().setLatLng(e.latlng).setContent(html).openOn(mapa);
+                });
+            }
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, camada, metricas, padrao, opacidade=0.7, cor_sem_dado='#d9d9d9', valores=None, camada_tiles=None):
+        super().__init__()
+        self._name = 'SeletorMetrica'
+        self.camada = camada
+        self.config = {
+            'metricas': metricas,
+            'padrao': padrao,
+            'opacidade': opacidade,
+            'cor_sem_dado': cor_sem_dado,
+            'valores': valores,
+            'camada_tiles': camada_tiles,
+        }
+
+
+class LegendaCategorias(MacroElement):
+    """Legenda Leaflet de uma camada com cores por categoria ('itens' = {rótulo: cor})."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var legenda = L.control({position: 'bottomright'});
+            legenda.onAdd = function() {
+                var div = L.DomUtil.create('div', 'legenda-categorias');
+                div.style.background = 'white';
+                div.style.padding = '6px 8px';
+                div.style.borderRadius = '4px';
+                div.style.boxShadow = '0 1px 4px rgba(0,0,0,0.3)';
+                var html = '<b>' + {{ this.titulo|tojson }} + '</b>';
+                var itens = {{ this.itens|tojson }};
+                Object.keys(itens).forEach(function(rotulo) {
+                    html += '<div><span style="display:inline-block;width:12px;height:12px;margin-right:4px;background:'
+                        + itens[rotulo] + '"></span>' + rotulo + '</div>';
+                });
+                div.innerHTML = html;
+                return div;
+            };
+            legenda.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, titulo, itens):
+        super().__init__()
+        self._name = 'LegendaCategorias'
+        self.titulo = titulo
+        self.itens = itens
+
+
+def preparar_metricas(gdf_mapa, metricas, n_cores=N_CORES, classes=None):
+    """
+    Monta limites e cores de cada métrica.
+    'metricas' é um dict {coluna: título da legenda}; 'classes' ({coluna: limites}) traz os limites
+    pré-calculados do estado, e só as métricas ausentes dele são classificadas aqui.
+    Métricas sem valores válidos ficam sem bins.
+    """
+    classes = classes or {}
+    config = {}
+    for coluna, titulo in metricas.items():
+        bins = classes.get(coluna) or calcular_bins(gdf_mapa[coluna], n_cores)
+        n_classes = max(len(bins) - 1, 1) if bins else 1
+        config[coluna] = {
+            'titulo': titulo,
+            'bins': bins,
+            # color_brewer exige pelo menos 3 cores; com menos classes, o JavaScript usa as primeiras
+            'cores': color_brewer(PALETA, max(n_classes, 3)),
+        }
+    return config
+
+
+def criar_mapa_multimetrica(gdf_mapa, metricas, estado_coords_centro, niveis_geometria=None, largura_px=450, padrao=None,
+                            classes=None, altura_px=None):
+    """
+    Cria um mapa Folium com uma única camada de municípios e todas as métricas como propriedades.
+    'metricas' é um dict {coluna: título}; 'padrao' é a métrica exibida ao abrir o mapa;
+    'classes' ({coluna: limites}) são os limites das cores já calculados para o estado.
+    Retorna None se nenhum município tiver valor em nenhuma das métricas.
+    """
+    colunas = list(metricas)
+    gdf_mapa = gdf_mapa[gdf_mapa[colunas].notna().any(axis=1)]
+    if gdf_mapa.empty:
+        return None
+
+    mapa = folium.Map(location=[estado_coords_centro.y, estado_coords_centro.x], zoom_start=6, tiles="CartoDB positron")
+    _enquadrar(mapa, gdf_mapa.total_bounds)
+
+    valores = {
+        int(codigo): {coluna: _valor_json(v) for coluna, v in zip(colunas, linha)}
+        for codigo, linha in zip(gdf_mapa['code_muni'], gdf_mapa[colunas].itertuples(index=False, name=None))
+    }
+    if niveis_geometria is not None:
+        nivel = geometria_simplificada.escolher_nivel(gdf_mapa.total_bounds, largura_px, altura_px)
+        payload = geometria_simplificada.montar_payload(niveis_geometria[nivel], valores)
+    else:
+        dados = gdf_mapa[['code_muni', 'name_muni', 'geometry']].copy()
+        dados['code_muni'] = dados['code_muni'].astype('int64')
+        payload = geometria_simplificada.montar_payload(
+            {'formato': 'geojson', 'dados': dados.__geo_interface__}, valores)
+
+    tooltip = folium.GeoJsonTooltip(
+        fields=['name_muni'] + colunas,
+        aliases=['Município:'] + [titulo + ':' for titulo in metricas.values()],
+        localize=True, sticky=False, labels=True,
+        style="background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; box-shadow: 3px;",
+        max_width=800,
+    )
+    if payload['formato'] == 'topojson':
+        camada = folium.TopoJson(payload['dados'], f"objects.{geometria_simplificada.OBJETO_TOPOJSON}",
+                                 name='Municípios', tooltip=tooltip)
+    else:
+        camada = folium.GeoJson(payload['dados'], name='Municípios', tooltip=tooltip,
+                                highlight_function=lambda x: {'weight': 3, 'fillOpacity': 0.9})
+    camada.add_to(mapa)
+
+    SeletorMetrica(camada, preparar_metricas(gdf_mapa, metricas, classes=classes), padrao or colunas[-1]).add_to(mapa)
+    return mapa
+
+
+def criar_mapa_nacional(agregados, metricas, url_tiles, camada_tiles, zoom_maximo, padrao=None, classes=None):
+    """
+    Cria um mapa Folium de todos os municípios do Brasil com as geometrias em tiles vetoriais.
+    'agregados' é indexado pelo código do município (ex: agregados_ideb.calcular_agregados_municipios);
+    'url_tiles' é o modelo de URL dos tiles ({z}/{x}/{y}) e 'camada_tiles' o nome da camada neles;
+    'zoom_maximo' é o último nível da pirâmide (acima dele, o Leaflet amplia os tiles desse nível).
+    'classes' ({coluna: limites}) são os limites nacionais das cores.
+    Retorna None se nenhum município tiver valor em nenhuma das métricas.
+    """
+    colunas = list(metricas)
+    dados = agregados[colunas]
+    dados = dados[dados.notna().any(axis=1)]
+    if dados.empty:
+        return None
+
+    mapa = folium.Map(location=[-14.2, -51.9], zoom_start=4, min_zoom=3, tiles="CartoDB positron")
+    valores = {
+        int(codigo): {coluna: _valor_json(v) for coluna, v in zip(colunas, linha)}
+        for codigo, linha in zip(dados.index, dados.itertuples(index=False, name=None))
+    }
+    camada = VectorGridProtobuf(url_tiles, name='Municípios', options={
+        'interactive': True,
+        'maxNativeZoom': zoom_maximo,
+        'vectorTileLayerStyles': {camada_tiles: {}}, # Substituído pelo SeletorMetrica
+    })
+    camada.add_to(mapa)
+
+    SeletorMetrica(camada, preparar_metricas(dados, metricas, classes=classes), padrao or colunas[-1],
+                   valores=valores, camada_tiles=camada_tiles).add_to(mapa)
+    return mapa
+
+
+def criar_mapa_coropletico(gdf_mapa_filtrado, coluna_valor, legenda_titulo, estado_coords_centro, niveis_geometria=None,
+                           largura_px=450, bins_mapa=None, altura_px=None):
+    """
+    Mapa Choropleth de uma única métrica (usado pelo painel e pela renderização em lote).
+    'gdf_mapa_filtrado' já deve estar sem valores ausentes na coluna; 'bins_mapa' são os
+    limites das classes de cor (calculados aqui por quantis se não forem informados).
+    """
+    mapa = folium.Map(location=[estado_coords_centro.y, estado_coords_centro.x], zoom_start=6, tiles="CartoDB positron")
+    _enquadrar(mapa, gdf_mapa_filtrado.total_bounds)
+
+    if bins_mapa is None:
+        bins_mapa = calcular_bins(gdf_mapa_filtrado[coluna_valor])
+    cor_preenchimento = PALETA
+
+    caminho_topojson = None
+    if niveis_geometria is not None:
+        nivel = geometria_simplificada.escolher_nivel(gdf_mapa_filtrado.total_bounds, largura_px, altura_px)
+        valores = {
+            int(codigo): {coluna_valor: float(valor)}
+            for codigo, valor in zip(gdf_mapa_filtrado['code_muni'], gdf_mapa_filtrado[coluna_valor])
+        }
+        payload = geometria_simplificada.montar_payload(niveis_geometria[nivel], valores)
+        geo_data = payload['dados']
+        if payload['formato'] == 'topojson':
+            caminho_topojson = f"objects.{geometria_simplificada.OBJETO_TOPOJSON}"
+    else:
+        geo_data = gdf_mapa_filtrado.__geo_interface__
+
+    choropleth_layer = folium.Choropleth(
+        geo_data=geo_data,
+        topojson=caminho_topojson,
+        name='Choropleth',
+        data=gdf_mapa_filtrado,
+        columns=['code_muni', coluna_valor],
+        key_on='feature.properties.code_muni',
+        fill_color=cor_preenchimento,
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name=legenda_titulo,
+        bins=bins_mapa,
+        highlight=True
+    ).add_to(mapa)
+
+    folium.GeoJsonTooltip(
+        fields=['name_muni', coluna_valor],
+        aliases=['Município:', legenda_titulo + ':'],
+        localize=True, sticky=False, labels=True,
+        style="background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; box-shadow: 3px;",
+        max_width=800,
+    ).add_to(choropleth_layer.geojson)
+
+    return mapa
+
+
+def criar_mapa_lisa(gdf_mapa, locais, legenda_titulo, estado_coords_centro, niveis_geometria=None, largura_px=450, altura_px=None):
+    """
+    Mapa dos agrupamentos espaciais (LISA) de uma métrica: cada município é colorido pelo
+    quadrante de Moran em que caiu quando significativo (Alto-Alto, Baixo-Baixo, ...).
+    'locais' é o DataFrame de analise_espacial.autocorrelacao_espacial (indexado por code_muni).
+    Retorna None se nenhum município tiver resultado.
+    """
+    locais = locais.dropna(subset=['lisa_i'])
+    if locais.empty:
+        return None
+
+    mapa = folium.Map(location=[estado_coords_centro.y, estado_coords_centro.x], zoom_start=6, tiles="CartoDB positron")
+    _enquadrar(mapa, gdf_mapa.total_bounds)
+
+    valores = {
+        int(codigo): {
+            'classe_lisa': analise_espacial.CLASSES_LISA[classe],
+            'cor_lisa': CORES_LISA[classe],
+            'p_valor_lisa': _valor_json(p_valor),
+        }
+        for codigo, classe, p_valor in zip(locais.index, locais['classe'], locais['p_valor'])
+    }
+    if niveis_geometria is not None:
+        nivel = geometria_simplificada.escolher_nivel(gdf_mapa.total_bounds, largura_px, altura_px)
+        payload = geometria_simplificada.montar_payload(niveis_geometria[nivel], valores)
+    else:
+        dados = gdf_mapa[['code_muni', 'name_muni', 'geometry']].dropna(subset=['code_muni']).copy()
+        dados['code_muni'] = dados['code_muni'].astype('int64')
+        payload = geometria_simplificada.montar_payload(
+            {'formato': 'geojson', 'dados': dados.__geo_interface__}, valores)
+
+    estilo = lambda feature: {
+        'fillColor': feature['properties']['cor_lisa'], 'fillOpacity': 0.8,
+        'color': 'black', 'weight': 1, 'opacity': 0.2,
+    }
+    tooltip = folium.GeoJsonTooltip(
+        fields=['name_muni', 'classe_lisa', 'p_valor_lisa'],
+        aliases=['Município:', legenda_titulo + ':', 'Pseudo p-valor:'],
+        localize=True, sticky=False, labels=True,
+        style="background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; box-shadow: 3px;",
+        max_width=800,
+    )
+    if payload['formato'] == 'topojson':
+        camada = folium.TopoJson(payload['dados'], f"objects.{geometria_simplificada.OBJETO_TOPOJSON}",
+                                 name='Agrupamentos (LISA)', style_function=estilo, tooltip=tooltip)
+    else:
+        camada = folium.GeoJson(payload['dados'], name='Agrupamentos (LISA)', style_function=estilo, tooltip=tooltip,
+                                highlight_function=lambda x: {'weight': 3, 'fillOpacity': 0.9})
+    camada.add_to(mapa)
+
+    presentes = set(locais['classe'])
+    LegendaCategorias(legenda_titulo, {
+        titulo: CORES_LISA[classe] for classe, titulo in analise_espacial.CLASSES_LISA.items() if classe in presentes
+    }).add_to(mapa)
+    return mapa
+
+
+def colunas_tabela(com_variacoes=False):
+    """Colunas da tabela de municípios (coluna -> título), com as variações se pedidas."""
+    return dict(COLUNAS_TABELA, **(VARIACOES_TABELA if com_variacoes else {}))
+
+
+def formatos_tabela(colunas):
+    """Formato (str.format) de cada coluna numérica da tabela, indexado pela chave de 'colunas'."""
+    return {
+        chave: '{:+.2f}' if coluna.startswith('variacao_') else '{:.2f}'
+        for coluna, chave in colunas.items() if coluna != 'name_muni'
+    }
+
+
+def dados_tabela_municipios(gdf_mapa, com_variacoes=False, colunas_extras=()):
+    """Linhas da tabela de municípios com os nomes originais das colunas (sem municípios sem nenhuma média)."""
+    colunas = list(colunas_extras) + list(colunas_tabela(com_variacoes))
+    tabela = gdf_mapa[colunas].dropna(subset=list(METRICAS_MAPA), how='all')
+    return pd.DataFrame(tabela)
+
+
+def tabela_municipios(gdf_mapa, com_variacoes=False):
+    """
+    Tabela de municípios gravada pela renderização em lote.
+    Retorna (DataFrame com os títulos como colunas, formatos de cada coluna para Styler.format).
+    """
+    colunas = colunas_tabela(com_variacoes)
+    tabela = dados_tabela_municipios(gdf_mapa, com_variacoes).rename(columns=colunas)
+    return tabela, formatos_tabela(colunas)
+
+
+def artefato_mapa(mapa):
+    """
+    Converte um mapa Folium no artefato guardado em cache: o HTML renderizado e as
+    classes de cor (limites, cores e título) de cada camada temática do mapa.
+    """
+    classes = {}
+    for filho in mapa._children.values():
+        if isinstance(filho, SeletorMetrica):
+            classes.update(filho.config['metricas'])
+        elif isinstance(filho, folium.Choropleth) and filho.color_scale is not None:
+            escala = filho.color_scale
+            classes[escala.caption] = {
+                'titulo': escala.caption,
+                'bins': [float(b) for b in escala.index],
+                'cores': [escala.rgb_hex_str(b) for b in escala.index[:-1]],
+            }
+    return {'html': mapa.get_root().render(), 'classes': classes}
@@ -4,99 +4,289 @@
 # Execute no terminal:
 #   streamlit run nome_do_seu_arquivo.py
 
+import threading
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
-import geopandas # Para manipulação de dados geoespaciais
-import folium # Para criar mapas interativos
-from streamlit_folium import st_folium # Para integrar Folium com Streamlit
-import numpy as np
-# Não precisamos mais importar 'geobr' aqui se os dados são locais
+import streamlit.components.v1 as components # Para exibir o HTML dos mapas guardados em cache
+import os
+import ingestao_ideb # Ingestão colunar (Parquet) dos dados do IDEB
+import agregados_ideb # Tabela de agregados por município
+import particoes_uf # Índice de partições por UF
+import geometria_local # Leitura de GeoParquet/FlatGeobuf/GeoJSON, inclusive por estado
+import fontes_geometria # Fonte das geometrias (arquivos locais, GeoParquet ou geobr), importada só quando usada
+import armazem_compartilhado # Arquivos Arrow mapeados em memória, compartilhados entre os processos
+import carga_paralela # Cargas independentes executadas ao mesmo tempo
+import geometria_simplificada # Geometrias simplificadas (TopoJSON) em vários níveis
+import mapa_metricas # Mapa único com troca de métrica no navegador
+import classificacao # Limites das classes de cor de todos os estados, calculados de uma vez
+import cache_mapas # Cache LRU dos mapas já renderizados
+import serie_ideb # Série histórica do IDEB particionada por ano
+import instrumentacao # Tempo, memória, linhas e cache de cada etapa do painel
+import renderizacao_lote # Mapas pré-renderizados por renderizacao_lote.py
+import tiles_vetoriais # Tiles vetoriais (MBTiles) para o mapa de todos os municípios do Brasil
+import analise_espacial # Vizinhança dos municípios, I de Moran e agrupamentos LISA
+import tabela_paginada # Tabela de municípios com ordenação, busca e paginação no servidor
+import cubo_ideb # Cubo pré-agregado por rede, localização e etapa
+# O 'geobr' (e o R, via rpy2) só é importado por fontes_geometria se não houver arquivos locais
 
 # Configuração da página do Streamlit
 st.set_page_config(layout="wide", page_title="Painel IDEB Brasil")
 
-@st.cache_data # Cache para otimizar o carregamento de dados
-def carregar_dados_ideb(caminho_arquivo):
-    """
-    Carrega e limpa os dados do IDEB de um arquivo TXT delimitado por tabulação.
-    (Esta função permanece a mesma)
-    """
-    try:
-        try:
-            df = pd.read_csv(caminho_arquivo, sep='\t', encoding='utf-8', low_memory=False)
-        except UnicodeDecodeError:
-            df = pd.read_csv(caminho_arquivo, sep='\t', encoding='latin-1', low_memory=False)
-
-        colunas_necessarias = ['UF', 'cod_mun', 'nome_mun', 'ideb', 'nota_matem', 'nota_portugues']
-        for col in colunas_necessarias:
-            if col not in df.columns:
-                st.error(f"Coluna essencial '{col}' não encontrada no arquivo '{caminho_arquivo}'. Verifique o conteúdo do arquivo.")
-                return None
-        
-        df = df[colunas_necessarias].copy()
-        cols_numericas = ['ideb', 'nota_matem', 'nota_portugues']
-        for col in cols_numericas:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        df.dropna(subset=['ideb'], inplace=True)
-        df = df[df['ideb'] != 0].copy()
-        df['cod_mun'] = pd.to_numeric(df['cod_mun'], errors='coerce').astype('Int64')
-        df.dropna(subset=['cod_mun'], inplace=True)
-        return df
-    except FileNotFoundError:
-        st.error(f"Arquivo '{caminho_arquivo}' não encontrado. Certifique-se de que ele está no mesmo diretório que o script Python ou que o caminho está correto.")
-        return None
-    except Exception as e:
-        st.error(f"Ocorreu um erro ao carregar os dados do IDEB: {e}")
-        return None
+# Cada rerun mede as próprias etapas (ver o painel "Diagnóstico de desempenho" na barra lateral)
+instrumentacao.iniciar_execucao()
+
+# Limites dos caches indexados pela versão dos dados (chave_dados). Cada combinação de filtros
+# do cubo é uma versão nova; sem limite, os resultados de filtros antigos ficariam na memória
+# do processo. Os menos usados recentemente são descartados.
+ENTRADAS_CACHE_VERSOES = 8 # Resultados de uma versão inteira (Brasil, todas as UFs)
+ENTRADAS_CACHE_ESTADOS = 64 # Resultados de um estado de uma versão
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Um frame por processo, sem cópia a cada acesso (somente leitura)
+def carregar_dados_ideb(caminho_arquivo, versao):
+    """
+    Carrega e limpa os dados do IDEB. 'versao' (ingestao_ideb.versao_dados) faz uma nova
+    ingestão do TXT/Parquet invalidar o cache.
+    Usa o Parquet gerado por ingestao_ideb.py quando ele existe e está atualizado;
+    caso contrário, lê o arquivo TXT delimitado por tabulação (apenas as colunas necessárias).
+    Os dados são servidos do armazém Arrow mapeado em memória (armazem_compartilhado.py),
+    gravado na primeira carga, quando a pasta permite escrita.
+    Roda em uma thread de carga: os erros são propagados e exibidos por mensagens_erro_ideb.
+    """
+    instrumentacao.registrar_falha_cache()
+    armazem = armazem_compartilhado.armazem_ideb(caminho_arquivo)
+    if armazem is not None:
+        return armazem.dataframe()
+    return ingestao_ideb.carregar_ideb(caminho_arquivo)
+
+
+def mensagens_erro_ideb(caminho_arquivo, erro):
+    """Mensagens exibidas (st.error) para um erro na carga dos dados do IDEB."""
+    if isinstance(erro, FileNotFoundError):
+        return [f"Arquivo '{caminho_arquivo}' não encontrado. Certifique-se de que ele está no mesmo diretório que o script Python ou que o caminho está correto."]
+    if isinstance(erro, ValueError): # Coluna essencial ausente no arquivo
+        return [str(erro)]
+    return [f"Ocorreu um erro ao carregar os dados do IDEB: {erro}"]
+
+# Pasta e ano dos arquivos geoespaciais DENTRO do seu repositório
+PASTA_DADOS_GEO = "mapa_ideb_2021/dados_geoespaciais"
+ANO_GEO = 2020 # ATUALIZADO para 2020
+# Arquivos locais quando existem; caso contrário, geobr. PAINEL_IDEB_FONTE_GEO escolhe outra fonte
+FONTE_GEO = fontes_geometria.escolher_fonte(PASTA_DADOS_GEO, ANO_GEO)
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Mapeado uma vez por processo; as páginas do arquivo são compartilhadas entre processos
+def abrir_armazem_geometrias(especificacao_fonte, nivel):
+    """
+    Armazém Arrow das geometrias do nível ('municipios' ou 'estados'), gravado a partir da
+    fonte na primeira vez. Retorna None se a pasta das geometrias não permitir escrita.
+    """
+    instrumentacao.registrar_falha_cache()
+    fonte = fontes_geometria.criar_fonte(especificacao_fonte)
+    return armazem_compartilhado.armazem_geometrias(fonte, PASTA_DADOS_GEO, nivel, ANO_GEO)
+
+
+def ler_geometrias_painel(especificacao_fonte, nivel, uf=None, bbox=None):
+    """Geometrias do armazém mapeado (só as linhas da UF são decodificadas) ou, sem ele, da fonte."""
+    armazem = abrir_armazem_geometrias(especificacao_fonte, nivel)
+    if armazem is not None:
+        return armazem.geodataframe(uf)
+    return fontes_geometria.criar_fonte(especificacao_fonte).ler(nivel, ANO_GEO, uf=uf, bbox=bbox)
+
+# Coluna que identifica cada feição, verificada na carga de cada nível
+COLUNAS_CHAVE_GEO = {"municipios": "code_muni", "estados": "abbrev_state"}
 
-@st.cache_data # Cache para otimizar o carregamento de dados geoespaciais
-def carregar_dados_geoespaciais_locais():
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Compartilhado entre sessões, sem cópia a cada acesso (somente leitura)
+def carregar_dados_geoespaciais_locais(especificacao_fonte, nivel):
     """
-    Carrega os dados geoespaciais de municípios e estados do Brasil
-    a partir de arquivos GeoJSON locais (previamente baixados e incluídos no repositório).
+    Carrega os dados geoespaciais dos municípios ou dos estados do Brasil ('nivel')
+    a partir de arquivos locais (previamente baixados e incluídos no repositório).
+    Usa GeoParquet/FlatGeobuf quando existem e GeoJSON caso contrário.
+    'especificacao_fonte' (ex: 'local:<pasta>', 'geobr') é a fonte de fontes_geometria.
+    Roda em uma thread de carga: os erros são propagados e exibidos por mensagens_erro_geometrias.
     ATUALIZADO PARA USAR ARQUIVOS DE 2020.
     """
-    # Caminhos para os arquivos GeoJSON DENTRO do seu repositório
-    path_municipios = "mapa_ideb_2021/dados_geoespaciais/municipios_br_2020.geojson" # ATUALIZADO para 2020
-    path_estados = "mapa_ideb_2021/dados_geoespaciais/estados_br_2020.geojson"     # ATUALIZADO para 2020
+    instrumentacao.registrar_falha_cache()
+    gdf = ler_geometrias_painel(especificacao_fonte, nivel)
+    coluna_chave = COLUNAS_CHAVE_GEO[nivel]
+    if coluna_chave not in gdf.columns:
+        caminho = geometria_local.caminho_geometria(PASTA_DADOS_GEO, nivel, ANO_GEO, "geojson")
+        raise ValueError(f"Coluna '{coluna_chave}' não encontrada no arquivo local: {caminho}")
+    if nivel == "municipios":
+        gdf['code_muni'] = gdf['code_muni'].astype('Int64')
+    return gdf
 
-    try:
-        st.write("Carregando dados geoespaciais dos municípios (local, ano 2020)...") # Mensagem atualizada
-        br_muni_gdf = geopandas.read_file(path_municipios)
-        
-        st.write("Carregando dados geoespaciais dos estados (local, ano 2020)...") # Mensagem atualizada
-        br_estados_gdf = geopandas.read_file(path_estados)
 
-        # Verificações e conversões de tipo
-        if 'code_muni' in br_muni_gdf.columns:
-            br_muni_gdf['code_muni'] = br_muni_gdf['code_muni'].astype('Int64')
-        else:
-            st.error(f"Coluna 'code_muni' não encontrada no arquivo local: {path_municipios}")
-            return None, None
+def carregar_municipios_nacionais(especificacao_fonte):
+    """
+    Municípios de todo o Brasil, carregados só quando não é possível ler um estado por vez
+    (armazém Arrow ou GeoParquet/FlatGeobuf). Caso contrário, retorna None: os municípios
+    serão lidos estado a estado por carregar_municipios_estado_local.
+    """
+    fonte = fontes_geometria.criar_fonte(especificacao_fonte)
+    if fonte.leitura_por_estado("municipios", ANO_GEO) or abrir_armazem_geometrias(especificacao_fonte, "municipios") is not None:
+        return None
+    return carregar_dados_geoespaciais_locais(especificacao_fonte, "municipios")
+
+
+def mensagens_erro_geometrias(erro):
+    """Mensagens exibidas (st.error) para um erro na carga das geometrias."""
+    if isinstance(erro, FileNotFoundError):
+        path_municipios = geometria_local.caminho_geometria(PASTA_DADOS_GEO, "municipios", ANO_GEO, "geojson")
+        path_estados = geometria_local.caminho_geometria(PASTA_DADOS_GEO, "estados", ANO_GEO, "geojson")
+        return [
+            f"Erro: Um ou ambos os arquivos GeoJSON de 2020 não foram encontrados. Verifique os caminhos:", # Mensagem atualizada
+            f"- Municípios: {path_municipios}",
+            f"- Estados: {path_estados}",
+            "Certifique-se de que a pasta 'dados_geoespaciais' com os arquivos .geojson de 2020 está na raiz do seu repositório GitHub.",
+        ]
+    if isinstance(erro, ValueError): # Coluna essencial ausente
+        return [str(erro)]
+    return [f"Erro ao carregar dados geoespaciais locais (2020): {erro}"] # Mensagem atualizada
+
+
+# Cargas feitas na partida do painel, com o nome exibido na barra de progresso
+NOMES_CARGA = {"ideb": "dados do IDEB", "estados": "geometrias dos estados", "municipios": "geometrias dos municípios"}
+
+def carregar_dados_em_paralelo(tarefas):
+    """
+    Executa as cargas independentes ao mesmo tempo (carga_paralela.py), com uma única barra
+    de progresso. As threads do pool recebem o contexto do rerun (caches do Streamlit e
+    instrumentação). Retorna (resultados, erros) por nome de tarefa.
+    """
+    contexto = get_script_run_ctx()
+    execucao = instrumentacao.execucao_atual()
+
+    def inicializar():
+        add_script_run_ctx(threading.current_thread(), contexto)
+        instrumentacao.vincular_execucao(execucao)
+
+    barra = st.progress(0.0, text="Carregando dados...")
+
+    def ao_concluir(nome, concluidas, total):
+        barra.progress(concluidas / total, text=f"Carregando dados... {NOMES_CARGA[nome]} ({concluidas}/{total})")
 
-        if 'abbrev_state' not in br_estados_gdf.columns:
-             st.error(f"Coluna 'abbrev_state' não encontrada no arquivo local: {path_estados}")
-             return None, None
+    with instrumentacao.etapa('carga_inicial'):
+        resultados, erros, _ = carga_paralela.carregar_em_paralelo(tarefas, ao_concluir, inicializar)
+    barra.empty()
+    return resultados, erros
 
-        st.write("Dados geoespaciais locais (2020) carregados com sucesso.") # Mensagem atualizada
-        return br_muni_gdf, br_estados_gdf
-        
-    except FileNotFoundError:
-        st.error(f"Erro: Um ou ambos os arquivos GeoJSON de 2020 não foram encontrados. Verifique os caminhos:") # Mensagem atualizada
-        st.error(f"- Municípios: {path_municipios}")
-        st.error(f"- Estados: {path_estados}")
-        st.error("Certifique-se de que a pasta 'dados_geoespaciais' com os arquivos .geojson de 2020 está na raiz do seu repositório GitHub.")
-        return None, None
-    except Exception as e:
-        st.error(f"Erro ao carregar dados geoespaciais locais (2020): {e}") # Mensagem atualizada
-        return None, None
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_ESTADOS) # Um GeoDataFrame por estado, lido uma vez e compartilhado entre sessões
+def carregar_municipios_estado_local(especificacao_fonte, sigla_estado, bbox_estado, chave_dados, _agregados):
+    """
+    Lê apenas os municípios de um estado no armazém Arrow (fatia da UF) ou no armazenamento
+    binário (GeoParquet/FlatGeobuf, filtro por UF e retângulo envolvente do estado),
+    e une os agregados do IDEB.
+    'chave_dados' identifica a versão/ano dos agregados (os DataFrames não são hasheados).
+    """
+    instrumentacao.registrar_falha_cache()
+    muni_estado_gdf = ler_geometrias_painel(especificacao_fonte, "municipios", uf=sigla_estado, bbox=bbox_estado)
+    muni_estado_gdf['code_muni'] = muni_estado_gdf['code_muni'].astype('Int64')
+    return agregados_ideb.juntar_agregados_geometria(muni_estado_gdf, _agregados)
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Construído uma vez e compartilhado entre reruns e sessões, sem cópia a cada acesso
+def preparar_agregados_txt(caminho_arquivo_ideb, versao, _df_ideb):
+    """
+    Calcula a tabela de agregados (média, contagem e desvio) de todos os municípios do Brasil
+    a partir das escolas e indexa as escolas por UF.
+    Retorna (particoes_escolas, agregados); as fatias são somente leitura.
+    O cache é indexado pelo caminho e pela versão dos dados do IDEB (os DataFrames não são hasheados).
+    """
+    instrumentacao.registrar_falha_cache()
+    agregados = agregados_ideb.calcular_agregados_municipios(_df_ideb)
+    return particoes_uf.ParticoesUF(_df_ideb, 'UF'), agregados
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Agregados de um ano da série histórica, lidos só da partição daquele ano
+def carregar_agregados_serie(versao, ano, ano_comparacao=None):
+    """
+    Lê os agregados de um ano da série particionada e, se 'ano_comparacao' for informado,
+    acrescenta as variações das médias em relação a ele (colunas variacao_*).
+    'versao' (hashes do manifesto) garante que uma nova ingestão invalide o cache.
+    """
+    instrumentacao.registrar_falha_cache()
+    agregados = serie_ideb.ler_agregados_ano(PASTA_SERIE_IDEB, ano)
+    if ano_comparacao is not None:
+        agregados_base = serie_ideb.ler_agregados_ano(PASTA_SERIE_IDEB, ano_comparacao)
+        agregados = agregados.join(serie_ideb.calcular_variacoes(agregados, agregados_base))
+    return agregados
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_VERSOES) # Junção nacional indexada por UF, feita uma vez por versão dos dados
+def preparar_particoes_municipios(chave_dados, _agregados, _br_muni_gdf):
+    """
+    Une os agregados às geometrias de todo o Brasil com um único join e indexa o resultado por UF:
+    trocar de estado passa a ser só uma fatia. As fatias são somente leitura.
+    """
+    instrumentacao.registrar_falha_cache()
+    muni_notas_br_gdf = agregados_ideb.juntar_agregados_geometria(_br_muni_gdf, _agregados)
+    return particoes_uf.ParticoesUF(muni_notas_br_gdf, 'abbrev_state')
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_VERSOES) # Limites das cores de todos os estados e métricas, calculados uma vez por versão dos dados
+def preparar_classes_cores(chave_dados, metodo, colunas, _agregados):
+    """
+    Classifica de uma vez todas as colunas 'colunas' para as 27 UFs (ver classificacao.py).
+    Retorna {sigla_uf: {coluna: limites}}; os mapas só consultam o estado selecionado.
+    """
+    instrumentacao.registrar_falha_cache()
+    return classificacao.classificar_agregados(_agregados, colunas, metodo)
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Geometrias simplificadas de cada estado, preparadas uma vez
+def preparar_geometrias_simplificadas(versao_geometrias, sigla_estado, _muni_estado_gdf):
+    """
+    Retorna as geometrias do estado em vários níveis de resolução (TopoJSON quantizado).
+    Usa os arquivos gerados por geometria_simplificada.py quando existem e vêm das mesmas
+    geometrias ('versao_geometrias'); senão, calcula na hora.
+    """
+    instrumentacao.registrar_falha_cache()
+    niveis = geometria_simplificada.ler_niveis_estado(PASTA_DADOS_GEO, ANO_GEO, sigla_estado, versao_geometrias)
+    if niveis is None:
+        niveis = geometria_simplificada.preparar_niveis_estado(_muni_estado_gdf)
+    return niveis
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Vizinhança de todos os municípios, calculada (ou lida do disco) uma vez por ano das geometrias
+def carregar_vizinhanca(especificacao_fonte, tipo):
+    """Matriz esparsa de contiguidade dos municípios do Brasil (ver analise_espacial.py)."""
+    instrumentacao.registrar_falha_cache()
+    fonte = fontes_geometria.criar_fonte(especificacao_fonte)
+    return analise_espacial.vizinhanca_municipios(
+        fonte, PASTA_DADOS_GEO, ANO_GEO, tipo, ler_municipios=lambda: ler_geometrias_painel(especificacao_fonte, "municipios"))
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_ESTADOS) # Um resultado por estado e métrica, por versão dos dados
+def preparar_analise_espacial(chave_dados, especificacao_fonte, tipo, sigla_estado, coluna, _muni_estado_gdf):
+    """
+    I de Moran global e LISA da métrica 'coluna' nos municípios do estado, com a vizinhança
+    restrita ao estado (vizinhos de outros estados não entram). Retorna (global, locais).
+    """
+    instrumentacao.registrar_falha_cache()
+    muni_estado_gdf = _muni_estado_gdf.dropna(subset=['code_muni'])
+    vizinhanca = carregar_vizinhanca(especificacao_fonte, tipo).subconjunto(muni_estado_gdf['code_muni'].astype('int64'))
+    return analise_espacial.autocorrelacao_espacial(muni_estado_gdf[coluna], vizinhanca)
 
 
-def criar_mapa_folium(gdf_mapa, coluna_valor, legenda_titulo, estado_coords_centro):
+def criar_mapa_folium(gdf_mapa, coluna_valor, legenda_titulo, estado_coords_centro, niveis_geometria=None, largura_px=450, bins_mapa=None):
     """
     Cria um mapa Choropleth (mapa temático de áreas) com Folium.
-    (Esta função permanece a mesma)
+    Se 'niveis_geometria' (geometrias simplificadas do estado) for informado, usa o nível de
+    resolução adequado à largura do mapa em vez das coordenadas em precisão total.
+    'bins_mapa' são os limites das classes de cor já calculados (ver preparar_classes_cores);
+    sem eles, os limites são calculados aqui por quantis.
     """
     if gdf_mapa is None or gdf_mapa.empty or coluna_valor not in gdf_mapa.columns:
         st.warning(f"Não há dados geográficos ou a coluna '{coluna_valor}' não existe para exibir no mapa de {legenda_titulo}.")
@@ -107,130 +297,450 @@ def criar_mapa_folium(gdf_mapa, coluna_valor, legenda_titulo, estado_coords_cent
         st.warning(f"Não há dados válidos para exibir no mapa de {legenda_titulo} após remover valores ausentes (NaNs).")
         return None
 
-    mapa = folium.Map(location=[estado_coords_centro.y, estado_coords_centro.x], zoom_start=6, tiles="CartoDB positron")
+    return mapa_metricas.criar_mapa_coropletico(
+        gdf_mapa_filtrado, coluna_valor, legenda_titulo, estado_coords_centro, niveis_geometria, largura_px, bins_mapa
+    )
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_VERSOES) # Limites nacionais das cores, para o mapa de todos os municípios
+def preparar_classes_nacionais(chave_dados, metodo, colunas, _agregados):
+    """Calcula os limites das cores de cada métrica com os municípios de todo o Brasil juntos."""
+    instrumentacao.registrar_falha_cache()
+    return {coluna: mapa_metricas.calcular_bins(_agregados[coluna], metodo=metodo) for coluna in colunas}
+
+
+@st.cache_resource # Um servidor de tiles por processo, compartilhado por todas as sessões
+def iniciar_servidor_tiles(caminho_tiles):
+    """Inicia o servidor local dos tiles vetoriais e retorna (modelo de URL dos tiles, zoom máximo)."""
+    servidor = tiles_vetoriais.iniciar_servidor(caminho_tiles)
+    zoom_maximo = int(servidor.leitor.metadados().get('maxzoom', tiles_vetoriais.ZOOM_MAXIMO))
+    return tiles_vetoriais.url_tiles(servidor), zoom_maximo
+
+
+@st.cache_resource # Nomes e UFs de todos os municípios, lidos sem as geometrias quando há armazém
+def carregar_nomes_municipios(especificacao_fonte):
+    armazem = abrir_armazem_geometrias(especificacao_fonte, "municipios")
+    colunas = ['code_muni', 'name_muni', 'abbrev_state']
+    if armazem is not None:
+        return armazem.dataframe(colunas=colunas)
+    return pd.DataFrame(ler_geometrias_painel(especificacao_fonte, "municipios")[colunas])
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_ESTADOS) # Ordens das colunas calculadas uma vez por estado e versão dos dados
+def preparar_tabela_estado(chave_dados, sigla_estado, com_variacoes, _muni_notas_gdf):
+    instrumentacao.registrar_falha_cache()
+    return tabela_paginada.TabelaOrdenada(mapa_metricas.dados_tabela_municipios(_muni_notas_gdf, com_variacoes))
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_VERSOES) # Tabela de todos os municípios do Brasil, por versão dos dados
+def preparar_tabela_nacional(chave_dados, especificacao_fonte, com_variacoes, _agregados):
+    instrumentacao.registrar_falha_cache()
+    municipios = agregados_ideb.juntar_agregados_geometria(carregar_nomes_municipios(especificacao_fonte), _agregados)
+    return tabela_paginada.TabelaOrdenada(
+        mapa_metricas.dados_tabela_municipios(municipios, com_variacoes, colunas_extras=['abbrev_state']))
+
+
+def exibir_tabela_paginada(tabela, colunas, chave_widgets):
+    """
+    Exibe uma página da tabela (tabela_paginada.TabelaOrdenada) com busca por nome, ordenação
+    e paginação feitas aqui; só as linhas da página vão para o navegador, que formata os números.
+    'colunas' ({coluna: título}) define os títulos; 'chave_widgets' separa o estado dos controles por visão.
+    """
+    col_busca, col_ordem, col_direcao, col_tamanho = st.columns([3, 2, 1, 1])
+    busca = col_busca.text_input("Buscar município:", key=f"busca_{chave_widgets}")
+    ordenar_por = col_ordem.selectbox(
+        "Ordenar por:", options=list(colunas), format_func=colunas.get, key=f"ordem_{chave_widgets}")
+    decrescente = col_direcao.checkbox("Decrescente", key=f"decrescente_{chave_widgets}")
+    tamanho_pagina = col_tamanho.selectbox(
+        "Linhas:", options=tabela_paginada.TAMANHOS_PAGINA,
+        index=tabela_paginada.TAMANHOS_PAGINA.index(tabela_paginada.TAMANHO_PAGINA_PADRAO), key=f"linhas_{chave_widgets}")
+
+    # A página escolhida vem do rerun anterior; se a busca reduziu o total, volta para a última existente
+    chave_pagina = f"pagina_{chave_widgets}"
+    with instrumentacao.etapa('tabela') as medicao:
+        pagina, total = tabela.consultar(ordenar_por, decrescente, busca, st.session_state.get(chave_pagina, 1), tamanho_pagina)
+        paginas = tabela_paginada.numero_paginas(total, tamanho_pagina)
+        if st.session_state.get(chave_pagina, 1) > paginas:
+            st.session_state[chave_pagina] = paginas
+            pagina, total = tabela.consultar(ordenar_por, decrescente, busca, paginas, tamanho_pagina)
+        formatos = mapa_metricas.formatos_tabela(colunas)
+        configuracao = {
+            coluna: st.column_config.NumberColumn(titulo, format=tabela_paginada.formato_printf(formatos[coluna]))
+            if coluna in formatos else st.column_config.TextColumn(titulo)
+            for coluna, titulo in colunas.items()
+        }
+        st.dataframe(pagina, column_config=configuracao, column_order=list(colunas), hide_index=True, height=400,
+                     use_container_width=True)
+        medicao.linhas = len(pagina)
+
+    col_pagina, col_contagem = st.columns([1, 3])
+    numero_pagina = col_pagina.number_input("Página:", min_value=1, max_value=paginas, value=1, step=1, key=chave_pagina)
+    inicio = (numero_pagina - 1) * tamanho_pagina
+    col_contagem.caption(
+        f"Municípios {min(inicio + 1, total)}–{min(inicio + tamanho_pagina, total)} de {total}"
+        + (f" com '{busca.strip()}' no nome" if busca.strip() else "")
+    )
+
+
+@st.cache_resource # Um cache de mapas por processo, compartilhado por todas as sessões
+def obter_cache_mapas():
+    """Cria o cache LRU dos artefatos de mapa (orçamento em PAINEL_IDEB_CACHE_MAPAS_MB)."""
+    return cache_mapas.CacheArtefatosMapa()
+
+
+def exibir_mapa_em_cache(chave, criar_mapa, largura, altura, ler_pronto=None):
+    """
+    Exibe o mapa da chave (versão dos dados, ano das geometrias, UF, métrica), buscando o HTML
+    já renderizado no cache ou chamando criar_mapa() para construí-lo.
+    'ler_pronto', se informado, lê o artefato pré-renderizado por renderizacao_lote.py
+    (ou retorna None) antes de construir o mapa.
+    Retorna False se não houver mapa (criar_mapa() retornou None).
+    """
+    def criar_artefato():
+        instrumentacao.registrar_falha_cache()
+        if ler_pronto is not None:
+            with instrumentacao.etapa('leitura_mapa_pronto'):
+                artefato = ler_pronto()
+            if artefato is not None:
+                return artefato
+        with instrumentacao.etapa('construcao_mapa'):
+            mapa = criar_mapa()
+        if mapa is None:
+            return None
+        with instrumentacao.etapa('serializacao_html'):
+            return mapa_metricas.artefato_mapa(mapa)
+
+    with instrumentacao.etapa(f"mapa_{chave[-1]}", cache=True) as medicao:
+        artefato = obter_cache_mapas().obter_ou_criar(chave, criar_artefato)
+        if artefato is None:
+            return False
+        medicao.bytes = cache_mapas.tamanho_artefato(artefato['html'])
+        components.html(artefato['html'], width=largura, height=altura)
+    return True
 
-    min_val = gdf_mapa_filtrado[coluna_valor].min()
-    max_val = gdf_mapa_filtrado[coluna_valor].max()
-    
-    bins_mapa = None 
-    cor_preenchimento = 'YlGnBu'
-
-    if not (pd.isna(min_val) or pd.isna(max_val) or min_val == max_val):
-        try:
-            n_cores = 6
-            bins_mapa_tentativa = list(gdf_mapa_filtrado[coluna_valor].quantile([i/n_cores for i in range(n_cores + 1)]))
-            bins_mapa_tentativa = sorted(list(set(bins_mapa_tentativa)))
-            if len(bins_mapa_tentativa) >= 2:
-                bins_mapa = bins_mapa_tentativa
-            else:
-                bins_mapa = np.linspace(min_val, max_val, n_cores + 1).tolist()
-            if len(bins_mapa) < 2:
-                 bins_mapa = [min_val, max_val] if min_val != max_val else [min_val, min_val + 0.1]
-        except Exception:
-            bins_mapa = [min_val, max_val] if min_val != max_val else [min_val, min_val + 0.1]
-            st.info(f"Não foi possível gerar uma escala de cores dinâmica para {legenda_titulo}. Usando escala simples.")
-    else:
-        st.info(f"Variação de dados insuficiente ou valores ausentes para {legenda_titulo}. Usando cor padrão ou escala simples.")
-        if not (pd.isna(min_val) or pd.isna(max_val)):
-            bins_mapa = [min_val, max_val] if min_val != max_val else [min_val, min_val + 0.1]
-
-    choropleth_layer = folium.Choropleth(
-        geo_data=gdf_mapa_filtrado.__geo_interface__,
-        name='Choropleth',
-        data=gdf_mapa_filtrado,
-        columns=['code_muni', coluna_valor],
-        key_on='feature.properties.code_muni',
-        fill_color=cor_preenchimento,
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name=legenda_titulo,
-        bins=bins_mapa,
-        highlight=True
-    ).add_to(mapa)
-
-    folium.GeoJsonTooltip(
-        fields=['name_muni', coluna_valor],
-        aliases=['Município:', legenda_titulo + ':'],
-        localize=True, sticky=False, labels=True,
-        style="background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; box-shadow: 3px;",
-        max_width=800,
-    ).add_to(choropleth_layer.geojson)
-    
-    return mapa
 
 # --- Interface Principal do Streamlit ---
 st.title("Painel IDEB Brasil (Dados Geo Locais - Ano 2020)") # Título atualizado
 
 # Carregamento dos dados
-# Certifique-se de que 'ideb_escola_2021.txt' está na raiz do repositório ou ajuste o caminho
-# Os dados do IDEB ainda são de 2021, mas os dados geoespaciais são de 2020.
-# Isso pode ou não ser um problema, dependendo da sua análise.
-# Se precisar de dados do IDEB de 2020, você precisaria de um arquivo diferente.
-df_ideb = carregar_dados_ideb("mapa_ideb_2021/ideb_escola_2021.txt")
-br_muni_gdf, br_estados_gdf = carregar_dados_geoespaciais_locais() # Carrega dados geoespaciais locais de 2020
-
-if df_ideb is not None and br_muni_gdf is not None and br_estados_gdf is not None:
+# Se a série histórica particionada por ano existir (gerada por serie_ideb.py), o painel
+# oferece um seletor de ano e lê só as partições necessárias, sem carregar as escolas.
+# Caso contrário, usa o arquivo 'ideb_escola_2021.txt' (ou o Parquet gerado por ingestao_ideb.py).
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource # Um cubo por arquivo do IDEB, lido uma vez e compartilhado entre sessões
+def carregar_cubo(caminho_txt, versao_cubo):
+    """
+    Cubo de rede, localização e etapa gerado por cubo_ideb.py para o TXT do IDEB de um ano,
+    ou None se não foi gerado ou está desatualizado. 'versao_cubo' invalida o cache quando ele é regerado.
+    """
+    instrumentacao.registrar_falha_cache()
+    if versao_cubo is None:
+        return None
+    return cubo_ideb.carregar_cubo(caminho_txt)
+
+
+@instrumentacao.instrumentar(cache=True)
+@st.cache_resource(max_entries=ENTRADAS_CACHE_VERSOES) # Uma consulta por combinação de filtros e versão dos dados
+def consultar_agregados_cubo(versao, filtros, _cubo, _cubo_comparacao=None):
+    """
+    Agregados por município só das escolas dos 'filtros' ((dimensão, membros), ...), buscados no cubo
+    sem reler as escolas; com o cubo do ano de comparação, acrescenta as variações (colunas variacao_*).
+    'versao' identifica os dados, os cubos e os filtros (os cubos não são hasheados).
+    """
+    instrumentacao.registrar_falha_cache()
+    filtros = dict(filtros)
+    agregados = _cubo.consultar('municipio', filtros)
+    if _cubo_comparacao is not None:
+        agregados_base = _cubo_comparacao.consultar('municipio', filtros)
+        agregados = agregados.join(serie_ideb.calcular_variacoes(agregados, agregados_base))
+    return agregados
+
+
+def resumo_hierarquico(cubo, filtros, sigla_estado):
+    """IDEB médio e número de escolas no estado, na região e no Brasil, somados no cubo com os filtros."""
+    cod_uf = {sigla: codigo for codigo, sigla in ingestao_ideb.CODIGOS_IBGE_UF.items()}.get(sigla_estado)
+    if cod_uf is None:
+        return ""
+    partes = []
+    for nivel, codigo, nome in (('uf', cod_uf, sigla_estado),
+                                ('regiao', cod_uf // 10, cubo_ideb.REGIOES.get(cod_uf // 10)),
+                                ('brasil', 0, "Brasil")):
+        agregados = cubo.consultar(nivel, filtros)
+        if codigo in agregados.index and agregados.loc[codigo, 'contagem_ideb'] > 0:
+            partes.append(f"{nome}: {agregados.loc[codigo, 'media_ideb']:.2f} ({agregados.loc[codigo, 'contagem_ideb']} escolas)")
+    return "; ".join(partes)
+
+
+# Os dados geoespaciais são de 2020; os códigos dos municípios são os mesmos entre os anos.
+PASTA_SERIE_IDEB = "mapa_ideb_2021/dados_ideb"
+# Mapas de todos os estados pré-renderizados por renderizacao_lote.py (opcional)
+PASTA_MAPAS_PRONTOS = "mapa_ideb_2021/mapas_prontos"
+OPCAO_BRASIL = "BR" # Opção do seletor de estados para o mapa nacional em tiles vetoriais
+anos_serie = serie_ideb.anos_disponiveis(PASTA_SERIE_IDEB)
+# Arquivo do IDEB de cada ano; ao lado dele fica o cubo gerado por cubo_ideb.py (opcional)
+MODELO_ARQUIVO_IDEB = "mapa_ideb_2021/ideb_escola_{ano}.txt"
+caminho_ideb = MODELO_ARQUIVO_IDEB.format(ano=2021)
+versao_txt_ideb = ingestao_ideb.versao_dados(caminho_ideb) if not anos_serie else None
+# Dados do IDEB (sem a série) e geometrias são independentes: carregados ao mesmo tempo
+tarefas_carga = {
+    "estados": lambda: carregar_dados_geoespaciais_locais(FONTE_GEO.nome, "estados"),
+    "municipios": lambda: carregar_municipios_nacionais(FONTE_GEO.nome),
+}
+if not anos_serie:
+    tarefas_carga["ideb"] = lambda: carregar_dados_ideb(caminho_ideb, versao_txt_ideb)
+resultados_carga, erros_carga = carregar_dados_em_paralelo(tarefas_carga)
+mensagens_erro = []
+for nome_carga, erro in erros_carga.items():
+    mensagens_erro += mensagens_erro_ideb(caminho_ideb, erro) if nome_carga == "ideb" else mensagens_erro_geometrias(erro)
+for mensagem in dict.fromkeys(mensagens_erro): # Sem repetir a mesma mensagem das duas geometrias
+    st.error(mensagem)
+df_ideb = resultados_carga.get("ideb")
+br_estados_gdf = resultados_carga.get("estados")
+br_muni_gdf = resultados_carga.get("municipios") # Dados geoespaciais locais de 2020
+# Sem o Brasil inteiro carregado, os municípios são lidos só para o estado selecionado
+leitura_por_estado = "municipios" not in erros_carga and br_muni_gdf is None
+legenda_cache_mapas = None
+
+if (anos_serie or df_ideb is not None) and (leitura_por_estado or br_muni_gdf is not None) and br_estados_gdf is not None:
     
     st.sidebar.header("Filtros")
+    ano_ideb, ano_comparacao = 2021, None
+    if anos_serie:
+        ano_ideb = st.sidebar.selectbox("Ano do IDEB:", options=anos_serie[::-1], index=0)
+        anos_anteriores = [ano for ano in anos_serie if ano < ano_ideb]
+        if anos_anteriores:
+            opcao_comparacao = st.sidebar.selectbox(
+                "Comparar com o ano:", options=["Nenhum"] + anos_anteriores[::-1], index=0
+            )
+            ano_comparacao = None if opcao_comparacao == "Nenhum" else opcao_comparacao
+    anos_lidos = [ano_ideb] + ([ano_comparacao] if ano_comparacao else [])
+    # Filtros por rede, localização e etapa, respondidos pelo cubo do ano (e do ano de comparação)
+    arquivos_cubos = [MODELO_ARQUIVO_IDEB.format(ano=ano) for ano in anos_lidos]
+    cubos = [carregar_cubo(arquivo, cubo_ideb.versao_cubo(arquivo)) for arquivo in arquivos_cubos]
+    filtros_cubo = {}
+    if all(cubo is not None for cubo in cubos):
+        for dimensao in cubos[0].dimensoes():
+            escolhidos = st.sidebar.multiselect(
+                f"{cubo_ideb.TITULOS_DIMENSOES[dimensao]}:", options=cubos[0].membros(dimensao), placeholder="Todas"
+            )
+            if escolhidos:
+                filtros_cubo[dimensao] = tuple(escolhidos)
+    elif cubos[0] is not None:
+        st.sidebar.caption(f"Filtros por rede, localização e etapa indisponíveis: cubo de {ano_comparacao} não gerado (cubo_ideb.py).")
     lista_estados_sigla = sorted(br_estados_gdf['abbrev_state'].unique())
+    # Com os tiles vetoriais gerados (tiles_vetoriais.py gerar), o Brasil inteiro também pode ser escolhido
+    caminho_tiles = tiles_vetoriais.caminho_mbtiles(PASTA_DADOS_GEO, ANO_GEO)
+    if os.path.exists(caminho_tiles):
+        # O servidor local de tiles só é alcançável pelo navegador da própria máquina
+        if tiles_vetoriais.tiles_acessiveis(st.context.headers.get('Host')):
+            lista_estados_sigla = [OPCAO_BRASIL] + lista_estados_sigla
+        else:
+            st.sidebar.caption("Mapa nacional indisponível neste acesso: configure PAINEL_IDEB_URL_TILES com o endereço público dos tiles.")
     default_index_estado = lista_estados_sigla.index('AM') if 'AM' in lista_estados_sigla else 0
     estado_selecionado_sigla = st.sidebar.selectbox(
         "Selecione um Estado:",
         options=lista_estados_sigla,
-        index=default_index_estado
+        index=default_index_estado,
+        format_func=lambda sigla: "Brasil (todos os municípios)" if sigla == OPCAO_BRASIL else sigla
     )
+    modo_mapas = st.sidebar.radio(
+        "Exibição dos mapas:",
+        options=["Um mapa (troca de métrica no mapa)", "Três mapas lado a lado"],
+        index=0
+    )
+    metodo_classes = st.sidebar.selectbox(
+        "Classes de cores:",
+        options=list(classificacao.METODOS),
+        format_func=classificacao.METODOS.get,
+        index=list(classificacao.METODOS).index(classificacao.METODO_PADRAO)
+    )
+    metricas_mapa = dict(mapa_metricas.METRICAS_MAPA, **(mapa_metricas.VARIACOES_MAPA if ano_comparacao else {}))
+    # Desligado por padrão: a vizinhança só é carregada quando os agrupamentos são pedidos
+    coluna_lisa = None
+    if analise_espacial.sparse is not None:
+        coluna_lisa = st.sidebar.selectbox(
+            "Agrupamentos espaciais (LISA):",
+            options=[None] + list(metricas_mapa),
+            format_func=lambda coluna: "Nenhum" if coluna is None else metricas_mapa[coluna],
+            index=0
+        )
+    else:
+        st.sidebar.caption("Agrupamentos espaciais (LISA) indisponíveis: pacote 'scipy' não instalado.")
+    # Preenchido no fim do rerun, depois de os mapas desta execução passarem pelo cache
+    legenda_cache_mapas = st.sidebar.empty()
 
-    if estado_selecionado_sigla:
-        estado_geom_centroide = br_estados_gdf[br_estados_gdf['abbrev_state'] == estado_selecionado_sigla].geometry.iloc[0].centroid
-        muni_estado_gdf = br_muni_gdf[br_muni_gdf['abbrev_state'] == estado_selecionado_sigla].copy()
-        ideb_estado_df = df_ideb[df_ideb['UF'] == estado_selecionado_sigla].copy()
+    # Agregados do ano selecionado e chave que identifica esses dados nos caches
+    if anos_serie:
+        versao_ideb = serie_ideb.versao_serie(PASTA_SERIE_IDEB, anos_lidos)
+        agregados = carregar_agregados_serie(versao_ideb, ano_ideb, ano_comparacao)
+        particoes_escolas = None
+    else:
+        # A mesma versão que indexou a carga: os agregados e as chaves de cache não se desencontram
+        versao_ideb = versao_txt_ideb
+        particoes_escolas, agregados = preparar_agregados_txt(caminho_ideb, versao_ideb, df_ideb)
+    if filtros_cubo:
+        # Os filtros entram na versão, e com ela em todas as chaves de cache (tabelas, cores e mapas)
+        versao_ideb = "|".join(
+            [versao_ideb, cubo_ideb.descrever_filtros(filtros_cubo)]
+            + [cubo_ideb.versao_cubo(arquivo) for arquivo in arquivos_cubos]
+        )
+        agregados = consultar_agregados_cubo(versao_ideb, tuple(filtros_cubo.items()), cubos[0], cubos[1] if ano_comparacao else None)
+        particoes_escolas = None
+    chave_dados = renderizacao_lote.chave_dados(versao_ideb, ano_ideb, ano_comparacao)
+    colunas_classes = tuple(mapa_metricas.METRICAS_MAPA) + (tuple(mapa_metricas.VARIACOES_MAPA) if ano_comparacao else ())
+    classes_cores = preparar_classes_cores(chave_dados, metodo_classes, colunas_classes, agregados)
+
+    if estado_selecionado_sigla == OPCAO_BRASIL:
+        # Só os tiles visíveis são baixados do servidor local; os valores seguem no HTML do mapa
+        st.subheader(f"Mapa Nacional das Notas por Município ({ano_ideb})")
+        url_tiles, zoom_maximo_tiles = iniciar_servidor_tiles(caminho_tiles)
+        classes_nacionais = preparar_classes_nacionais(chave_dados, metodo_classes, tuple(metricas_mapa), agregados)
+        chave_mapa = (chave_dados, ANO_GEO, OPCAO_BRASIL, metodo_classes, tiles_vetoriais.versao_mbtiles(caminho_tiles), url_tiles)
+        if not exibir_mapa_em_cache(
+            chave_mapa + ('nacional',),
+            lambda: mapa_metricas.criar_mapa_nacional(
+                agregados, metricas_mapa, url_tiles, tiles_vetoriais.NOME_CAMADA, zoom_maximo_tiles, padrao='media_ideb',
+                classes=classes_nacionais
+            ),
+            largura=1100, altura=700
+        ):
+            st.info("Mapa nacional não disponível (sem dados válidos).")
+        st.caption("Clique em um município para ver os valores.")
+        st.subheader(f"Notas Médias por Município - Brasil ({ano_ideb})")
+        colunas_nacional = dict(
+            {'name_muni': mapa_metricas.COLUNAS_TABELA['name_muni'], 'abbrev_state': 'UF'},
+            **mapa_metricas.colunas_tabela(com_variacoes=bool(ano_comparacao))
+        )
+        exibir_tabela_paginada(
+            preparar_tabela_nacional(chave_dados, FONTE_GEO.nome, bool(ano_comparacao), agregados), colunas_nacional, OPCAO_BRASIL)
+    elif estado_selecionado_sigla:
+        estado_geom = br_estados_gdf[br_estados_gdf['abbrev_state'] == estado_selecionado_sigla].geometry.iloc[0]
+        estado_geom_centroide = estado_geom.centroid
+        with instrumentacao.etapa('filtro_uf') as medicao:
+            if leitura_por_estado:
+                # Lê só os municípios do estado no armazenamento binário (filtro por UF + bbox)
+                muni_notas_gdf = carregar_municipios_estado_local(FONTE_GEO.nome, estado_selecionado_sigla, tuple(estado_geom.bounds), chave_dados, agregados)
+            else:
+                # Os agregados de todo o Brasil já estão unidos às geometrias e indexados por UF: trocar de estado é só uma fatia
+                muni_notas_gdf = preparar_particoes_municipios(chave_dados, agregados, br_muni_gdf).obter(estado_selecionado_sigla)
+            medicao.linhas = len(muni_notas_gdf)
 
-        if muni_estado_gdf.empty:
+        if particoes_escolas is not None:
+            sem_dados_ideb = estado_selecionado_sigla not in particoes_escolas
+        else:
+            sem_dados_ideb = (muni_notas_gdf['contagem_ideb'] == 0).all()
+
+        if muni_notas_gdf.empty:
             st.warning(f"Não foram encontrados municípios para o estado {estado_selecionado_sigla} nos dados geoespaciais de 2020.")
-        elif ideb_estado_df.empty:
-            st.warning(f"Não foram encontrados dados do IDEB (2021) para o estado {estado_selecionado_sigla}.")
+        elif sem_dados_ideb:
+            st.warning(f"Não foram encontrados dados do IDEB ({ano_ideb}) para o estado {estado_selecionado_sigla}.")
         else:
-            media_mat_df = ideb_estado_df.groupby('cod_mun')['nota_matem'].mean().reset_index().rename(columns={'nota_matem': 'media_mat'})
-            media_por_df = ideb_estado_df.groupby('cod_mun')['nota_portugues'].mean().reset_index().rename(columns={'nota_portugues': 'media_por'})
-            media_ideb_df = ideb_estado_df.groupby('cod_mun')['ideb'].mean().reset_index().rename(columns={'ideb': 'media_ideb'})
-            
-            muni_notas_gdf = pd.merge(muni_estado_gdf, media_mat_df, left_on='code_muni', right_on='cod_mun', how='left')
-            muni_notas_gdf = pd.merge(muni_notas_gdf, media_por_df, on='cod_mun', how='left')
-            muni_notas_gdf = pd.merge(muni_notas_gdf, media_ideb_df, on='cod_mun', how='left')
-            
-            if 'cod_mun_x' in muni_notas_gdf.columns:
-                muni_notas_gdf.drop(columns=[col for col in muni_notas_gdf.columns if '_y' in col], inplace=True, errors='ignore')
-                muni_notas_gdf.rename(columns={col: col.replace('_x', '') for col in muni_notas_gdf.columns if '_x' in col}, inplace=True, errors='ignore')
-
-            st.subheader(f"Notas Médias por Município - {estado_selecionado_sigla}")
-            tabela_df_display = muni_notas_gdf[['name_muni', 'media_mat', 'media_por', 'media_ideb']].copy()
-            tabela_df_display.rename(columns={
-                'name_muni': 'Município', 'media_mat': 'Profic. Mat.',
-                'media_por': 'Profic. Port.', 'media_ideb': 'IDEB (Média)'
-            }, inplace=True)
-            tabela_df_display.dropna(subset=['Profic. Mat.', 'Profic. Port.', 'IDEB (Média)'], how='all', inplace=True)
-            st.dataframe(tabela_df_display.style.format({
-                'Profic. Mat.': '{:.2f}', 'Profic. Port.': '{:.2f}', 'IDEB (Média)': '{:.2f}'
-            }), height=400, use_container_width=True)
+            st.subheader(f"Notas Médias por Município - {estado_selecionado_sigla} ({ano_ideb})")
+            if cubos[0] is not None:
+                resumo = resumo_hierarquico(cubos[0], filtros_cubo, estado_selecionado_sigla)
+                if resumo:
+                    st.caption(f"IDEB médio das escolas{' filtradas' if filtros_cubo else ''} - {resumo}")
+            exibir_tabela_paginada(
+                preparar_tabela_estado(chave_dados, estado_selecionado_sigla, bool(ano_comparacao), muni_notas_gdf),
+                mapa_metricas.colunas_tabela(com_variacoes=bool(ano_comparacao)), estado_selecionado_sigla)
 
             st.subheader(f"Mapas de Distribuição das Notas - {estado_selecionado_sigla}")
-            col_mapa1, col_mapa2, col_mapa3 = st.columns(3)
-
-            with col_mapa1:
-                st.markdown("##### Média de Matemática")
-                mapa_mat = criar_mapa_folium(muni_notas_gdf, 'media_mat', 'Média Mat.', estado_geom_centroide)
-                if mapa_mat: st_folium(mapa_mat, width=450, height=450)
-                else: st.info("Mapa de Matemática não disponível (sem dados válidos).")
-            with col_mapa2:
-                st.markdown("##### Média de Português")
-                mapa_por = criar_mapa_folium(muni_notas_gdf, 'media_por', 'Média Port.', estado_geom_centroide)
-                if mapa_por: st_folium(mapa_por, width=450, height=450)
-                else: st.info("Mapa de Português não disponível (sem dados válidos).")
-            with col_mapa3:
-                st.markdown("##### Média do IDEB")
-                mapa_ideb_geral = criar_mapa_folium(muni_notas_gdf, 'media_ideb', 'IDEB (Média)', estado_geom_centroide)
-                if mapa_ideb_geral: st_folium(mapa_ideb_geral, width=450, height=450)
-                else: st.info("Mapa do IDEB não disponível (sem dados válidos).")
+            niveis_geometria = preparar_geometrias_simplificadas(
+                armazem_compartilhado.versao_geometrias(FONTE_GEO, 'municipios', ANO_GEO), estado_selecionado_sigla, muni_notas_gdf)
+            chave_mapa = (chave_dados, ANO_GEO, estado_selecionado_sigla, metodo_classes)
+            classes_estado = classes_cores.get(estado_selecionado_sigla, {})
+            # Os mapas pré-renderizados só valem se foram gerados com os mesmos dados e o mesmo método de cores
+            manifesto_prontos = renderizacao_lote.ler_manifesto(PASTA_MAPAS_PRONTOS)
+            if renderizacao_lote.manifesto_compativel(manifesto_prontos, chave_dados, ANO_GEO, metodo_classes):
+                ler_pronto = lambda nome: lambda: renderizacao_lote.ler_artefato_pronto(
+                    PASTA_MAPAS_PRONTOS, manifesto_prontos, estado_selecionado_sigla, nome)
+            else:
+                ler_pronto = lambda nome: None
+
+            if modo_mapas.startswith("Um mapa"):
+                # Geometrias serializadas uma única vez; a troca de métrica recolore a camada no navegador
+                if not exibir_mapa_em_cache(
+                    chave_mapa + ('multimetrica',),
+                    lambda: mapa_metricas.criar_mapa_multimetrica(
+                        muni_notas_gdf, metricas_mapa, estado_geom_centroide, niveis_geometria, largura_px=900, padrao='media_ideb',
+                        classes=classes_estado, altura_px=600
+                    ),
+                    largura=900, altura=600, ler_pronto=ler_pronto('multimetrica')
+                ):
+                    st.info("Mapa não disponível (sem dados válidos).")
+            else:
+                col_mapa1, col_mapa2, col_mapa3 = st.columns(3)
+
+                with col_mapa1:
+                    st.markdown("##### Média de Matemática")
+                    mapa_mat = lambda: criar_mapa_folium(muni_notas_gdf, 'media_mat', 'Média Mat.', estado_geom_centroide, niveis_geometria, bins_mapa=classes_estado.get('media_mat'))
+                    if not exibir_mapa_em_cache(chave_mapa + ('media_mat',), mapa_mat, largura=450, altura=450, ler_pronto=ler_pronto('media_mat')):
+                        st.info("Mapa de Matemática não disponível (sem dados válidos).")
+                with col_mapa2:
+                    st.markdown("##### Média de Português")
+                    mapa_por = lambda: criar_mapa_folium(muni_notas_gdf, 'media_por', 'Média Port.', estado_geom_centroide, niveis_geometria, bins_mapa=classes_estado.get('media_por'))
+                    if not exibir_mapa_em_cache(chave_mapa + ('media_por',), mapa_por, largura=450, altura=450, ler_pronto=ler_pronto('media_por')):
+                        st.info("Mapa de Português não disponível (sem dados válidos).")
+                with col_mapa3:
+                    st.markdown("##### Média do IDEB")
+                    mapa_ideb_geral = lambda: criar_mapa_folium(muni_notas_gdf, 'media_ideb', 'IDEB (Média)', estado_geom_centroide, niveis_geometria, bins_mapa=classes_estado.get('media_ideb'))
+                    if not exibir_mapa_em_cache(chave_mapa + ('media_ideb',), mapa_ideb_geral, largura=450, altura=450, ler_pronto=ler_pronto('media_ideb')):
+                        st.info("Mapa do IDEB não disponível (sem dados válidos).")
+
+            if coluna_lisa:
+                titulo_lisa = metricas_mapa[coluna_lisa]
+                st.subheader(f"Agrupamentos Espaciais (LISA) - {titulo_lisa} - {estado_selecionado_sigla}")
+                moran_global, lisa_locais = preparar_analise_espacial(
+                    chave_dados, FONTE_GEO.nome, analise_espacial.TIPO_PADRAO, estado_selecionado_sigla, coluna_lisa, muni_notas_gdf)
+                if moran_global is None:
+                    st.info("Agrupamentos não disponíveis (poucos municípios vizinhos com dados).")
+                else:
+                    st.caption(
+                        f"I de Moran global: {moran_global['moran_i']:.3f} (esperado sem autocorrelação: {moran_global['esperado']:.3f}; "
+                        f"pseudo p-valor {moran_global['p_valor']:.3f}; {moran_global['n']} municípios; "
+                        f"contiguidade {analise_espacial.TIPOS_CONTIGUIDADE[analise_espacial.TIPO_PADRAO].lower()}). "
+                        f"Os vizinhos de outros estados não entram no cálculo."
+                    )
+                    if not exibir_mapa_em_cache(
+                        chave_mapa + (analise_espacial.TIPO_PADRAO, f"lisa_{coluna_lisa}"),
+                        lambda: mapa_metricas.criar_mapa_lisa(
+                            muni_notas_gdf, lisa_locais, titulo_lisa, estado_geom_centroide, niveis_geometria, largura_px=900, altura_px=600),
+                        largura=900, altura=600
+                    ):
+                        st.info("Mapa de agrupamentos não disponível (sem dados válidos).")
 else:
     st.error("Não foi possível carregar os dados necessários para exibir o painel. Verifique os arquivos de dados e as mensagens de erro acima.")
 
+if legenda_cache_mapas is not None:
+    estatisticas_cache = obter_cache_mapas().estatisticas()
+    legenda_cache_mapas.caption(
+        f"Cache de mapas: {estatisticas_cache['itens']} itens, "
+        f"{estatisticas_cache['bytes'] / 1024 / 1024:.1f} de {estatisticas_cache['limite_bytes'] / 1024 / 1024:.0f} MB, "
+        f"{estatisticas_cache['acertos']} acertos / {estatisticas_cache['falhas']} falhas"
+    )
+
+# Diagnóstico de desempenho: etapas medidas neste rerun
+execucao = instrumentacao.finalizar_execucao()
+with st.sidebar.expander("Diagnóstico de desempenho"):
+    st.caption(f"Rerun completo em {execucao.segundos * 1000:.0f} ms")
+    etapas_df = pd.DataFrame([m.como_dict() for m in execucao.etapas])
+    if not etapas_df.empty:
+        etapas_df['ms'] = etapas_df.pop('segundos') * 1000
+        etapas_df['pico_memoria_mb'] = pd.to_numeric(etapas_df.pop('pico_memoria_bytes')) / 1024 / 1024
+        etapas_df[['linhas', 'bytes']] = etapas_df[['linhas', 'bytes']].apply(pd.to_numeric)
+        st.dataframe(etapas_df[['etapa', 'ms', 'pico_memoria_mb', 'linhas', 'bytes', 'cache']].style.format(
+            {'ms': '{:.1f}', 'pico_memoria_mb': '{:.1f}', 'linhas': '{:.0f}', 'bytes': '{:.0f}'}, na_rep='-'
+        ), hide_index=True, use_container_width=True)
+    # O tracemalloc é do processo: só muda com o botão (nunca pelo estado de cada sessão a cada rerun)
+    if instrumentacao.memoria_fixada_por_ambiente():
+        st.caption("Medição de memória ligada por PAINEL_IDEB_MEDIR_MEMORIA=1 (todas as sessões).")
+    elif instrumentacao.memoria_ativa():
+        st.button("Desligar medição de memória (todas as sessões)",
+                  on_click=instrumentacao.ativar_memoria, args=(False,), key='alternar_memoria')
+    else:
+        st.button("Ligar medição de memória (tracemalloc, mais lento; todas as sessões)",
+                  on_click=instrumentacao.ativar_memoria, args=(True,), key='alternar_memoria')
+    st.caption("Exportação: PAINEL_IDEB_LOG_ETAPAS (JSON por linha) e PAINEL_IDEB_PROMETHEUS (texto do Prometheus).")
+
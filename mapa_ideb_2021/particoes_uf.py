@@ -0,0 +1,56 @@
+# Índice de partições por UF.
+# Reordena um DataFrame (ou GeoDataFrame) UMA VEZ pela UF, usando os códigos da
+# categoria fixa de UFs, e guarda o início e o fim da fatia contígua de cada estado.
+# Buscar um estado passa a custar O(tamanho da partição) e devolve uma fatia
+# (view) do frame reordenado, sem comparar strings nem copiar o país inteiro.
+
+import numpy as np
+import pandas as pd
+
+from ingestao_ideb import UFS_BRASIL
+
+
+class ParticoesUF:
+    """
+    Partições contíguas de um frame por UF.
+    As fatias retornadas por obter() são somente leitura: quem precisar alterá-las deve copiar.
+    """
+
+    def __init__(self, df, coluna_uf):
+        self.coluna_uf = coluna_uf
+        codigos = pd.Categorical(df[coluna_uf].astype(str), categories=UFS_BRASIL).codes
+        # Ordenação estável: dentro de cada UF a ordem original das linhas é mantida.
+        # UFs desconhecidas (código -1) ficam no início e não pertencem a nenhuma partição.
+        if np.all(codigos[:-1] <= codigos[1:]):
+            # Frame já ordenado por UF (ex: armazem_compartilhado.py): usado sem cópia
+            self.df = df
+            self.codigos = codigos
+        else:
+            ordem = np.argsort(codigos, kind='stable')
+            self.df = df.iloc[ordem]
+            self.codigos = codigos[ordem]
+        self._limites = np.searchsorted(self.codigos, np.arange(len(UFS_BRASIL) + 1), side='left')
+        self._posicao_uf = {uf: i for i, uf in enumerate(UFS_BRASIL)}
+
+    def limites(self, uf):
+        """Retorna (início, fim) da fatia da UF no frame reordenado; (0, 0) se a UF não existir."""
+        i = self._posicao_uf.get(uf)
+        if i is None:
+            return 0, 0
+        return int(self._limites[i]), int(self._limites[i + 1])
+
+    def obter(self, uf):
+        """Retorna a fatia (sem cópia) com as linhas da UF."""
+        inicio, fim = self.limites(uf)
+        return self.df.iloc[inicio:fim]
+
+    def ufs(self):
+        """Lista as UFs que têm pelo menos uma linha."""
+        return [uf for uf in UFS_BRASIL if self.tamanho(uf) > 0]
+
+    def tamanho(self, uf):
+        inicio, fim = self.limites(uf)
+        return fim - inicio
+
+    def __contains__(self, uf):
+        return self.tamanho(uf) > 0
@@ -0,0 +1,300 @@
+# Renderização em lote, fora do Streamlit, dos mapas e tabelas de todos os estados.
+# Reaproveita a carga, a agregação, a classificação e os construtores de mapa do painel
+# e grava, para cada UF, os arquivos prontos em uma pasta estática:
+#
+#   mapas_prontos/
+#     manifesto.json              chave dos dados, ano das geometrias, método das cores, UFs geradas
+#     index.html                  índice do espelho estático (não precisa de servidor Python)
+#     MG/index.html               tabela + mapa com troca de métrica
+#     MG/mapa_multimetrica.html   mapa único (troca de métrica no navegador)
+#     MG/mapa_media_mat.html      um mapa por métrica (modo "três mapas")
+#     MG/tabela.csv, MG/municipios.geojson
+#
+# Os estados são renderizados em paralelo em processos separados. A pasta é montada ao lado
+# e só substitui a anterior no final, então o painel nunca vê uma geração pela metade.
+# O painel serve esses arquivos quando o manifesto corresponde aos dados e ao método de
+# classificação selecionados; caso contrário, renderiza sob demanda como antes.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/renderizacao_lote.py --trabalhadores 4
+#   python mapa_ideb_2021/renderizacao_lote.py --ano 2021 --ano-comparacao 2019 --metodo jenks
+
+import argparse
+import html
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import agregados_ideb
+import armazem_compartilhado
+import classificacao
+import fontes_geometria
+import geometria_local
+import geometria_simplificada
+import ingestao_ideb
+import mapa_metricas
+import serie_ideb
+
+PASTA_MODULO = os.path.dirname(os.path.abspath(__file__))
+PASTA_SAIDA_PADRAO = os.path.join(PASTA_MODULO, "mapas_prontos")
+ARQUIVO_IDEB_PADRAO = os.path.join(PASTA_MODULO, "ideb_escola_2021.txt")
+PASTA_GEO_PADRAO = os.path.join(PASTA_MODULO, "dados_geoespaciais")
+ANO_GEO_PADRAO = 2020
+NOME_MANIFESTO = "manifesto.json"
+VERSAO_FORMATO = 1
+
+# Larguras usadas pelo painel: o nível de simplificação das geometrias depende delas
+LARGURA_MAPA_UNICO = 900
+ALTURA_MAPA_UNICO = 600
+LARGURA_MAPA_METRICA = 450
+
+
+def chave_dados(versao_ideb, ano_ideb, ano_comparacao):
+    """Identifica os agregados exibidos (versão dos arquivos, ano e ano de comparação). Igual à do painel."""
+    return f"{versao_ideb}|{ano_ideb}|{ano_comparacao}"
+
+
+def carregar_agregados(arquivo_ideb=ARQUIVO_IDEB_PADRAO, pasta_serie=serie_ideb.PASTA_SERIE_PADRAO, ano=None, ano_comparacao=None):
+    """
+    Carrega os agregados como o painel faz: da série particionada por ano, se existir,
+    ou do arquivo TXT/Parquet do IDEB. Retorna (agregados, chave_dados, ano, ano_comparacao).
+    """
+    anos_serie = serie_ideb.anos_disponiveis(pasta_serie)
+    if anos_serie:
+        ano = ano or anos_serie[-1]
+        anos_lidos = [ano] + ([ano_comparacao] if ano_comparacao else [])
+        for ano_lido in anos_lidos:
+            if ano_lido not in anos_serie:
+                raise ValueError(f"O ano {ano_lido} não está na série em '{pasta_serie}' (disponíveis: {anos_serie}).")
+        agregados = serie_ideb.ler_agregados_ano(pasta_serie, ano)
+        if ano_comparacao:
+            agregados_base = serie_ideb.ler_agregados_ano(pasta_serie, ano_comparacao)
+            agregados = agregados.join(serie_ideb.calcular_variacoes(agregados, agregados_base))
+        versao = serie_ideb.versao_serie(pasta_serie, anos_lidos)
+    else:
+        if ano_comparacao:
+            raise ValueError("A comparação entre anos exige a série particionada (ver serie_ideb.py).")
+        ano = 2021
+        agregados = agregados_ideb.calcular_agregados_municipios(ingestao_ideb.carregar_ideb(arquivo_ideb))
+        versao = ingestao_ideb.versao_dados(arquivo_ideb)
+    return agregados, chave_dados(versao, ano, ano_comparacao), ano, ano_comparacao
+
+
+def _pagina_estado(uf, ano, tabela_html, metricas):
+    """Página estática de um estado: tabela de municípios e o mapa com troca de métrica."""
+    links = " · ".join(f'<a href="mapa_{coluna}.html">{html.escape(titulo)}</a>' for coluna, titulo in metricas.items())
+    return f"""<!DOCTYPE html>
+<html lang="pt-br"><head><meta charset="utf-8"><title>IDEB {ano} - {uf}</title>
+<style>body{{font-family:sans-serif;margin:1.5em}} table{{border-collapse:collapse;font-size:0.9em}}
+td,th{{border:1px solid #ccc;padding:2px 6px}} td{{text-align:right}}</style></head>
+<body><p><a href="../index.html">Estados</a></p>
+<h1>Notas Médias por Município - {uf} ({ano})</h1>
+<iframe src="mapa_multimetrica.html" width="{LARGURA_MAPA_UNICO}" height="{ALTURA_MAPA_UNICO}" style="border:0"></iframe>
+<p>Um mapa por métrica: {links}</p>
+{tabela_html}
+</body></html>
+"""
+
+
+def renderizar_uf(uf, muni_estado_gdf, classes_uf, centro, pasta_uf, pasta_geo, ano_geo, ano, com_variacoes):
+    """
+    Renderiza os mapas e a tabela de um estado e grava os arquivos em 'pasta_uf'.
+    Executada em um processo separado. Retorna o registro do estado para o manifesto.
+    """
+    inicio = time.perf_counter()
+    os.makedirs(pasta_uf, exist_ok=True)
+    versao_geometrias = armazem_compartilhado.versao_geometrias(fontes_geometria.FonteArquivosLocais(pasta_geo), 'municipios', ano_geo)
+    niveis = geometria_simplificada.ler_niveis_estado(pasta_geo, ano_geo, uf, versao_geometrias)
+    if niveis is None:
+        niveis = geometria_simplificada.preparar_niveis_estado(muni_estado_gdf)
+
+    metricas = dict(mapa_metricas.METRICAS_MAPA, **(mapa_metricas.VARIACOES_MAPA if com_variacoes else {}))
+    mapas = {}
+    mapa = mapa_metricas.criar_mapa_multimetrica(muni_estado_gdf, metricas, centro, niveis,
+                                                 largura_px=LARGURA_MAPA_UNICO, padrao='media_ideb', classes=classes_uf,
+                                                 altura_px=ALTURA_MAPA_UNICO)
+    if mapa is not None:
+        mapas['multimetrica'] = mapa_metricas.artefato_mapa(mapa)
+    for coluna, titulo in mapa_metricas.METRICAS_MAPA.items():
+        gdf_filtrado = muni_estado_gdf.dropna(subset=[coluna])
+        if gdf_filtrado.empty:
+            continue
+        mapa = mapa_metricas.criar_mapa_coropletico(gdf_filtrado, coluna, titulo, centro, niveis,
+                                                    LARGURA_MAPA_METRICA, classes_uf.get(coluna))
+        mapas[coluna] = mapa_metricas.artefato_mapa(mapa)
+
+    arquivos = {}
+    for nome, artefato in mapas.items():
+        arquivo = f"mapa_{nome}.html"
+        with open(os.path.join(pasta_uf, arquivo), 'w', encoding='utf-8') as f:
+            f.write(artefato['html'])
+        arquivos[nome] = {'arquivo': arquivo, 'classes': artefato['classes']}
+
+    tabela, formatos = mapa_metricas.tabela_municipios(muni_estado_gdf, com_variacoes)
+    tabela.to_csv(os.path.join(pasta_uf, "tabela.csv"), index=False, float_format='%.4f')
+    colunas_geojson = ['code_muni', 'name_muni'] + [c for c in metricas if c in muni_estado_gdf.columns] + ['geometry']
+    muni_estado_gdf[colunas_geojson].assign(code_muni=muni_estado_gdf['code_muni'].astype('int64')).to_file(
+        os.path.join(pasta_uf, "municipios.geojson"), driver="GeoJSON")
+    tabela_html = tabela.style.format(formatos, na_rep='-').hide(axis='index').to_html()
+    with open(os.path.join(pasta_uf, "index.html"), 'w', encoding='utf-8') as f:
+        f.write(_pagina_estado(uf, ano, tabela_html, mapa_metricas.METRICAS_MAPA))
+
+    return {
+        'mapas': arquivos,
+        'municipios': int(len(tabela)),
+        'segundos': round(time.perf_counter() - inicio, 2),
+    }
+
+
+def _pagina_indice(manifesto):
+    itens = "\n".join(
+        f'<li><a href="{uf}/index.html">{uf}</a> ({registro["municipios"]} municípios)</li>'
+        for uf, registro in sorted(manifesto['ufs'].items())
+    )
+    return f"""<!DOCTYPE html>
+<html lang="pt-br"><head><meta charset="utf-8"><title>Painel IDEB - mapas por estado</title></head>
+<body style="font-family:sans-serif;margin:1.5em"><h1>IDEB {manifesto['ano']} por estado</h1>
+<p>Gerado em {manifesto['gerado_em']}. Classes de cores: {html.escape(classificacao.METODOS[manifesto['metodo']])}.</p>
+<ul>
+{itens}
+</ul></body></html>
+"""
+
+
+def renderizar_todos(pasta_saida=PASTA_SAIDA_PADRAO, arquivo_ideb=ARQUIVO_IDEB_PADRAO, pasta_serie=serie_ideb.PASTA_SERIE_PADRAO,
+                     pasta_geo=PASTA_GEO_PADRAO, ano_geo=ANO_GEO_PADRAO, ano=None, ano_comparacao=None,
+                     metodo=classificacao.METODO_PADRAO, estados=None, trabalhadores=None):
+    """
+    Renderiza todos os estados (ou só 'estados') em paralelo e publica a pasta de saída.
+    Retorna o manifesto gravado; estados que falharem ficam de fora dele e são listados em 'falhas'.
+    """
+    agregados, chave, ano, ano_comparacao = carregar_agregados(arquivo_ideb, pasta_serie, ano, ano_comparacao)
+    colunas = list(mapa_metricas.METRICAS_MAPA) + (list(mapa_metricas.VARIACOES_MAPA) if ano_comparacao else [])
+    classes = classificacao.classificar_agregados(agregados, colunas, metodo)
+
+    br_estados_gdf = geometria_local.ler_geometrias(pasta_geo, "estados", ano_geo)
+    centros = {uf: geom.centroid for uf, geom in zip(br_estados_gdf['abbrev_state'], br_estados_gdf.geometry)}
+    estados = sorted(estados or centros)
+
+    pasta_tmp = f"{pasta_saida}.tmp-{os.getpid()}"
+    shutil.rmtree(pasta_tmp, ignore_errors=True)
+    os.makedirs(pasta_tmp)
+    manifesto = {
+        'versao_formato': VERSAO_FORMATO,
+        'chave_dados': chave,
+        'ano': ano,
+        'ano_comparacao': ano_comparacao,
+        'ano_geo': ano_geo,
+        'metodo': metodo,
+        'gerado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'ufs': {},
+        'falhas': {},
+    }
+
+    print(f"Renderizando {len(estados)} estado(s) ({chave}, cores: {metodo})...")
+    with ProcessPoolExecutor(max_workers=trabalhadores) as executor:
+        futuros = {}
+        for uf in estados:
+            # Só os municípios do estado vão para o processo (leitura por UF no GeoParquet/FlatGeobuf)
+            muni_estado_gdf = geometria_local.ler_geometrias(pasta_geo, "municipios", ano_geo, uf=uf)
+            if muni_estado_gdf.empty:
+                manifesto['falhas'][uf] = "Nenhum município nas geometrias."
+                continue
+            muni_estado_gdf['code_muni'] = muni_estado_gdf['code_muni'].astype('Int64')
+            muni_estado_gdf = agregados_ideb.juntar_agregados_geometria(muni_estado_gdf, agregados)
+            futuro = executor.submit(renderizar_uf, uf, muni_estado_gdf, classes.get(uf, {}), centros[uf],
+                                     os.path.join(pasta_tmp, uf), pasta_geo, ano_geo, ano, bool(ano_comparacao))
+            futuros[futuro] = uf
+        for futuro in as_completed(futuros):
+            uf = futuros[futuro]
+            try:
+                manifesto['ufs'][uf] = futuro.result()
+            except Exception as e:
+                manifesto['falhas'][uf] = str(e)
+                print(f"{uf}: ERRO - {e}")
+                continue
+            print(f"{uf}: {manifesto['ufs'][uf]['municipios']} municípios em {manifesto['ufs'][uf]['segundos']} s")
+
+    with open(os.path.join(pasta_tmp, NOME_MANIFESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(pasta_tmp, "index.html"), 'w', encoding='utf-8') as f:
+        f.write(_pagina_indice(manifesto))
+
+    # Troca a pasta publicada de uma vez
+    pasta_antiga = f"{pasta_saida}.antiga-{os.getpid()}"
+    if os.path.exists(pasta_saida):
+        os.replace(pasta_saida, pasta_antiga)
+    os.replace(pasta_tmp, pasta_saida)
+    shutil.rmtree(pasta_antiga, ignore_errors=True)
+    return manifesto
+
+
+# --- Leitura pelo painel ---
+
+def ler_manifesto(pasta_saida):
+    """Manifesto da pasta de mapas prontos, ou None se ela não existir."""
+    caminho = os.path.join(pasta_saida, NOME_MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def manifesto_compativel(manifesto, chave, ano_geo, metodo):
+    """Os arquivos prontos só valem para os mesmos dados, geometrias e método de classificação."""
+    return (
+        manifesto is not None
+        and manifesto.get('versao_formato') == VERSAO_FORMATO
+        and manifesto['chave_dados'] == chave
+        and manifesto['ano_geo'] == ano_geo
+        and manifesto['metodo'] == metodo
+    )
+
+
+def caminho_mapa_pronto(pasta_saida, manifesto, uf, nome):
+    """Caminho do HTML pronto do mapa 'nome' ('multimetrica' ou a coluna) da UF, ou None."""
+    registro = manifesto['ufs'].get(uf)
+    if registro is None or nome not in registro['mapas']:
+        return None
+    caminho = os.path.join(pasta_saida, uf, registro['mapas'][nome]['arquivo'])
+    return caminho if os.path.exists(caminho) else None
+
+
+def ler_artefato_pronto(pasta_saida, manifesto, uf, nome):
+    """Artefato de mapa (mesmo formato de mapa_metricas.artefato_mapa) lido da pasta de mapas prontos, ou None."""
+    caminho = caminho_mapa_pronto(pasta_saida, manifesto, uf, nome)
+    if caminho is None:
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        return {'html': f.read(), 'classes': manifesto['ufs'][uf]['mapas'][nome]['classes']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-renderiza os mapas e tabelas de todos os estados em paralelo.")
+    parser.add_argument('--pasta-saida', default=PASTA_SAIDA_PADRAO, help="Pasta estática de saída.")
+    parser.add_argument('--arquivo-ideb', default=ARQUIVO_IDEB_PADRAO, help="TXT do IDEB (usado se não houver série).")
+    parser.add_argument('--pasta-serie', default=serie_ideb.PASTA_SERIE_PADRAO, help="Série particionada por ano.")
+    parser.add_argument('--ano', type=int, help="Ano da série (padrão: o mais recente).")
+    parser.add_argument('--ano-comparacao', type=int, help="Ano base para as variações.")
+    parser.add_argument('--pasta-geo', default=PASTA_GEO_PADRAO)
+    parser.add_argument('--ano-geo', type=int, default=ANO_GEO_PADRAO)
+    parser.add_argument('--metodo', default=classificacao.METODO_PADRAO, choices=list(classificacao.METODOS))
+    parser.add_argument('--estados', nargs='*', help="Siglas dos estados (padrão: todos).")
+    parser.add_argument('--trabalhadores', type=int, help="Número de processos (padrão: número de CPUs).")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    manifesto = renderizar_todos(
+        args.pasta_saida, args.arquivo_ideb, args.pasta_serie, args.pasta_geo, args.ano_geo,
+        args.ano, args.ano_comparacao, args.metodo, args.estados, args.trabalhadores,
+    )
+    print(f"{len(manifesto['ufs'])} estado(s) em '{args.pasta_saida}' ({time.perf_counter() - inicio:.1f} s).")
+    if manifesto['falhas']:
+        print(f"Falharam: {', '.join(sorted(manifesto['falhas']))}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
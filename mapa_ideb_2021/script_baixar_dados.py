@@ -1,45 +1,176 @@
-# Script para rodar localmente UMA VEZ para baixar os dados geoespaciais.
+# Script para rodar localmente para baixar os dados geoespaciais.
 # Certifique-se de que seu ambiente Conda com geobr (Python wrapper), R, r-geobr, etc., está ativo.
+#
+# Baixa vários anos e níveis (municípios, estados) em paralelo, grava cada arquivo de forma
+# atômica (arquivo temporário + renomeação) e registra em um manifesto o checksum e o número
+# de linhas de cada saída. Ao rodar de novo, as saídas já válidas são puladas, então um
+# download interrompido pode ser retomado.
+#
+# Exemplos (a partir da pasta mapa_ideb_2021):
+#   python script_baixar_dados.py                              (2021, municípios e estados)
+#   python script_baixar_dados.py --anos 2019-2021 --trabalhadores 3
+#   python script_baixar_dados.py --fonte local:/caminho/geojsons   (sem rede, ex: testes)
 
-import geobr # O wrapper Python para a biblioteca geobr do R
-import geopandas
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def baixar_e_salvar_dados_geo():
+import fontes_geometria # Fontes das geometrias (geobr ou arquivos locais)
+import geometria_local # Gravação em GeoJSON, GeoParquet e FlatGeobuf
+import ingestao_ideb # Para o cálculo do SHA-256 dos arquivos
+
+NIVEIS = ('municipios', 'estados')
+NOME_MANIFESTO = "manifesto_geo.json"
+
+
+def interpretar_anos(valores):
+    """Aceita anos soltos e intervalos: ['2019-2021', '2010'] -> [2010, 2019, 2020, 2021]."""
+    anos = set()
+    for valor in valores:
+        if '-' in valor:
+            inicio, fim = (int(v) for v in valor.split('-', 1))
+            anos.update(range(inicio, fim + 1))
+        else:
+            anos.add(int(valor))
+    return sorted(anos)
+
+
+def ler_manifesto(pasta_dados_geo):
+    caminho = os.path.join(pasta_dados_geo, NOME_MANIFESTO)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def gravar_manifesto(pasta_dados_geo, manifesto):
+    caminho = os.path.join(pasta_dados_geo, NOME_MANIFESTO)
+    caminho_tmp = caminho + '.tmp'
+    with open(caminho_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(caminho_tmp, caminho)
+
+
+def saida_valida(pasta_dados_geo, registro, formatos):
+    """Confere se todos os arquivos do registro existem e têm o checksum registrado."""
+    if not registro:
+        return False
+    for ext in formatos:
+        info = registro['arquivos'].get(ext)
+        caminho = os.path.join(pasta_dados_geo, info['arquivo']) if info else None
+        if not info or not os.path.exists(caminho):
+            return False
+        if os.path.getsize(caminho) != info['bytes'] or ingestao_ideb.calcular_hash_arquivo(caminho) != info['sha256']:
+            return False
+    return True
+
+
+def baixar_e_salvar(fonte, nivel, ano, pasta_dados_geo, formatos):
+    """
+    Tarefa executada em um processo separado: baixa um nível/ano e grava todos os formatos.
+    Retorna o registro do manifesto (arquivos com checksum, número de linhas, fonte e duração).
+    """
+    inicio = time.perf_counter()
+    gdf = fonte.ler(nivel, ano)
+    caminhos = geometria_local.salvar_geometrias(gdf, pasta_dados_geo, nivel, ano, formatos)
+    arquivos = {}
+    for ext, caminho in zip(formatos, caminhos):
+        arquivos[ext] = {
+            'arquivo': os.path.basename(caminho),
+            'sha256': ingestao_ideb.calcular_hash_arquivo(caminho),
+            'bytes': os.path.getsize(caminho),
+        }
+    return {
+        'nivel': nivel,
+        'ano': ano,
+        'linhas': int(len(gdf)),
+        'fonte': fonte.nome,
+        'arquivos': arquivos,
+        'segundos': round(time.perf_counter() - inicio, 1),
+    }
+
+
+def baixar_e_salvar_dados_geo(anos=(2021,), niveis=NIVEIS, pasta_dados_geo="dados_geoespaciais",
+                              fonte=None, trabalhadores=2, formatos=geometria_local.EXTENSOES, forcar=False):
     """
-    Baixa os dados de municípios e estados do Brasil para o ano de 2021
-    e salva como arquivos GeoJSON.
+    Baixa os dados de municípios e/ou estados do Brasil para os anos pedidos, em paralelo,
+    e salva como arquivos GeoJSON, GeoParquet (ordenado por UF) e FlatGeobuf (com índice espacial).
+    Os formatos binários permitem que o painel leia apenas os municípios de um estado.
+    Retorna o dict de falhas {(nivel, ano): mensagem}.
     """
-    ano = 2021 # ATUALIZADO PARA 2021
-    pasta_dados_geo = "dados_geoespaciais" # Nome da pasta para salvar os arquivos
+    fonte = fonte or fontes_geometria.FonteGeobr()
+    formatos = tuple(formatos)
 
     # Cria a pasta se não existir
     if not os.path.exists(pasta_dados_geo):
         os.makedirs(pasta_dados_geo)
         print(f"Pasta '{pasta_dados_geo}' criada.")
 
-    try:
-        print(f"Baixando dados dos municípios para {ano}...")
-        municipios_gdf = geobr.read_municipality(year=ano, simplified=True)
-        path_municipios = os.path.join(pasta_dados_geo, f"municipios_br_{ano}.geojson")
-        municipios_gdf.to_file(path_municipios, driver="GeoJSON")
-        print(f"Dados dos municípios salvos em: {path_municipios}")
+    manifesto = ler_manifesto(pasta_dados_geo)
+    tarefas = []
+    for ano in anos:
+        for nivel in niveis:
+            chave = f"{nivel}_{ano}"
+            if not forcar and saida_valida(pasta_dados_geo, manifesto.get(chave), formatos):
+                print(f"{nivel} {ano}: já baixado e íntegro, pulando.")
+                continue
+            tarefas.append((nivel, ano))
 
-        print(f"\nBaixando dados dos estados para {ano}...")
-        estados_gdf = geobr.read_state(year=ano, simplified=True)
-        path_estados = os.path.join(pasta_dados_geo, f"estados_br_{ano}.geojson")
-        estados_gdf.to_file(path_estados, driver="GeoJSON")
-        print(f"Dados dos estados salvos em: {path_estados}")
+    falhas = {}
+    if tarefas:
+        print(f"Baixando {len(tarefas)} conjunto(s) com {trabalhadores} processo(s)...")
+        # Processos (e não threads): o geobr via rpy2 usa um interpretador R que não é thread-safe
+        with ProcessPoolExecutor(max_workers=trabalhadores) as executor:
+            futuros = {
+                executor.submit(baixar_e_salvar, fonte, nivel, ano, pasta_dados_geo, formatos): (nivel, ano)
+                for nivel, ano in tarefas
+            }
+            for futuro in as_completed(futuros):
+                nivel, ano = futuros[futuro]
+                try:
+                    registro = futuro.result()
+                except Exception as e:
+                    falhas[(nivel, ano)] = str(e)
+                    print(f"{nivel} {ano}: ERRO - {e}")
+                    continue
+                # O manifesto é regravado a cada conclusão para que o progresso sobreviva a uma interrupção
+                manifesto[f"{nivel}_{ano}"] = registro
+                gravar_manifesto(pasta_dados_geo, manifesto)
+                print(f"{nivel} {ano}: {registro['linhas']} linhas salvas em {registro['segundos']} s")
 
+    if falhas:
+        print("\nAlguns downloads falharam (rode o script de novo para tentar apenas esses):")
+        for (nivel, ano), mensagem in sorted(falhas.items()):
+            print(f"- {nivel} {ano}: {mensagem}")
+        print("Verifique se o ambiente com geobr (Python), R e r-geobr está configurado e ativo.")
+        print("Verifique também se dados para esses anos estão disponíveis na API do geobr.")
+    else:
         print("\nProcesso concluído!")
-        print(f"Certifique-se de adicionar a pasta '{pasta_dados_geo}' com os arquivos .geojson ao seu repositório GitHub.")
-        print(f"Lembre-se também de atualizar os nomes dos arquivos no seu script principal do painel para refletir o ano de {ano}, se necessário.")
+        print(f"Certifique-se de adicionar a pasta '{pasta_dados_geo}' com os arquivos .geojson, .parquet e .fgb ao seu repositório GitHub.")
+        print("Lembre-se também de atualizar o ano dos arquivos no seu script principal do painel, se necessário.")
+    return falhas
 
-    except Exception as e:
-        print(f"Ocorreu um erro ao baixar ou salvar os dados geoespaciais: {e}")
-        print("Verifique se o ambiente com geobr (Python), R e r-geobr está configurado e ativo.")
-        print(f"Verifique também se dados para o ano {ano} estão disponíveis na API do geobr.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Baixa as geometrias do Brasil (geobr) para vários anos e níveis.")
+    parser.add_argument('--anos', nargs='+', default=['2021'], help="Anos ou intervalos (ex: 2019-2021 2010).")
+    parser.add_argument('--niveis', nargs='+', default=list(NIVEIS), choices=NIVEIS)
+    parser.add_argument('--pasta', default="dados_geoespaciais", help="Pasta de saída.")
+    parser.add_argument('--fonte', default='geobr', help="'geobr', 'local:<pasta>' ou 'geoparquet:<pasta>' (sem rede).")
+    parser.add_argument('--trabalhadores', type=int, default=2, help="Número de processos em paralelo.")
+    parser.add_argument('--formatos', nargs='+', default=list(geometria_local.EXTENSOES), choices=geometria_local.EXTENSOES)
+    parser.add_argument('--forcar', action='store_true', help="Baixa de novo mesmo as saídas já válidas.")
+    args = parser.parse_args()
+
+    falhas = baixar_e_salvar_dados_geo(
+        anos=interpretar_anos(args.anos), niveis=args.niveis, pasta_dados_geo=args.pasta,
+        fonte=fontes_geometria.criar_fonte(args.fonte), trabalhadores=args.trabalhadores,
+        formatos=args.formatos, forcar=args.forcar,
+    )
+    raise SystemExit(1 if falhas else 0)
 
 
 if __name__ == "__main__":
-    baixar_e_salvar_dados_geo()
+    main()
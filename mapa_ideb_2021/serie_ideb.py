@@ -0,0 +1,174 @@
+# Série histórica do IDEB particionada por ano.
+# Cada arquivo anual ideb_escola_<ano>.txt é agregado por município (em streaming, ver
+# agregados_ideb.py) e gravado em uma partição própria:
+#
+#   dados_ideb/
+#     manifesto.json              hash, tamanho e contagens de cada ano ingerido
+#     ano=2019/agregados.parquet
+#     ano=2021/agregados.parquet
+#
+# A ingestão é incremental: só processa os arquivos novos ou cujo conteúdo mudou
+# (comparando o SHA-256 com o do manifesto), então o tempo de atualização não cresce
+# com o tamanho da série. O painel lê apenas as partições dos anos que vai exibir.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/serie_ideb.py mapa_ideb_2021/ideb_escola_*.txt
+#   python mapa_ideb_2021/serie_ideb.py mapa_ideb_2021   (procura os arquivos na pasta)
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+import agregados_ideb
+import ingestao_ideb
+
+PASTA_SERIE_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados_ideb")
+PADRAO_ARQUIVO = re.compile(r'ideb_escola_(\d{4})\.txt$')
+NOME_MANIFESTO = 'manifesto.json'
+
+
+def ano_do_arquivo(caminho_arquivo):
+    """Extrai o ano do nome do arquivo (ideb_escola_<ano>.txt), ou None."""
+    encontrado = PADRAO_ARQUIVO.search(os.path.basename(caminho_arquivo))
+    return int(encontrado.group(1)) if encontrado else None
+
+
+def descobrir_arquivos(pasta):
+    """Lista os arquivos ideb_escola_<ano>.txt de uma pasta, em ordem de ano."""
+    arquivos = [c for c in glob.glob(os.path.join(pasta, 'ideb_escola_*.txt')) if ano_do_arquivo(c)]
+    return sorted(arquivos, key=ano_do_arquivo)
+
+
+def caminho_particao(pasta_serie, ano):
+    return os.path.join(pasta_serie, f"ano={ano}", "agregados.parquet")
+
+
+def ler_manifesto(pasta_serie):
+    caminho = os.path.join(pasta_serie, NOME_MANIFESTO)
+    if not os.path.exists(caminho):
+        return {'anos': {}}
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _gravar_manifesto(pasta_serie, manifesto):
+    caminho = os.path.join(pasta_serie, NOME_MANIFESTO)
+    caminho_tmp = caminho + '.tmp'
+    with open(caminho_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(caminho_tmp, caminho)
+
+
+def ingerir_arquivos(caminhos, pasta_serie=PASTA_SERIE_PADRAO, tamanho_bloco=agregados_ideb.TAMANHO_BLOCO_PADRAO, forcar=False):
+    """
+    Agrega e grava a partição de cada arquivo novo ou alterado.
+    Retorna uma lista de (ano, situação), com situação 'ingerido' ou 'inalterado'.
+    O manifesto é regravado após cada ano, então uma interrupção não perde os anos já concluídos.
+    """
+    os.makedirs(pasta_serie, exist_ok=True)
+    manifesto = ler_manifesto(pasta_serie)
+    resultado = []
+
+    for caminho in caminhos:
+        ano = ano_do_arquivo(caminho)
+        if ano is None:
+            raise ValueError(f"Não foi possível identificar o ano no nome do arquivo '{caminho}' (esperado: ideb_escola_<ano>.txt).")
+
+        sha256 = ingestao_ideb.calcular_hash_arquivo(caminho)
+        registro = manifesto['anos'].get(str(ano))
+        particao = caminho_particao(pasta_serie, ano)
+        if not forcar and registro and registro['sha256'] == sha256 and os.path.exists(particao):
+            resultado.append((ano, 'inalterado'))
+            continue
+
+        inicio = time.perf_counter()
+        agregados = agregados_ideb.agregar_arquivos_em_blocos([caminho], tamanho_bloco)
+        if agregados is None:
+            raise ValueError(f"Nenhum dado válido encontrado em '{caminho}'.")
+
+        os.makedirs(os.path.dirname(particao), exist_ok=True)
+        particao_tmp = particao + '.tmp'
+        agregados.to_parquet(particao_tmp, engine='pyarrow')
+        os.replace(particao_tmp, particao)
+
+        manifesto['anos'][str(ano)] = {
+            'arquivo': os.path.basename(caminho),
+            'sha256': sha256,
+            'tamanho': os.path.getsize(caminho),
+            'municipios': int(len(agregados)),
+            'escolas': int(agregados['contagem_ideb'].sum()),
+            'segundos_ingestao': round(time.perf_counter() - inicio, 3),
+        }
+        _gravar_manifesto(pasta_serie, manifesto)
+        resultado.append((ano, 'ingerido'))
+    return resultado
+
+
+def anos_disponiveis(pasta_serie=PASTA_SERIE_PADRAO):
+    """Anos registrados no manifesto cuja partição existe em disco."""
+    manifesto = ler_manifesto(pasta_serie)
+    return sorted(int(ano) for ano in manifesto['anos'] if os.path.exists(caminho_particao(pasta_serie, ano)))
+
+
+def versao_serie(pasta_serie, anos):
+    """Identificador dos dados dos anos pedidos (prefixos dos hashes), para chaves de cache."""
+    registros = ler_manifesto(pasta_serie)['anos']
+    return '-'.join(f"{ano}:{registros[str(ano)]['sha256'][:12]}" for ano in sorted(anos) if str(ano) in registros)
+
+
+def ler_agregados_ano(pasta_serie, ano):
+    """Lê a tabela de agregados de um ano (indexada por 'cod_mun')."""
+    agregados = pd.read_parquet(caminho_particao(pasta_serie, ano), engine='pyarrow')
+    agregados.index = agregados.index.astype('Int64')
+    agregados.index.name = 'cod_mun'
+    return agregados
+
+
+def ler_agregados_anos(pasta_serie, anos):
+    """Lê apenas as partições dos anos pedidos, em formato longo (coluna 'ano')."""
+    partes = [ler_agregados_ano(pasta_serie, ano).assign(ano=ano) for ano in anos]
+    if not partes:
+        return None
+    return pd.concat(partes).set_index('ano', append=True)
+
+
+def calcular_variacoes(agregados_ano, agregados_base):
+    """
+    Variação das médias de cada município entre dois anos (ano - base).
+    Retorna um DataFrame indexado por 'cod_mun' com as colunas variacao_mat, variacao_por e variacao_ideb;
+    municípios ausentes em um dos anos ficam com NaN.
+    """
+    variacoes = pd.DataFrame(index=agregados_ano.index)
+    for sufixo in agregados_ideb.METRICAS.values():
+        coluna = f"media_{sufixo}"
+        variacoes[f"variacao_{sufixo}"] = agregados_ano[coluna] - agregados_base[coluna].reindex(agregados_ano.index)
+    return variacoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão incremental da série histórica do IDEB (uma partição por ano).")
+    parser.add_argument('entradas', nargs='+', help="Arquivos ideb_escola_<ano>.txt ou pastas que os contenham.")
+    parser.add_argument('--pasta-serie', default=PASTA_SERIE_PADRAO, help="Pasta do conjunto particionado por ano.")
+    parser.add_argument('--tamanho-bloco', type=int, default=agregados_ideb.TAMANHO_BLOCO_PADRAO, help="Linhas lidas por bloco.")
+    parser.add_argument('--forcar', action='store_true', help="Reprocessa mesmo os anos inalterados.")
+    args = parser.parse_args()
+
+    caminhos = []
+    for entrada in args.entradas:
+        caminhos.extend(descobrir_arquivos(entrada) if os.path.isdir(entrada) else [entrada])
+    if not caminhos:
+        print("Nenhum arquivo ideb_escola_<ano>.txt encontrado.")
+        return
+
+    for ano, situacao in ingerir_arquivos(caminhos, args.pasta_serie, args.tamanho_bloco, args.forcar):
+        print(f"{ano}: {situacao}")
+    print(f"Anos disponíveis em '{args.pasta_serie}': {anos_disponiveis(args.pasta_serie)}")
+
+
+if __name__ == "__main__":
+    main()
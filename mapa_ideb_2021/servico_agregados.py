@@ -0,0 +1,316 @@
+# Serviço HTTP somente leitura com os agregados do IDEB por município, para consumo por outros
+# sistemas sem passar pelo painel (que reexecuta o script e monta os mapas a cada acesso).
+#
+#   GET /agregados                         índice: anos, UFs, formatos e links
+#   GET /agregados/<ano>/<UF>.json         municípios da UF (ou BR para o Brasil inteiro)
+#   GET /agregados/<ano>/<UF>.csv
+#   GET /agregados/<ano>/<UF>.parquet
+#
+# Os agregados vêm da mesma origem do painel (série particionada por ano ou TXT/Parquet do IDEB,
+# ver renderizacao_lote.carregar_agregados). Na primeira requisição de um ano, todas as respostas
+# daquele ano (28 recortes x 3 formatos) são montadas de uma vez e guardadas já compactadas
+# (gzip e, se o pacote 'brotli' estiver instalado, br); as requisições seguintes só escolhem os
+# bytes prontos. A ETag de cada resposta é derivada da chave dos dados (hashes dos manifestos),
+# então um cliente que reenvia If-None-Match recebe 304 sem corpo até a próxima ingestão, e uma
+# nova ingestão invalida as respostas montadas sem reiniciar o serviço.
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/servico_agregados.py --porta 8766
+#   curl -H 'Accept-Encoding: gzip' http://127.0.0.1:8766/agregados/2021/MG.json
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import armazem_compartilhado
+import fontes_geometria
+import ingestao_ideb
+import renderizacao_lote
+import serie_ideb
+
+# O pacote 'brotli' é opcional: sem ele, as respostas são oferecidas só com gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HOST_PADRAO = '127.0.0.1'
+PORTA_PADRAO = 8766
+RECORTE_BRASIL = 'BR'
+
+# Formato -> tipo de conteúdo. O Parquet já é compactado internamente: não vale gzip/br por cima
+FORMATOS = {
+    'json': 'application/json; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FORMATOS_COMPACTAVEIS = ('json', 'csv')
+# Respostas pequenas não compensam a compactação
+TAMANHO_MINIMO_COMPACTACAO = 1024
+
+_ROTA_INDICE = re.compile(r"^/agregados/?$")
+_ROTA_RECORTE = re.compile(r"^/agregados/(\d{4})/([A-Za-z]{2})\.(json|csv|parquet)$")
+
+
+def tabela_publicada(agregados, nomes_municipios=None):
+    """
+    Agregados no formato publicado: uma linha por município com código, UF (dos dois
+    primeiros dígitos do código IBGE), nome (se 'nomes_municipios' for informado) e as
+    colunas media_*, contagem_* e desvio_* (e variacao_*, se existirem).
+    """
+    tabela = agregados.reset_index()
+    codigos_uf = tabela['cod_mun'] // 100000
+    tabela.insert(1, 'uf', codigos_uf.map(ingestao_ideb.CODIGOS_IBGE_UF).astype('string'))
+    if nomes_municipios is not None:
+        tabela.insert(2, 'nome_mun', tabela['cod_mun'].map(nomes_municipios).astype('string'))
+    return tabela.sort_values(['uf', 'cod_mun'], kind='stable').reset_index(drop=True)
+
+
+def serializar(tabela, formato):
+    if formato == 'json':
+        return tabela.to_json(orient='records', force_ascii=False).encode('utf-8')
+    if formato == 'csv':
+        return tabela.to_csv(index=False).encode('utf-8')
+    if formato == 'parquet':
+        destino = io.BytesIO()
+        tabela.to_parquet(destino, engine='pyarrow', index=False)
+        return destino.getvalue()
+    raise ValueError(f"Formato desconhecido: '{formato}' (use {', '.join(FORMATOS)}).")
+
+
+def compactar(corpo, formato):
+    """Versões do corpo por Content-Encoding ('identity', 'gzip' e, com o pacote brotli, 'br')."""
+    versoes = {'identity': corpo}
+    if formato in FORMATOS_COMPACTAVEIS and len(corpo) >= TAMANHO_MINIMO_COMPACTACAO:
+        versoes['gzip'] = gzip.compress(corpo, compresslevel=9, mtime=0)
+        if brotli is not None:
+            versoes['br'] = brotli.compress(corpo, quality=11)
+    return versoes
+
+
+def calcular_etag(chave_dados, recorte, formato):
+    """ETag fraca (a mesma para todas as codificações do conteúdo) derivada da chave dos dados."""
+    resumo = hashlib.sha256(f"{chave_dados}|{recorte}|{formato}".encode('utf-8')).hexdigest()[:20]
+    return f'W/"{resumo}"'
+
+
+def etag_corresponde(if_none_match, etag):
+    """Compara o cabeçalho If-None-Match com a ETag (comparação fraca, como manda o HTTP para GET)."""
+    if not if_none_match:
+        return False
+    candidatas = [parte.strip() for parte in if_none_match.split(',')]
+    sem_prefixo = lambda valor: valor[2:] if valor.startswith('W/') else valor
+    return '*' in candidatas or sem_prefixo(etag) in {sem_prefixo(c) for c in candidatas}
+
+
+def escolher_codificacao(accept_encoding, disponiveis):
+    """Melhor codificação disponível aceita pelo cliente (br > gzip > identity); q=0 recusa."""
+    aceitas = {}
+    for parte in (accept_encoding or '').split(','):
+        nome, _, parametros = parte.strip().partition(';')
+        if not nome:
+            continue
+        q = 1.0
+        encontrado = re.search(r"q=([0-9.]+)", parametros)
+        if encontrado:
+            try:
+                q = float(encontrado.group(1))
+            except ValueError:
+                q = 0.0
+        aceitas[nome.lower()] = q
+    for codificacao in ('br', 'gzip'):
+        if codificacao in disponiveis and aceitas.get(codificacao, aceitas.get('*', 0.0)) > 0:
+            return codificacao
+    return 'identity'
+
+
+class CatalogoAgregados:
+    """
+    Respostas prontas (serializadas e compactadas) de cada ano, montadas na primeira requisição
+    e descartadas quando a chave dos dados muda (nova ingestão).
+    """
+
+    def __init__(self, arquivo_ideb=renderizacao_lote.ARQUIVO_IDEB_PADRAO, pasta_serie=serie_ideb.PASTA_SERIE_PADRAO,
+                 pasta_geo=renderizacao_lote.PASTA_GEO_PADRAO, ano_geo=renderizacao_lote.ANO_GEO_PADRAO):
+        self.arquivo_ideb = arquivo_ideb
+        self.pasta_serie = pasta_serie
+        self.pasta_geo = pasta_geo
+        self.ano_geo = ano_geo
+        self._anos = {} # ano -> {'chave': chave_dados, 'respostas': {(recorte, formato): resposta}}
+        self._trava = threading.Lock()
+        self._nomes = None
+
+    def anos(self):
+        return serie_ideb.anos_disponiveis(self.pasta_serie) or [2021]
+
+    def chave_dados(self, ano):
+        """Chave atual dos dados do ano (barata: só lê os manifestos), ou None se o ano não existir."""
+        anos_serie = serie_ideb.anos_disponiveis(self.pasta_serie)
+        if anos_serie:
+            if ano not in anos_serie:
+                return None
+            return renderizacao_lote.chave_dados(serie_ideb.versao_serie(self.pasta_serie, [ano]), ano, None)
+        if ano != 2021:
+            return None
+        return renderizacao_lote.chave_dados(ingestao_ideb.versao_dados(self.arquivo_ideb), ano, None)
+
+    def nomes_municipios(self):
+        """Código -> nome do município, das geometrias locais (None se não estiverem disponíveis)."""
+        if self._nomes is None:
+            fonte = fontes_geometria.FonteArquivosLocais(self.pasta_geo)
+            if not fonte.disponivel('municipios', self.ano_geo):
+                return None
+            armazem = armazem_compartilhado.armazem_geometrias(fonte, self.pasta_geo, 'municipios', self.ano_geo)
+            if armazem is not None:
+                nomes = armazem.dataframe(colunas=['code_muni', 'name_muni'])
+            else:
+                nomes = pd.DataFrame(fonte.ler('municipios', self.ano_geo).drop(columns='geometry'))
+            self._nomes = pd.Series(nomes['name_muni'].astype(str).values, index=nomes['code_muni'].astype('int64').values)
+        return self._nomes
+
+    def _montar_ano(self, ano, chave):
+        agregados, chave_lida, _, _ = renderizacao_lote.carregar_agregados(self.arquivo_ideb, self.pasta_serie, ano)
+        tabela = tabela_publicada(agregados, self.nomes_municipios())
+        recortes = {RECORTE_BRASIL: tabela}
+        recortes.update({uf: parte.reset_index(drop=True) for uf, parte in tabela.groupby('uf', sort=True, observed=True)})
+        respostas = {}
+        for recorte, parte in recortes.items():
+            for formato in FORMATOS:
+                respostas[(recorte, formato)] = {
+                    'etag': calcular_etag(chave_lida, recorte, formato),
+                    'tipo': FORMATOS[formato],
+                    'corpos': compactar(serializar(parte, formato), formato),
+                }
+        return {'chave': chave, 'respostas': respostas}
+
+    def resposta(self, ano, recorte, formato):
+        """Resposta pronta do recorte (UF ou BR) e formato do ano, ou None se não existir."""
+        chave = self.chave_dados(ano)
+        if chave is None:
+            return None
+        with self._trava: # Uma montagem por vez; as outras threads esperam e reaproveitam
+            dados_ano = self._anos.get(ano)
+            if dados_ano is None or dados_ano['chave'] != chave:
+                dados_ano = self._anos[ano] = self._montar_ano(ano, chave)
+        return dados_ano['respostas'].get((recorte.upper(), formato))
+
+    def indice(self):
+        anos = self.anos()
+        return {
+            'anos': anos,
+            'ufs': sorted(ingestao_ideb.CODIGOS_IBGE_UF.values()) + [RECORTE_BRASIL],
+            'formatos': list(FORMATOS),
+            'codificacoes': ['br', 'gzip'] if brotli is not None else ['gzip'],
+            'exemplo': f"/agregados/{anos[-1]}/MG.json",
+        }
+
+
+class _ManipuladorAgregados(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._responder(com_corpo=True)
+
+    def do_HEAD(self):
+        self._responder(com_corpo=False)
+
+    def _responder(self, com_corpo):
+        caminho = self.path.split('?', 1)[0]
+        if _ROTA_INDICE.match(caminho):
+            corpo = json.dumps(self.server.catalogo.indice(), ensure_ascii=False).encode('utf-8')
+            self._enviar(200, FORMATOS['json'], corpo if com_corpo else b'', len(corpo), cache='no-cache')
+            return
+        rota = _ROTA_RECORTE.match(caminho)
+        if rota is None:
+            self.send_error(404)
+            return
+        ano, recorte, formato = int(rota.group(1)), rota.group(2), rota.group(3)
+        try:
+            resposta = self.server.catalogo.resposta(ano, recorte, formato)
+        except Exception as erro:
+            self.send_error(500, f"Erro ao montar os agregados: {erro}")
+            return
+        if resposta is None:
+            self.send_error(404, "Ano ou UF sem dados")
+            return
+
+        if etag_corresponde(self.headers.get('If-None-Match'), resposta['etag']):
+            self.send_response(304)
+            self.send_header('ETag', resposta['etag'])
+            self._cabecalhos_comuns()
+            self.end_headers()
+            return
+        codificacao = escolher_codificacao(self.headers.get('Accept-Encoding'), resposta['corpos'])
+        corpo = resposta['corpos'][codificacao]
+        self._enviar(200, resposta['tipo'], corpo if com_corpo else b'', len(corpo),
+                     etag=resposta['etag'], codificacao=codificacao)
+
+    def _enviar(self, status, tipo, corpo, tamanho, etag=None, codificacao='identity', cache=None):
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(tamanho))
+        if codificacao != 'identity':
+            self.send_header('Content-Encoding', codificacao)
+        if etag:
+            self.send_header('ETag', etag)
+        self._cabecalhos_comuns(cache)
+        self.end_headers()
+        if corpo:
+            self.wfile.write(corpo)
+
+    def _cabecalhos_comuns(self, cache=None):
+        # Sempre revalidar: a resposta muda com uma nova ingestão, e o 304 é barato
+        self.send_header('Cache-Control', cache or 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+    def log_message(self, formato, *args):
+        pass # Sem uma linha de log por requisição
+
+
+def criar_servidor(catalogo, host=HOST_PADRAO, porta=PORTA_PADRAO):
+    servidor = ThreadingHTTPServer((host, porta), _ManipuladorAgregados)
+    servidor.daemon_threads = True
+    servidor.catalogo = catalogo
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve os agregados do IDEB por município (JSON, CSV e Parquet) por HTTP.")
+    parser.add_argument('--arquivo-ideb', default=renderizacao_lote.ARQUIVO_IDEB_PADRAO,
+                        help="Arquivo TXT do IDEB (usado quando não há série particionada)")
+    parser.add_argument('--pasta-serie', default=serie_ideb.PASTA_SERIE_PADRAO, help="Pasta da série particionada por ano")
+    parser.add_argument('--pasta-geo', default=renderizacao_lote.PASTA_GEO_PADRAO,
+                        help="Pasta das geometrias (só para os nomes dos municípios)")
+    parser.add_argument('--ano-geo', type=int, default=renderizacao_lote.ANO_GEO_PADRAO)
+    parser.add_argument('--host', default=HOST_PADRAO)
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    parser.add_argument('--precomputar', action='store_true',
+                        help="Monta as respostas de todos os anos antes de começar a atender")
+    args = parser.parse_args()
+
+    catalogo = CatalogoAgregados(args.arquivo_ideb, args.pasta_serie, args.pasta_geo, args.ano_geo)
+    if args.precomputar:
+        for ano in catalogo.anos():
+            catalogo.resposta(ano, RECORTE_BRASIL, 'json')
+            print(f"Respostas de {ano} montadas")
+    servidor = criar_servidor(catalogo, args.host, args.porta)
+    host, porta = servidor.server_address[:2]
+    print(f"Servindo os agregados em http://{host}:{porta}/agregados (Ctrl+C para encerrar)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,21 @@
 # IMPORTANTE: Este é um aplicativo Streamlit.
 #  Para executá-lo, siga as instruções no arquivo environment.yml para criar o ambiente Conda.
 #  Este ambiente deve incluir R, o pacote geobr do R, rpy2, e o pacote Python 'geobr' (instalado via pip).
+#  Com os arquivos de geometria em dados_geoespaciais/ (script_baixar_dados.py), o geobr e o R
+#  não são usados nem importados. PAINEL_IDEB_FONTE_GEO escolhe outra fonte (ver fontes_geometria.py).
 #  Depois de ativar o ambiente, execute no terminal:
 #    streamlit run nome_do_seu_arquivo.py
 
 # %%
 
+import os
 import streamlit as st
 import pandas as pd
-import geopandas # Para manipulação de dados geoespaciais
-import folium # Para criar mapas interativos
-from streamlit_folium import st_folium # Para integrar Folium com Streamlit
 import numpy as np
-import geobr # Wrapper Python para a biblioteca geobr do R
+import fontes_geometria # Arquivos locais ou geobr; folium, streamlit_folium e geobr são importados só quando usados
+import ingestao_ideb # Ingestão colunar (Parquet) dos dados do IDEB
+import agregados_ideb # Tabela de agregados por município
+import particoes_uf # Índice de partições por UF
 
 # %%
 
@@ -28,66 +31,44 @@ st.set_page_config(layout="wide", page_title="Painel IDEB Brasil")
 @st.cache_data # Cache para otimizar o carregamento de dados
 def carregar_dados_ideb(caminho_arquivo):
     """
-    Carrega e limpa os dados do IDEB de um arquivo TXT delimitado por tabulação.
+    Carrega e limpa os dados do IDEB.
+    Se existir o Parquet gerado por ingestao_ideb.py (e ele estiver atualizado), lê dele;
+    caso contrário, lê o arquivo TXT delimitado por tabulação.
     """
     try:
-        # Tenta ler com encoding utf-8, se falhar, tenta latin-1 (comum em arquivos brasileiros)
-        try:
-            df = pd.read_csv(caminho_arquivo, sep='\t', encoding='utf-8', low_memory=False)
-        except UnicodeDecodeError:
-            df = pd.read_csv(caminho_arquivo, sep='\t', encoding='latin-1', low_memory=False)
-
-        # Define as colunas que são realmente necessárias para o painel
-        colunas_necessarias = ['UF', 'cod_mun', 'nome_mun', 'ideb', 'nota_matem', 'nota_portugues']
-        
-        # Verifica se todas as colunas necessárias existem no arquivo carregado
-        for col in colunas_necessarias:
-            if col not in df.columns:
-                st.error(f"Coluna essencial '{col}' não encontrada no arquivo '{caminho_arquivo}'. Verifique o conteúdo do arquivo.")
-                return None
-        
-        df = df[colunas_necessarias].copy() # Usar .copy() para evitar SettingWithCopyWarning
-
-        # Converte colunas de notas para tipo numérico.
-        # Erros na conversão (ex: texto em campo de nota) se tornarão NaN (Not a Number).
-        cols_numericas = ['ideb', 'nota_matem', 'nota_portugues']
-        for col in cols_numericas:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        # Limpeza dos dados:
-        # Remove linhas onde 'ideb' é NaN (após conversão) ou explicitamente 0.
-        df.dropna(subset=['ideb'], inplace=True)
-        df = df[df['ideb'] != 0].copy() # Usar .copy() após a filtragem
-        
-        # Converte 'cod_mun' para tipo numérico (inteiro Int64 para suportar NaN se houver)
-        # e remove linhas onde 'cod_mun' não pôde ser convertido.
-        df['cod_mun'] = pd.to_numeric(df['cod_mun'], errors='coerce').astype('Int64')
-        df.dropna(subset=['cod_mun'], inplace=True)
-
-        return df
+        # Leitura colunar (Parquet) com fallback para o TXT, aplicando as mesmas regras de limpeza:
+        # remove linhas onde 'ideb' é NaN ou 0 e onde 'cod_mun' não pôde ser convertido.
+        return ingestao_ideb.carregar_ideb(caminho_arquivo)
     except FileNotFoundError:
         st.error(f"Arquivo '{caminho_arquivo}' não encontrado. Certifique-se de que ele está no mesmo diretório que o script Python.")
         return None
+    except ValueError as e: # Coluna essencial ausente no arquivo
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Ocorreu um erro ao carregar os dados do IDEB: {e}")
         return None
 
 # %%
 
+# Geometrias: arquivos locais (mesmo ano do painel_ideb_2020.py) ou, sem eles, o geobr
+PASTA_DADOS_GEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados_geoespaciais")
+ANO_GEO = 2020
+
 @st.cache_data # Cache para otimizar o carregamento de dados geoespaciais
-def carregar_dados_geoespaciais_com_python_geobr():
+def carregar_dados_geoespaciais(especificacao_fonte):
     """
-    Carrega os dados geoespaciais de municípios e estados do Brasil
-    usando o pacote Python 'geobr', que é um wrapper para o pacote R 'geobr'.
-    Este pacote Python deve estar instalado via pip, conforme o environment.yml.
+    Carrega os dados geoespaciais de municípios e estados do Brasil pela fonte indicada
+    ('local:<pasta>', 'geoparquet:<pasta>' ou 'geobr', ver fontes_geometria.py).
+    O pacote Python 'geobr' (wrapper do pacote R 'geobr') só é importado pela fonte 'geobr'.
     """
+    fonte = fontes_geometria.criar_fonte(especificacao_fonte)
     try:
-        st.write("Carregando dados geoespaciais dos municípios via geobr (Python wrapper)...")
-        # O pacote geobr (Python) retorna um GeoDataFrame diretamente
-        br_muni_gdf = geobr.read_municipality(year=2019, simplified=True)
+        st.write(f"Carregando dados geoespaciais dos municípios ({fonte.nome})...")
+        br_muni_gdf = fonte.ler('municipios', ANO_GEO)
         
-        st.write("Carregando dados geoespaciais dos estados via geobr (Python wrapper)...")
-        br_estados_gdf = geobr.read_state(year=2019, simplified=True)
+        st.write(f"Carregando dados geoespaciais dos estados ({fonte.nome})...")
+        br_estados_gdf = fonte.ler('estados', ANO_GEO)
 
         # Verificações e conversões de tipo
         # A coluna de código do município no geobr é 'code_muni'
@@ -101,20 +82,34 @@ def carregar_dados_geoespaciais_com_python_geobr():
              st.error("Coluna 'abbrev_state' não encontrada nos dados dos estados carregados pelo geobr.")
              return None, None # Retorna None se a coluna chave estiver faltando
 
-        st.write("Dados geoespaciais carregados com sucesso via geobr (Python wrapper).")
+        st.write(f"Dados geoespaciais carregados com sucesso ({fonte.nome}).")
         return br_muni_gdf, br_estados_gdf
         
     except Exception as e:
-        st.error(f"Erro ao carregar dados geoespaciais com o wrapper Python 'geobr': {e}")
-        st.error("Verifique se o R, o pacote 'geobr' do R (r-geobr), rpy2, e o pacote Python 'geobr' (instalado via pip) estão corretamente configurados no ambiente Conda.")
-        st.error("Consulte o arquivo environment.yml para as dependências necessárias.")
+        st.error(f"Erro ao carregar dados geoespaciais ({fonte.nome}): {e}")
+        if isinstance(fonte, fontes_geometria.FonteGeobr):
+            st.error("Verifique se o R, o pacote 'geobr' do R (r-geobr), rpy2, e o pacote Python 'geobr' (instalado via pip) estão corretamente configurados no ambiente Conda.")
+            st.error("Consulte o arquivo environment.yml para as dependências necessárias.")
         return None, None
 
+@st.cache_resource # Construído uma vez e compartilhado entre reruns e sessões, sem cópia a cada acesso
+def preparar_particoes_uf(caminho_arquivo_ideb, _df_ideb, _br_muni_gdf):
+    """
+    Calcula a tabela de agregados (média, contagem e desvio) de todos os municípios do Brasil,
+    une às geometrias com um único join e indexa por UF tanto as escolas quanto os municípios.
+    Retorna (particoes_escolas, particoes_municipios); as fatias devolvidas são somente leitura.
+    O cache é indexado pelo caminho do arquivo do IDEB (os DataFrames não são hasheados).
+    """
+    agregados = agregados_ideb.calcular_agregados_municipios(_df_ideb)
+    muni_notas_br_gdf = agregados_ideb.juntar_agregados_geometria(_br_muni_gdf, agregados)
+    return particoes_uf.ParticoesUF(_df_ideb, 'UF'), particoes_uf.ParticoesUF(muni_notas_br_gdf, 'abbrev_state')
+
 # %%
 def criar_mapa_folium(gdf_mapa, coluna_valor, legenda_titulo, estado_coords_centro):
     """
     Cria um mapa Choropleth (mapa temático de áreas) com Folium.
     """
+    import folium # Importado só quando há um mapa a criar
     # Verifica se há dados válidos para plotar
     if gdf_mapa is None or gdf_mapa.empty or coluna_valor not in gdf_mapa.columns:
         st.warning(f"Não há dados geográficos ou a coluna '{coluna_valor}' não existe para exibir no mapa de {legenda_titulo}.")
@@ -200,8 +195,10 @@ st.title("Painel IDEB Brasil (Python com wrapper geobr)")
 # %%
 
 # Carregamento dos dados (com cache para performance)
-df_ideb = carregar_dados_ideb("/home/est/Documentos/GitHub/mapa_ideb_max_python/mapa_ideb_2021/ideb_escola_2021.txt") # Carrega dados do IDEB
-br_muni_gdf, br_estados_gdf = carregar_dados_geoespaciais_com_python_geobr() # Carrega dados geoespaciais
+caminho_ideb = "/home/est/Documentos/GitHub/mapa_ideb_max_python/mapa_ideb_2021/ideb_escola_2021.txt"
+df_ideb = carregar_dados_ideb(caminho_ideb) # Carrega dados do IDEB
+fonte_geo = fontes_geometria.escolher_fonte(PASTA_DADOS_GEO, ANO_GEO) # Local se existir; senão geobr
+br_muni_gdf, br_estados_gdf = carregar_dados_geoespaciais(fonte_geo.nome) # Carrega dados geoespaciais
 
 # %%
 
@@ -219,38 +216,16 @@ if df_ideb is not None and br_muni_gdf is not None and br_estados_gdf is not Non
 
     if estado_selecionado_sigla:
         estado_geom_centroide = br_estados_gdf[br_estados_gdf['abbrev_state'] == estado_selecionado_sigla].geometry.iloc[0].centroid
-        muni_estado_gdf = br_muni_gdf[br_muni_gdf['abbrev_state'] == estado_selecionado_sigla].copy()
-        ideb_estado_df = df_ideb[df_ideb['UF'] == estado_selecionado_sigla].copy()
+        # Tabela nacional de agregados já unida às geometrias (calculada uma vez e mantida em cache).
+        # Trocar de estado passa a ser apenas uma fatia do índice por UF, sem varrer nem copiar o país inteiro.
+        particoes_escolas, particoes_municipios = preparar_particoes_uf(caminho_ideb, df_ideb, br_muni_gdf)
+        muni_notas_gdf = particoes_municipios.obter(estado_selecionado_sigla)
 
-        if muni_estado_gdf.empty:
+        if muni_notas_gdf.empty:
             st.warning(f"Não foram encontrados municípios para o estado {estado_selecionado_sigla} nos dados geoespaciais.")
-        elif ideb_estado_df.empty:
+        elif estado_selecionado_sigla not in particoes_escolas:
             st.warning(f"Não foram encontrados dados do IDEB para o estado {estado_selecionado_sigla}.")
         else:
-            media_mat_df = ideb_estado_df.groupby('cod_mun')['nota_matem'].mean().reset_index().rename(columns={'nota_matem': 'media_mat'})
-            media_por_df = ideb_estado_df.groupby('cod_mun')['nota_portugues'].mean().reset_index().rename(columns={'nota_portugues': 'media_por'})
-            media_ideb_df = ideb_estado_df.groupby('cod_mun')['ideb'].mean().reset_index().rename(columns={'ideb': 'media_ideb'})
-
-            # Assegura que code_muni (do GeoDataFrame) e cod_mun (do IDEB) são do mesmo tipo para o merge
-            # O geobr retorna code_muni como int64, o IDEB foi convertido para Int64.
-            # Para o merge, é mais seguro converter ambos para string temporariamente se houver dúvidas.
-            # No entanto, se ambos são Int64 (que suporta NA), deve funcionar.
-            # A função carregar_dados_geoespaciais_com_python_geobr já converte code_muni para Int64.
-            # A função carregar_dados_ideb já converte cod_mun para Int64.
-            
-            muni_notas_gdf = pd.merge(muni_estado_gdf, media_mat_df, left_on='code_muni', right_on='cod_mun', how='left')
-            muni_notas_gdf = pd.merge(muni_notas_gdf, media_por_df, on='cod_mun', how='left') # Assume cod_mun de media_mat_df
-            muni_notas_gdf = pd.merge(muni_notas_gdf, media_ideb_df, on='cod_mun', how='left')
-            
-            # Limpeza de colunas de merge duplicadas (ex: cod_mun_x, cod_mun_y)
-            # Mantém 'code_muni' do GeoDataFrame original e 'cod_mun' das médias se não houver conflito.
-            # Se 'cod_mun' foi usado como chave de junção e não é mais necessário, pode ser removido.
-            # O importante é que 'code_muni' esteja presente para o Choropleth.
-            if 'cod_mun_x' in muni_notas_gdf.columns: # Se o merge criou sufixos
-                muni_notas_gdf.drop(columns=[col for col in muni_notas_gdf.columns if '_y' in col], inplace=True, errors='ignore')
-                muni_notas_gdf.rename(columns={col: col.replace('_x', '') for col in muni_notas_gdf.columns if '_x' in col}, inplace=True, errors='ignore')
-
-
             st.subheader(f"Notas Médias por Município - {estado_selecionado_sigla}")
             tabela_df_display = muni_notas_gdf[['name_muni', 'media_mat', 'media_por', 'media_ideb']].copy()
             tabela_df_display.rename(columns={
@@ -263,6 +238,7 @@ if df_ideb is not None and br_muni_gdf is not None and br_estados_gdf is not Non
             }), height=400, use_container_width=True)
 
             st.subheader(f"Mapas de Distribuição das Notas - {estado_selecionado_sigla}")
+            from streamlit_folium import st_folium # Para integrar Folium com Streamlit
             col_mapa1, col_mapa2, col_mapa3 = st.columns(3)
 
             with col_mapa1:
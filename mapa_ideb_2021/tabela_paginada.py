@@ -0,0 +1,81 @@
+# Tabela de municípios paginada, com ordenação e busca feitas no servidor.
+# Um Styler do pandas formata todas as células no servidor e envia a tabela inteira ao
+# navegador a cada rerun; com centenas (ou, no Brasil inteiro, milhares) de municípios,
+# isso domina o tempo da tabela. Aqui, a ordem de cada coluna ordenável é calculada UMA
+# vez (argsort estável, valores ausentes no fim) quando a tabela é montada, e cada consulta
+# só filtra essa ordem pela busca, fatia a página e copia as linhas dela. Os números seguem
+# crus (float) para o st.dataframe, que os formata no navegador (column_config), então o
+# custo de exibir uma página não depende de quantos municípios atendem à busca.
+
+import numpy as np
+import pandas as pd
+
+TAMANHOS_PAGINA = (25, 50, 100)
+TAMANHO_PAGINA_PADRAO = 50
+
+
+def normalizar_texto(textos):
+    """Texto em minúsculas e sem acentos, para busca e ordenação ('São Paulo' -> 'sao paulo')."""
+    textos = pd.Series(textos, dtype='string').fillna('')
+    return textos.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('ascii').str.lower()
+
+
+def formato_printf(formato):
+    """Converte um formato do str.format ('{:+.2f}') no formato printf do column_config ('%+.2f')."""
+    return '%' + formato[2:-1]
+
+
+class TabelaOrdenada:
+    """
+    Linhas de 'df' com a ordem de cada coluna pré-calculada.
+    'coluna_busca' é a coluna de texto usada na busca (nome do município).
+    """
+
+    def __init__(self, df, coluna_busca='name_muni'):
+        self.df = df.reset_index(drop=True)
+        self.coluna_busca = coluna_busca
+        self._busca = normalizar_texto(self.df[coluna_busca])
+        self._ordens = {}
+        self._validos = {}
+        for coluna in self.df.columns:
+            serie = self.df[coluna]
+            if pd.api.types.is_numeric_dtype(serie):
+                valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+                ausentes = np.isnan(valores)
+                chave = valores
+            else:
+                ausentes = serie.isna().to_numpy()
+                chave = normalizar_texto(serie).to_numpy(dtype=object)
+            ordem = np.argsort(chave, kind='stable')
+            # Ausentes sempre no fim, nas duas direções
+            ordem = np.concatenate([ordem[~ausentes[ordem]], ordem[ausentes[ordem]]])
+            self._ordens[coluna] = ordem
+            self._validos[coluna] = int((~ausentes).sum())
+
+    def __len__(self):
+        return len(self.df)
+
+    def ordem(self, coluna, decrescente=False):
+        ordem = self._ordens[coluna]
+        if decrescente:
+            validos = self._validos[coluna]
+            ordem = np.concatenate([ordem[:validos][::-1], ordem[validos:]])
+        return ordem
+
+    def consultar(self, ordenar_por, decrescente=False, busca='', pagina=1, tamanho_pagina=TAMANHO_PAGINA_PADRAO):
+        """
+        Página 'pagina' (a partir de 1) das linhas cujo texto de busca contém 'busca'
+        (sem diferenciar maiúsculas nem acentos), ordenadas por 'ordenar_por'.
+        Retorna (DataFrame da página, total de linhas encontradas).
+        """
+        ordem = self.ordem(ordenar_por, decrescente)
+        termo = normalizar_texto([busca.strip()]).iloc[0] if busca else ''
+        if termo:
+            encontrados = self._busca.str.contains(termo, regex=False).to_numpy(dtype=bool)
+            ordem = ordem[encontrados[ordem]]
+        inicio = (max(pagina, 1) - 1) * tamanho_pagina
+        return self.df.take(ordem[inicio:inicio + tamanho_pagina]), len(ordem)
+
+
+def numero_paginas(total, tamanho_pagina):
+    return max(-(-total // tamanho_pagina), 1)
@@ -0,0 +1,228 @@
+# Visão nacional dos municípios em tiles vetoriais (Mapbox Vector Tiles).
+# Embutir as geometrias dos ~5.570 municípios em um mapa Folium deixa o HTML pesado demais
+# para o navegador; por isso os mapas do painel mostram um estado por vez. Para o Brasil
+# inteiro, as geometrias são cortadas em uma pirâmide de tiles MVT gravada em um arquivo
+# MBTiles (SQLite), com o driver MBTiles do GDAL (o mesmo usado pelo geopandas para os
+# outros formatos). Os tiles levam só o código, o nome e a UF de cada município: os valores
+# do IDEB vão no HTML do mapa (código -> métricas) e são unidos às feições no navegador,
+# então a mesma pirâmide serve para qualquer ano, comparação ou método de cores.
+#
+# Um servidor HTTP local mínimo, em uma thread, entrega cada tile em
+# /municipios/{z}/{x}/{y}.pbf, e o Leaflet.VectorGrid baixa apenas os tiles visíveis.
+# O servidor escuta em 127.0.0.1 (porta em PAINEL_IDEB_PORTA_TILES, padrão 8765); se o
+# painel for acessado por outra máquina, publique os tiles e informe o endereço em
+# PAINEL_IDEB_URL_TILES (ex: https://exemplo.org/tiles/municipios/{z}/{x}/{y}.pbf). Sem ela,
+# o painel só oferece o mapa nacional a quem o abre na própria máquina (tiles_acessiveis).
+#
+# Uso (a partir da raiz do repositório):
+#   python mapa_ideb_2021/tiles_vetoriais.py gerar mapa_ideb_2021/dados_geoespaciais 2020
+#   python mapa_ideb_2021/tiles_vetoriais.py servir mapa_ideb_2021/dados_geoespaciais 2020
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import geometria_local
+
+NOME_CAMADA = 'municipios'
+COLUNAS_TILES = ['code_muni', 'name_muni', 'abbrev_state']
+
+# Zoom 3 mostra o Brasil inteiro; no zoom 10 um tile cobre cerca de 40 km, suficiente para
+# os menores municípios. Acima do zoom máximo, o Leaflet amplia os tiles do último nível.
+ZOOM_MINIMO = 3
+ZOOM_MAXIMO = 10
+
+HOST_PADRAO = '127.0.0.1'
+HOSTS_LOCAIS = {'localhost', '127.0.0.1', '::1'}
+PORTA_PADRAO = 8765
+
+_ROTA_TILE = re.compile(rf"^/{NOME_CAMADA}/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+def caminho_mbtiles(pasta, ano):
+    return os.path.join(pasta, f"{NOME_CAMADA}_br_{ano}.mbtiles")
+
+
+def versao_mbtiles(caminho):
+    """Identifica o conteúdo do arquivo (data de modificação e tamanho), para as chaves de cache."""
+    estado = os.stat(caminho)
+    return f"{estado.st_mtime_ns}-{estado.st_size}"
+
+
+def gerar_mbtiles(pasta, ano, zoom_minimo=ZOOM_MINIMO, zoom_maximo=ZOOM_MAXIMO):
+    """
+    Corta as geometrias dos municípios (melhor formato disponível em 'pasta') em tiles MVT
+    do zoom_minimo ao zoom_maximo e grava o arquivo MBTiles. Retorna o caminho gravado.
+    """
+    municipios_gdf = geometria_local.ler_geometrias(pasta, NOME_CAMADA, ano)
+    municipios_gdf = municipios_gdf[COLUNAS_TILES + ['geometry']].copy()
+    municipios_gdf['code_muni'] = municipios_gdf['code_muni'].astype('int64')
+
+    caminho = caminho_mbtiles(pasta, ano)
+    # Arquivo temporário com a extensão '.mbtiles' (o GDAL escolhe o formato pela extensão)
+    caminho_tmp = os.path.join(pasta, f".{NOME_CAMADA}_br_{ano}.tmp-{os.getpid()}.mbtiles")
+    try:
+        municipios_gdf.to_file(
+            caminho_tmp, driver='MBTiles', layer=NOME_CAMADA,
+            dataset_options={
+                'NAME': f"Municípios do Brasil ({ano})",
+                'TYPE': 'overlay',
+                'MINZOOM': str(zoom_minimo),
+                'MAXZOOM': str(zoom_maximo),
+            },
+        )
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+    return caminho
+
+
+class LeitorMBTiles:
+    """
+    Leitura dos tiles de um arquivo MBTiles. O SQLite não compartilha conexões entre threads,
+    então cada thread do servidor abre a sua (somente leitura).
+    """
+
+    def __init__(self, caminho):
+        if not os.path.exists(caminho):
+            raise FileNotFoundError(f"Arquivo de tiles '{caminho}' não encontrado. Gere-o com: tiles_vetoriais.py gerar")
+        self.caminho = caminho
+        self._local = threading.local()
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(f"file:{self.caminho}?mode=ro", uri=True)
+            self._local.conexao = conexao
+        return conexao
+
+    def metadados(self):
+        return dict(self._conexao().execute("SELECT name, value FROM metadata").fetchall())
+
+    def ler_tile(self, z, x, y):
+        """Bytes do tile (z, x, y) no esquema XYZ do Leaflet, ou None se o tile não existir."""
+        # O MBTiles numera as linhas no esquema TMS (de baixo para cima)
+        linha = self._conexao().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return linha[0] if linha else None
+
+
+class _ManipuladorTiles(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        rota = _ROTA_TILE.match(self.path.split('?', 1)[0])
+        if rota is None:
+            self.send_error(404)
+            return
+        z, x, y = (int(parte) for parte in rota.groups())
+        tile = self.server.leitor.ler_tile(z, x, y)
+        if tile is None:
+            # Tile sem municípios (ex: oceano): resposta vazia, o VectorGrid apenas não desenha nada
+            self.send_response(204)
+            self._cabecalhos_comuns()
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.mapbox-vector-tile')
+        if tile[:2] == b'\x1f\x8b': # O GDAL grava os tiles compactados com gzip
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(tile)))
+        self._cabecalhos_comuns()
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def _cabecalhos_comuns(self):
+        # O mapa roda em um iframe do Streamlit, em outra origem
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'public, max-age=86400')
+
+    def log_message(self, formato, *args):
+        pass # Sem uma linha de log por tile
+
+
+def iniciar_servidor(caminho, host=HOST_PADRAO, porta=None):
+    """
+    Inicia o servidor de tiles em uma thread de segundo plano e retorna o servidor.
+    Sem 'porta', usa PAINEL_IDEB_PORTA_TILES (padrão 8765); se ela estiver ocupada,
+    o sistema escolhe uma porta livre.
+    """
+    leitor = LeitorMBTiles(caminho)
+    if porta is None:
+        porta = int(os.environ.get('PAINEL_IDEB_PORTA_TILES', PORTA_PADRAO))
+    try:
+        servidor = ThreadingHTTPServer((host, porta), _ManipuladorTiles)
+    except OSError:
+        servidor = ThreadingHTTPServer((host, 0), _ManipuladorTiles)
+    servidor.daemon_threads = True
+    servidor.leitor = leitor
+    threading.Thread(target=servidor.serve_forever, name='servidor-tiles', daemon=True).start()
+    return servidor
+
+
+def url_tiles(servidor):
+    """Modelo de URL dos tiles para o Leaflet ({z}/{x}/{y}), ou o informado em PAINEL_IDEB_URL_TILES."""
+    url = os.environ.get('PAINEL_IDEB_URL_TILES')
+    if url:
+        return url
+    host, porta = servidor.server_address[:2]
+    return f"http://{host}:{porta}/{NOME_CAMADA}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+def tiles_acessiveis(host_painel):
+    """
+    Indica se o navegador que abriu o painel alcança os tiles: há uma URL pública em
+    PAINEL_IDEB_URL_TILES ou o painel foi aberto na própria máquina ('host_painel' é o
+    cabeçalho Host da requisição; None quando não há navegador, ex: testes).
+    """
+    if os.environ.get('PAINEL_IDEB_URL_TILES'):
+        return True
+    if host_painel is None:
+        return True
+    return urlsplit(f"//{host_painel}").hostname in HOSTS_LOCAIS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera e serve os tiles vetoriais (MVT) dos municípios do Brasil.")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    gerar = subcomandos.add_parser('gerar', help="Grava a pirâmide de tiles em municipios_br_<ano>.mbtiles.")
+    servir = subcomandos.add_parser('servir', help="Serve os tiles do arquivo MBTiles por HTTP.")
+    for subparser in (gerar, servir):
+        subparser.add_argument('pasta', help="Pasta com os arquivos municipios_br_<ano>.*")
+        subparser.add_argument('ano', type=int)
+    gerar.add_argument('--zoom-minimo', type=int, default=ZOOM_MINIMO)
+    gerar.add_argument('--zoom-maximo', type=int, default=ZOOM_MAXIMO)
+    servir.add_argument('--host', default=HOST_PADRAO)
+    servir.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    args = parser.parse_args()
+
+    if args.comando == 'gerar':
+        caminho = gerar_mbtiles(args.pasta, args.ano, args.zoom_minimo, args.zoom_maximo)
+        with sqlite3.connect(caminho) as conexao:
+            niveis = conexao.execute(
+                "SELECT zoom_level, COUNT(*), SUM(LENGTH(tile_data)) FROM tiles GROUP BY zoom_level ORDER BY zoom_level"
+            ).fetchall()
+        for zoom, quantidade, tamanho in niveis:
+            print(f"Zoom {zoom}: {quantidade} tiles, {tamanho / 1024:.0f} KB")
+        print(f"Tiles gravados em {caminho} ({os.path.getsize(caminho) / 1024 / 1024:.1f} MB)")
+    else:
+        caminho = caminho_mbtiles(args.pasta, args.ano)
+        servidor = ThreadingHTTPServer((args.host, args.porta), _ManipuladorTiles)
+        servidor.leitor = LeitorMBTiles(caminho)
+        print(f"Servindo {caminho} em {url_tiles(servidor)} (Ctrl+C para encerrar)")
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()